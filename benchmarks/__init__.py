@@ -0,0 +1,12 @@
+# -*- coding: utf-8 -*-
+"""
+    benchmarks
+
+    Performance benchmarks of monstor. Every module can be run on its own,
+    for example::
+
+        python -m benchmarks.bench_dates
+
+    :copyright: (c) 2012 by Openlabs Technologies & Consulting (P) Limited
+    :license: BSD, see LICENSE for more details.
+"""
@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+"""
+    bench_auth
+
+    Load benchmark of the `monstor.contrib.auth` endpoints
+
+    The application is built with :func:`monstor.app.make_app` and served by
+    a separate process, against the MongoDB database `bench_database` which
+    is emptied first. Each scenario is driven by `bench_concurrency`
+    concurrent clients and the requests per second and the latency
+    percentiles are reported::
+
+        python -m benchmarks.bench_auth --bench_requests=2000
+
+    Save the results as the baseline with `--bench_save_baseline` and
+    compare later runs against it with `--bench_baseline=baseline.json`.
+    The benchmark then exits with status 1 if the throughput of a scenario
+    dropped or its latency grew by more than `bench_tolerance`, so it can
+    gate a release.
+
+    :copyright: (c) 2012 by Openlabs Technologies & Consulting (P) Limited
+    :license: BSD, see LICENSE for more details.
+"""
+import os
+import sys
+import json
+import time
+import functools
+import itertools
+import multiprocessing
+from urllib import urlencode
+
+import tornado.web
+from tornado.ioloop import IOLoop
+from tornado.httpclient import AsyncHTTPClient, HTTPRequest
+from tornado.options import define, options, parse_command_line
+from itsdangerous import URLSafeSerializer
+
+from monstor.utils.stats import summarize
+from monstor.utils.web import BaseHandler
+
+define("bench_database", default="monstor_bench_auth",
+    help="Database used (and emptied) by the benchmark")
+define("bench_requests", type=int, default=1000,
+    help="Requests measured for each scenario")
+define("bench_warmup", type=int, default=50,
+    help="Requests sent before the measure of each scenario")
+define("bench_concurrency", type=int, default=10,
+    help="Concurrent requests")
+define("bench_users", type=int, default=100,
+    help="Users created for the login, activation and reset scenarios")
+define("bench_scenarios", multiple=True,
+    default=["login", "registration", "activation", "reset-password"],
+    help="Scenarios to run")
+define("bench_template_path", default=os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        "test", "contrib", "templates"
+    ), help="Templates of the auth views")
+define("bench_baseline", default="benchmarks/bench_auth.json",
+    help="Baseline file the results are compared to or saved in")
+define("bench_save_baseline", type=bool, default=False,
+    help="Save the results as the baseline")
+define("bench_tolerance", type=float, default=0.1,
+    help="Relative change tolerated against the baseline")
+
+COOKIE_SECRET = 'bench-cookie-secret'
+PASSWORD = 'password'
+
+
+class HomeHandler(BaseHandler):
+    def get(self):
+        self.write("Home")
+
+
+class urls(object):
+    """Makes this module an app which provides the `home` URL the auth
+    views redirect to
+    """
+    HANDLERS = [
+        tornado.web.URLSpec(r'/', HomeHandler, name='home'),
+    ]
+
+
+def user_email(n):
+    return 'user%d@bench.example.com' % (n % options.bench_users)
+
+
+def login_request(base_url, n):
+    return HTTPRequest(
+        base_url + '/login', method='POST', follow_redirects=False,
+        body=urlencode({'email': user_email(n), 'password': PASSWORD})
+    )
+
+
+def registration_request(base_url, n):
+    return HTTPRequest(
+        base_url + '/registration', method='POST', follow_redirects=False,
+        body=urlencode({
+            'name': 'Bench User %d' % n,
+            'email': 'new%d-%d@bench.example.com' % (os.getpid(), n),
+            'password': PASSWORD, 'confirm_password': PASSWORD,
+        })
+    )
+
+
+def activation_request(base_url, n):
+    key = URLSafeSerializer(COOKIE_SECRET).dumps(user_email(n))
+    return HTTPRequest(
+        base_url + '/activation/' + key, follow_redirects=False
+    )
+
+
+def reset_password_request(base_url, n):
+    return HTTPRequest(
+        base_url + '/reset-password?' + urlencode({
+            'email': user_email(n),
+            'reset_key': 'key%d' % (n % options.bench_users),
+        }), follow_redirects=False
+    )
+
+
+#: The scenarios as (name, request factory, expected status codes)
+SCENARIOS = [
+    ('login', login_request, (302,)),
+    ('registration', registration_request, (302,)),
+    ('activation', activation_request, (302,)),
+    ('reset-password', reset_password_request, (200,)),
+]
+
+
+def serve(port, ready):
+    """Builds the application, creates the users of the scenarios and
+    serves the application on the port. Runs in the server process.
+    """
+    from monstor.app import make_app
+    from monstor.contrib.auth.models import User
+
+    options.database = options.bench_database
+    application = make_app(
+        installed_apps=['monstor.contrib.auth', __name__],
+        template_path=options.bench_template_path,
+        cookie_secret=COOKIE_SECRET,
+        xsrf_cookies=False,
+    )
+    User.drop_collection()
+    for n in xrange(options.bench_users):
+        user = User(
+            name='User %d' % n, email=user_email(n), active=True,
+            reset_key='key%d' % n
+        )
+        user.set_password(PASSWORD)
+        user.save(safe=True)
+    application.listen(port, address='127.0.0.1')
+    ready.set()
+    IOLoop.instance().start()
+
+
+def run_scenario(client, io_loop, base_url, factory, codes, count,
+        concurrency, offset=0):
+    """Sends `count` requests built by `factory` with `concurrency`
+    requests in flight and returns the elapsed time, the latency of each
+    request and the number of responses whose status is not in `codes`.
+    """
+    numbers = itertools.count(offset)
+    latencies = []
+    state = {'errors': 0, 'active': concurrency}
+
+    def issue():
+        n = numbers.next()
+        if n >= offset + count:
+            state['active'] -= 1
+            if not state['active']:
+                io_loop.stop()
+            return
+        client.fetch(
+            factory(base_url, n), functools.partial(done, time.time())
+        )
+
+    def done(start, response):
+        latencies.append(time.time() - start)
+        if response.code not in codes:
+            state['errors'] += 1
+        issue()
+
+    start = time.time()
+    for i in xrange(concurrency):
+        issue()
+    io_loop.start()
+    return time.time() - start, latencies, state['errors']
+
+
+def compare(results, baseline, tolerance):
+    """Returns the regressions of the results against the baseline as a
+    list of messages
+    """
+    regressions = []
+    for name, result in sorted(results.iteritems()):
+        if name not in baseline:
+            continue
+        base = baseline[name]
+        if result['rps'] < base['rps'] * (1 - tolerance):
+            regressions.append("%s: %.1f requests/s, baseline %.1f" % (
+                name, result['rps'], base['rps']
+            ))
+        for percentile in ('p95', 'p99'):
+            if result[percentile] > base[percentile] * (1 + tolerance):
+                regressions.append("%s: %s %.2f ms, baseline %.2f ms" % (
+                    name, percentile, result[percentile] * 1000,
+                    base[percentile] * 1000
+                ))
+    return regressions
+
+
+def main():
+    parse_command_line()
+    port = 18000 + os.getpid() % 1000
+    base_url = 'http://127.0.0.1:%d' % port
+
+    ready = multiprocessing.Event()
+    server = multiprocessing.Process(target=serve, args=(port, ready))
+    server.start()
+    try:
+        while not ready.is_set():
+            if not server.is_alive():
+                print "The server did not start"
+                return 2
+            ready.wait(0.5)
+
+        io_loop = IOLoop.instance()
+        client = AsyncHTTPClient(
+            io_loop, max_clients=options.bench_concurrency,
+            force_instance=True
+        )
+        results = {}
+        print "%-16s %8s %7s %10s %9s %9s %9s" % (
+            'scenario', 'requests', 'errors', 'requests/s',
+            'p50 ms', 'p95 ms', 'p99 ms'
+        )
+        for name, factory, codes in SCENARIOS:
+            if name not in options.bench_scenarios:
+                continue
+            run_scenario(
+                client, io_loop, base_url, factory, codes,
+                options.bench_warmup, options.bench_concurrency
+            )
+            elapsed, latencies, errors = run_scenario(
+                client, io_loop, base_url, factory, codes,
+                options.bench_requests, options.bench_concurrency,
+                offset=options.bench_warmup
+            )
+            summary = summarize(latencies, (50, 95, 99))
+            result = results[name] = {
+                'requests': len(latencies),
+                'errors': errors,
+                'rps': len(latencies) / elapsed,
+                'p50': summary['p50'],
+                'p95': summary['p95'],
+                'p99': summary['p99'],
+            }
+            print "%-16s %8d %7d %10.1f %9.2f %9.2f %9.2f" % (
+                name, result['requests'], errors, result['rps'],
+                result['p50'] * 1000, result['p95'] * 1000,
+                result['p99'] * 1000
+            )
+    finally:
+        server.terminate()
+        server.join()
+
+    if options.bench_save_baseline:
+        with open(options.bench_baseline, 'wb') as baseline_file:
+            json.dump(results, baseline_file, indent=2, sort_keys=True)
+        print "Saved the baseline to %s" % options.bench_baseline
+    elif os.path.exists(options.bench_baseline):
+        with open(options.bench_baseline, 'rb') as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = compare(results, baseline, options.bench_tolerance)
+        for regression in regressions:
+            print "REGRESSION %s" % regression
+        if regressions:
+            return 1
+        print "No regression against %s" % options.bench_baseline
+    if any(result['errors'] for result in results.itervalues()):
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""
+    bench_dates
+
+    Compare formatting dates directly with babel against the cached patterns
+    and the batch API of :class:`monstor.utils.locale.Locale`
+
+    :copyright: (c) 2012 by Openlabs Technologies & Consulting (P) Limited
+    :license: BSD, see LICENSE for more details.
+"""
+import timeit
+from datetime import datetime, timedelta
+
+from babel import dates
+from monstor.utils.locale import Locale
+
+VALUES = [datetime(2012, 1, 1) + timedelta(hours=7 * i) for i in xrange(1000)]
+LOCALE = Locale.parse('pt_BR')
+TIMEZONE = 'Asia/Kolkata'
+
+
+def babel_format_datetime():
+    # babel expects a tzinfo object
+    tzinfo = dates.get_timezone(TIMEZONE)
+    return [
+        dates.format_datetime(value, 'medium', tzinfo, LOCALE)
+        for value in VALUES
+    ]
+
+
+def locale_format_datetime():
+    return [
+        LOCALE.format_datetime(value, 'medium', TIMEZONE)
+        for value in VALUES
+    ]
+
+
+def locale_format_datetimes():
+    return LOCALE.format_datetimes(VALUES, 'medium', TIMEZONE)
+
+
+def main(repeat=5, number=3):
+    results = []
+    for name, func in [
+            ('babel.dates.format_datetime', babel_format_datetime),
+            ('Locale.format_datetime', locale_format_datetime),
+            ('Locale.format_datetimes', locale_format_datetimes)]:
+        best = min(timeit.repeat(func, repeat=repeat, number=number))
+        per_value = best / (number * len(VALUES)) * 1e6
+        results.append((name, per_value))
+    baseline = results[0][1]
+    for name, per_value in results:
+        print "%-30s %8.2f us/value %6.2fx" % (
+            name, per_value, baseline / per_value
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+"""
+    bench_helpers
+
+    Microbenchmarks of the helpers which run on every request: slugify,
+    the locale negotiation, the flash message cookie, the form arguments and
+    the pagination links::
+
+        python -m benchmarks.bench_helpers
+        python -m benchmarks.bench_helpers --bench_filter=slugify \\
+            --bench_json=benchmarks/helpers.jsonl
+
+    For each benchmark the best time per call (ns/op) and the allocations
+    per call (allocs/op) are reported. The allocations are the memory blocks
+    a call leaves allocated where `sys.getallocatedblocks` exists. Python 2
+    has no such counter, so there allocs/op is the number of objects
+    tracked by the garbage collector (containers and instances) which a
+    call leaves behind, the returned value and the uncollected cycles
+    included. It does not count the strings and numbers, nor the objects
+    freed during the call, so it is a lower bound which is useful to
+    compare the runs of a benchmark rather than two benchmarks.
+
+    With `bench_json` the results are appended to the file as one JSON
+    document per run, so they can be tracked over time.
+
+    :copyright: (c) 2012 by Openlabs Technologies & Consulting (P) Limited
+    :license: BSD, see LICENSE for more details.
+"""
+import gc
+import sys
+import json
+import timeit
+import platform
+from StringIO import StringIO
+from datetime import datetime
+from urllib import urlencode
+
+from tornado.web import Application
+from tornado.wsgi import HTTPRequest
+from tornado.options import define, options, parse_command_line
+
+from monstor.utils import locale
+from monstor.utils.web import BaseHandler, Pagination, slugify, slugify_all
+from monstor.utils.wtforms import TornadoMultiDict
+
+define("bench_filter", default=None,
+    help="Run only the benchmarks whose name contains this")
+define("bench_min_time", type=float, default=0.2,
+    help="Minimum time (in seconds) of each timed run")
+define("bench_repeat", type=int, default=5,
+    help="Timed runs of each benchmark, the best one is reported")
+define("bench_json", default=None,
+    help="File the results are appended to as a JSON document")
+
+TITLES = {
+    'ascii': u"Monstor 0.1 released: faster startup, lazy views & more!",
+    'latin': u"Crème brûlée à la française – São Paulo, Zürich & Málaga",
+    'cjk': u"東京でのミーティング 2012年6月 議事録",
+}
+
+ACCEPT_LANGUAGES = {
+    'simple': "en-US,en;q=0.8",
+    'browser': "pt-BR,pt;q=0.8,en-US;q=0.6,en;q=0.4",
+    'long': "fr-CH, fr;q=0.9, de-DE;q=0.8, de;q=0.7, it;q=0.6, "
+        "es-ES;q=0.5, es;q=0.4, en-GB;q=0.3, en;q=0.2, *;q=0.1",
+}
+
+FLASH_MESSAGES = {
+    'info': [u"Thank you for registering Jane Doe"],
+    'warning': [u"Your password expires in 3 days",
+        u"Please verify your email address"],
+}
+
+COOKIE_SECRET = 'bench-cookie-secret'
+
+
+def make_request(headers=None, arguments=None):
+    """Returns a GET request with the given headers and query arguments"""
+    environ = {
+        'REQUEST_METHOD': 'GET',
+        'PATH_INFO': '/',
+        'QUERY_STRING': urlencode(arguments or [], True),
+        'SERVER_NAME': 'localhost',
+        'SERVER_PORT': '80',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': StringIO(),
+    }
+    for name, value in (headers or {}).iteritems():
+        environ['HTTP_' + name.upper().replace('-', '_')] = value
+    return HTTPRequest(environ)
+
+
+def make_handler(headers=None, arguments=None):
+    """Returns a :class:`BaseHandler` for a GET request with the given
+    headers and query arguments
+    """
+    application = Application(cookie_secret=COOKIE_SECRET)
+    return BaseHandler(application, make_request(headers, arguments))
+
+
+class PageCount(object):
+    """Stands for a query set of `count` documents in a :class:`Pagination`,
+    which only needs the count to build the links
+    """
+
+    def __init__(self, count):
+        self._count = count
+
+    def count(self):
+        return self._count
+
+
+def benchmarks():
+    """Returns the benchmarks as a list of (name, callable)"""
+    result = []
+
+    for name, title in sorted(TITLES.iteritems()):
+        result.append((
+            'slugify[%s]' % name, lambda title=title: slugify(title)
+        ))
+    titles = TITLES.values() * 10
+    result.append((
+        'slugify_all[%d]' % len(titles), lambda: slugify_all(titles)
+    ))
+
+    for name, header in sorted(ACCEPT_LANGUAGES.iteritems()):
+        handler = make_handler({'Accept-Language': header})
+        result.append((
+            'BaseHandler.get_browser_locale[%s]' % name,
+            handler.get_browser_locale
+        ))
+
+    for codes in [('en_US',), ('pt-br', 'pt'), ('fr-CH', 'fr', 'de_DE')]:
+        result.append((
+            'Locale.get_closest[%s]' % ','.join(codes),
+            lambda codes=codes: locale.Locale.get_closest(*codes)
+        ))
+
+    writer = make_handler()
+
+    def write_flash():
+        writer._new_cookies = []
+        writer.messages = FLASH_MESSAGES
+    result.append(('flash.serialize', write_flash))
+
+    writer.messages = FLASH_MESSAGES
+    cookie = writer._new_cookies[-1]['flash_messages'].OutputString(['path'])
+    reader = make_handler({'Cookie': cookie})
+
+    def read_flash():
+        reader._messages = None
+        return reader.messages
+    result.append(('flash.deserialize', read_flash))
+
+    # The decoded arguments are cached on the handler, so each call reads
+    # them from a new handler as the first form of a request does
+    application = Application(cookie_secret=COOKIE_SECRET)
+    request = make_request(arguments=[
+        ('field%d' % index, u'välue %d' % index) for index in xrange(20)
+    ] + [('tags', u'tag%d' % index) for index in xrange(10)])
+    for name in ('field10', 'tags', 'missing'):
+        result.append((
+            'TornadoMultiDict.getlist[%s]' % name,
+            lambda name=name: TornadoMultiDict(
+                BaseHandler(application, request)
+            ).getlist(name)
+        ))
+
+    for page, count in [(1, 200), (50, 10000), (5000, 1000000)]:
+        pagination = Pagination(page, 20, PageCount(count))
+        result.append((
+            'Pagination.iter_pages[%d/%d]' % (page, pagination.pages),
+            lambda pagination=pagination: list(pagination.iter_pages())
+        ))
+    return result
+
+
+if hasattr(sys, 'getallocatedblocks'):
+    ALLOCS_SOURCE = 'allocated_blocks'
+    count_objects = sys.getallocatedblocks
+else:
+    ALLOCS_SOURCE = 'gc_objects'
+    count_objects = lambda: len(gc.get_objects())
+
+
+def count_allocations(func, number=1000):
+    """Returns the number of blocks or objects (see :data:`ALLOCS_SOURCE`)
+    which a call of `func` leaves allocated. The returned values are kept
+    and the collector is disabled until the end of the count, so that the
+    values and the garbage cycles are included.
+    """
+    results = [None] * number
+    gc.collect()
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        start = count_objects()
+        for index in xrange(number):
+            results[index] = func()
+        end = count_objects()
+    finally:
+        if enabled:
+            gc.enable()
+    return float(end - start) / number
+
+
+def measure(func, min_time=0.2, repeat=5):
+    """Times `func` and returns the best time per call in nanoseconds, the
+    allocations per call and the number of calls per timed run
+    """
+    timer = timeit.Timer(func)
+    number = 1
+    while timer.timeit(number) < min_time:
+        number *= 2
+    best = min(timer.repeat(repeat, number))
+    return {
+        'ns_per_op': best / number * 1e9,
+        'allocs_per_op': count_allocations(func, min(number, 1000)),
+        'ops': number,
+    }
+
+
+def main():
+    parse_command_line()
+    results = []
+    print "%-45s %12s %10s" % ('benchmark', 'ns/op', 'allocs/op')
+    for name, func in benchmarks():
+        if options.bench_filter and options.bench_filter not in name:
+            continue
+        result = measure(func, options.bench_min_time, options.bench_repeat)
+        result['name'] = name
+        results.append(result)
+        print "%-45s %12.0f %10.1f" % (
+            name, result['ns_per_op'], result['allocs_per_op']
+        )
+    print "allocs/op: %s" % ALLOCS_SOURCE
+
+    if options.bench_json:
+        with open(options.bench_json, 'ab') as json_file:
+            json_file.write(json.dumps({
+                'timestamp': datetime.utcnow().isoformat(),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'allocs_source': ALLOCS_SOURCE,
+                'results': results,
+            }, sort_keys=True) + '\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
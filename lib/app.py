@@ -5,11 +5,19 @@
     :copyright: (c) 2012 by Openlabs Technologies & Consulting (P) LTD
     :license: BSD, see LICENSE for more details.
 """
+import time
+import logging
+
 from tornado import options
-from tornado.web import Application
-from mongoengine import connect
+from tornado.web import Application, ChunkedTransferEncoding
 
-from monstor.exc import InvalidRequestError
+from monstor.utils.transforms import CompressionTransform
+from monstor.utils.static import StaticManifest, StaticFileHandler
+from monstor.utils.imports import ImportProfiler
+from monstor.utils.db import connect_database
+from monstor.utils.locale import TranslationsWatcher
+from monstor.utils import metrics, queries
+from monstor.utils.web import URLSpec
 
 options.define("config", help="Config file relative path")
 options.define("login_url", default="/login", help="Login url for application")
@@ -17,15 +25,6 @@ options.define('cookie_secret', help="Secret for setting the secure cookie")
 options.define('address', default="127.0.0.1", help="Address to bind to")
 options.define('port', default=8000, type=int, help="Port to listen")
 
-# Database settings
-options.define("database", default=None, help="Database name")
-options.define("db_host", default="localhost",
-    help="Host name where mongod runs"
-)
-options.define("db_port", default=27017, help="Port where mongod listen to")
-options.define("db_username", help="Username to connect to MongoDB")
-options.define("db_password", help="Username to connect to Paassword")
-
 # SMTP settings
 options.define("smtp_server", help="Email host server address")
 options.define("smtp_port", help="Email host port number", default=25)
@@ -39,14 +38,22 @@ DEFAULT_SETTINGS = {
     'xsrf_cookies': True,
 }
 
+logger = logging.getLogger(__name__)
+
 def load_app(app_name):
     """
     Loads the application
 
+    Only the `urls` and `ui_modules` of the app are imported. The `models`
+    are imported by the handlers which use them and handlers declared with
+    :class:`monstor.utils.web.URLSpec` as dotted strings are imported on the
+    first request they serve. An app which needs to run code at startup
+    should import it from its `urls`.
+
     :param app_name: The string name of the module that needs to be imported
     :return: The list of handlers
     """
-    app = __import__(app_name, fromlist=['models', 'urls', 'ui_modules'])
+    app = __import__(app_name, fromlist=['urls', 'ui_modules'])
 
     handlers = []
     if hasattr(app, 'urls') and hasattr(app.urls, 'HANDLERS'):
@@ -59,6 +66,41 @@ def load_app(app_name):
     return handlers, ui_modules
 
 
+class StartupTimings(object):
+    """The time taken by each phase of :func:`make_app`, available as the
+    `startup_timings` attribute of the application built.
+    """
+
+    def __init__(self):
+        self.phases = []
+        self._last = time.time()
+
+    def mark(self, phase):
+        """Records the time since the previous mark as the phase"""
+        now = time.time()
+        self.phases.append((phase, now - self._last))
+        self._last = now
+
+    @property
+    def total(self):
+        return sum(seconds for phase, seconds in self.phases)
+
+    def as_dict(self):
+        """Returns the seconds taken by each phase and the `total`"""
+        timings = dict(self.phases)
+        timings['total'] = self.total
+        return timings
+
+    def log(self):
+        logger.info(
+            "Application built in %.1f ms (%s)", self.total * 1000,
+            ", ".join(
+                "%s: %.1f ms" % (phase, seconds * 1000)
+                for phase, seconds in self.phases
+            )
+        )
+
+
 def make_app(default_host='', transforms=None, wsgi=False, **settings):
     """
     Builds an instance of :class:`tornado.web.Application` and returns it 
@@ -68,39 +110,87 @@ def make_app(default_host='', transforms=None, wsgi=False, **settings):
     Remember that the modules are loaded in the order of the list and it
     affects the overall way the application works including how the URLs
     are resolved.
+
+    The time taken by each phase of the startup is logged and kept in the
+    `startup_timings` attribute (:class:`StartupTimings`) of the
+    application.
+
+    When the `reload_translations` option is set the changed translation
+    catalogs are reloaded by a
+    :class:`monstor.utils.locale.TranslationsWatcher`, kept in the
+    `translations_watcher` attribute of the application. It runs on the
+    IOLoop of the process, so pre-forked servers should leave the option
+    unset and start a watcher in each worker instead.
     """
+    timings = StartupTimings()
     options.parse_command_line()
     config_file = options.options.config
     if config_file:
         options.parse_config_file(config_file)
+    defined_options = len(options.options)
+    timings.mark('options')
 
-    app_settings = DEFAULT_SETTINGS
+    app_settings = dict(DEFAULT_SETTINGS)
     app_settings.update(settings)
 
     # XXX: Check again if DB must be loaded after or before apps
-    if not options.options.database:
-        raise InvalidRequestError("Database not specified in options")
-    connect(
-        options.options.database, host=options.options.db_host,
-        port=options.options.db_port, username=options.options.db_username,
-        password=options.options.db_password
-    )
+    connect_database()
+    timings.mark('database')
 
     handlers = []
     ui_modules = {}
-    for app_name in settings['installed_apps']:
-        app_handlers, app_ui_modules = load_app(app_name)
-        handlers.extend(app_handlers)
-        ui_modules.update(app_ui_modules)
+    with ImportProfiler(options.options.import_profile) as profiler:
+        for app_name in settings['installed_apps']:
+            app_handlers, app_ui_modules = load_app(app_name)
+            handlers.extend(app_handlers)
+            ui_modules.update(app_ui_modules)
+    profiler.report()
+    timings.mark('apps')
 
     app_settings.setdefault('ui_modules', {}).update(ui_modules)
 
+    # Resolve static assets through the manifest of `monstor_admin
+    # build_static` if one has been built
+    if app_settings.get('static_path') and \
+            'static_manifest' not in app_settings:
+        manifest = StaticManifest.load(app_settings['static_path'])
+        if manifest is not None:
+            app_settings['static_manifest'] = manifest
+            app_settings.setdefault('static_handler_class', StaticFileHandler)
+    timings.mark('static')
+
     # Parse the config file again because the modules might have introduced
     # additional options
-    if config_file:
+    if config_file and len(options.options) != defined_options:
         options.parse_config_file(config_file)
+        timings.mark('options_reparse')
+
+    if options.options.metrics:
+        metrics.instrument_pymongo()
+        if options.options.metrics_url:
+            handlers.insert(0, URLSpec(
+                options.options.metrics_url, metrics.MetricsHandler,
+                name='monstor.metrics'
+            ))
+
+    if options.options.profile_queries:
+        queries.install_profiler()
+
+    if transforms is None and options.options.compress:
+        transforms = [CompressionTransform, ChunkedTransferEncoding]
 
     application = Application(
         handlers, default_host, transforms, wsgi, **app_settings
     )
+    timings.mark('application')
+
+    application.translations_watcher = None
+    if options.options.reload_translations:
+        application.translations_watcher = TranslationsWatcher(
+            options.options.reload_translations
+        )
+        application.translations_watcher.start()
+
+    application.startup_timings = timings
+    timings.log()
     return application
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""
+    auth
+
+    User authentication app. The options are defined here rather than in
+    the views, so that they are known when the config file is parsed even
+    though the views are imported on the first request.
+
+    :copyright: (c) 2012 by Openlabs Technologies & Consulting (P) Limited
+    :license: BSD, see LICENSE for more details.
+"""
+from tornado.options import define
+
+define("require_activation", type=bool,
+    help="Email activation will be made mandatory for new manual\
+    registrations.", default=False)
+define("twitter_consumer_key", help="Twitter consumer key")
+define("twitter_consumer_secret", help="Twitter consumer secret")
+
+define("facebook_api_key", help="Facebook application API key")
+define("facebook_secret", help="Facebook application secret")
+
+define("signal_workers", type=int, default=4,
+    help="Threads of the pool which runs the deferred signal receivers")
+define("signal_queue_size", type=int, default=1000,
+    help="Events waiting for the workers beyond which new events are "
+        "dropped")
+
+define("login_audit", type=bool, default=False,
+    help="Record the logins in the audit trail and the user statistics")
+define("login_audit_interval", type=int, default=5,
+    help="Seconds between two writes of the login audit trail")
+define("login_audit_batch_size", type=int, default=500,
+    help="Login events after which the audit trail is written early")
+
+define("auth_api", type=bool, default=False,
+    help="Serve the JSON API of the authentication (/api/token, "
+        "/api/token/revoke and /api/registration)")
+define("api_token_max_age", type=int, default=30 * 24 * 3600,
+    help="Seconds the bearer tokens of the API are valid")
+define("api_token_revocation", type=bool, default=False,
+    help="Check the bearer tokens of the API against the revoked tokens")
+define("api_revocation_refresh", type=int, default=30,
+    help="Seconds the revoked tokens are cached by each process")
+
+define("oauth_max_clients", type=int, default=10,
+    help="Concurrent requests to the OAuth providers")
+define("oauth_connect_timeout", type=float, default=5.0,
+    help="Seconds to connect to an OAuth provider")
+define("oauth_request_timeout", type=float, default=15.0,
+    help="Seconds for a request to an OAuth provider")
+define("oauth_timeouts", multiple=True, default=[],
+    help="Timeouts of the hosts of OAuth providers as host=connect:request")
@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -*-
+"""
+    api
+
+    JSON API of the user authentication for the clients which are not
+    browsers
+
+    The clients get a signed bearer token from :class:`TokenHandler` and
+    send it in the `Authorization` header of their requests::
+
+        POST /api/token  {"email": "jane@example.com", "password": "..."}
+        -> {"token": "eyJ1Ijoi...", "expires_in": 2592000, ...}
+
+        GET /api/articles
+        Authorization: Bearer eyJ1Ijoi...
+
+    The token holds the id of the user and is validated from its signature
+    alone, without a query. The handlers of the API derive from
+    :class:`APIHandler`, whose `current_user` is the :class:`BearerToken`,
+    and are protected with :func:`token_required`.
+
+    A token is valid for `api_token_max_age` seconds. Set
+    `api_token_revocation` to honour the tokens revoked through
+    :class:`RevokeTokenHandler`: the revoked tokens which have not expired
+    yet are cached by each process and reloaded every
+    `api_revocation_refresh` seconds.
+
+    The handlers answer in JSON, render no page and set no cookie, so they
+    are not subject to the XSRF check.
+
+    The endpoints of this module (:class:`TokenHandler`,
+    :class:`RevokeTokenHandler` and :class:`RegistrationAPIHandler`) answer
+    404 unless the `auth_api` option is set, so an app only exposes them
+    when it opts in.
+
+    :copyright: (c) 2012 by Openlabs Technologies & Consulting (P) Limited
+    :license: BSD, see LICENSE for more details.
+"""
+import os
+import time
+import base64
+import httplib
+import functools
+from datetime import datetime, timedelta
+
+from tornado.web import HTTPError
+from tornado.options import options
+from itsdangerous import URLSafeTimedSerializer, BadSignature
+
+from monstor.exc import InvalidRequestError
+from monstor.utils.web import BaseHandler
+from monstor.utils.wtforms import TornadoMultiDict
+from monstor.utils.i18n import _
+from monstor.contrib.auth.signals import login_success, login_failure
+from monstor.contrib.auth.views import LoginForm, RegistrationForm, \
+    ActivationKeyMixin
+
+TOKEN_SALT = 'monstor.contrib.auth.api'
+
+
+class BearerToken(object):
+    """The claims of a valid bearer token"""
+
+    def __init__(self, user_id, token_id, locale=None, issued=None):
+        self.user_id = user_id
+        self.token_id = token_id
+        self.locale = locale
+        self.issued = issued
+
+    @property
+    def expires(self):
+        return self.issued + timedelta(seconds=options.api_token_max_age)
+
+
+class RevocationList(object):
+    """The ids of the revoked tokens which have not expired, reloaded from
+    the database when they are older than `api_revocation_refresh` seconds
+    """
+
+    def __init__(self):
+        self.token_ids = frozenset()
+        self.loaded = 0
+
+    def __contains__(self, token_id):
+        if time.time() - self.loaded > options.api_revocation_refresh:
+            self.load()
+        return token_id in self.token_ids
+
+    def load(self):
+        from monstor.contrib.auth.models import RevokedToken
+
+        self.token_ids = frozenset(
+            RevokedToken.objects(expires__gt=datetime.utcnow()).scalar(
+                'token_id'
+            )
+        )
+        self.loaded = time.time()
+
+    def revoke(self, token):
+        """Revokes the token in the database and in this process"""
+        from monstor.contrib.auth.models import RevokedToken
+
+        RevokedToken.objects(token_id=token.token_id).update_one(
+            set__expires=token.expires, upsert=True
+        )
+        self.token_ids = self.token_ids | frozenset([token.token_id])
+
+revocations = RevocationList()
+
+
+def create_token(secret, user):
+    """Returns a new bearer token for the user, signed with the secret"""
+    claims = {
+        'u': unicode(user.id),
+        'j': base64.urlsafe_b64encode(os.urandom(6)),
+    }
+    if user.locale:
+        claims['l'] = user.locale
+    return URLSafeTimedSerializer(secret, salt=TOKEN_SALT).dumps(claims)
+
+
+def load_token(secret, token):
+    """Returns the :class:`BearerToken` of a token or None if the token is
+    not signed with the secret or has expired
+    """
+    try:
+        claims, issued = URLSafeTimedSerializer(secret, salt=TOKEN_SALT).loads(
+            token, max_age=options.api_token_max_age, return_timestamp=True
+        )
+    except BadSignature:
+        return None
+    return BearerToken(
+        claims['u'], claims['j'], claims.get('l'), issued.replace(tzinfo=None)
+    )
+
+
+def token_required(method):
+    """Decorate the methods of an :class:`APIHandler` which need a valid
+    bearer token. Requests without one are answered with `401`.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if not self.current_user:
+            self.set_header('WWW-Authenticate', 'Bearer')
+            self.send_error_json(401, _("A valid bearer token is required"))
+            return
+        return method(self, *args, **kwargs)
+    return wrapper
+
+
+def form_errors(form):
+    """Returns the errors of the form as JSON serialisable text"""
+    return dict(
+        (name, [unicode(error) for error in errors])
+        for name, errors in form.errors.iteritems()
+    )
+
+
+class APIHandler(BaseHandler):
+    """Base of the handlers of the JSON API, authenticated by the bearer
+    token in the `Authorization` header
+    """
+
+    def create_token(self, user):
+        """Returns a new bearer token for the user"""
+        return create_token(self.application.settings["cookie_secret"], user)
+
+    def load_token(self, token):
+        return load_token(self.application.settings["cookie_secret"], token)
+
+    def get_current_user(self):
+        """
+        Returns the :class:`BearerToken` of the request, if valid
+        """
+        authorization = self.request.headers.get('Authorization', '')
+        scheme, _sep, token = authorization.partition(' ')
+        if scheme.lower() != 'bearer' or not token:
+            return None
+        bearer_token = self.load_token(token.strip())
+        if bearer_token is None:
+            return None
+        if options.api_token_revocation and \
+                bearer_token.token_id in revocations:
+            return None
+        return bearer_token
+
+    def get_user(self):
+        """
+        Loads the user of the bearer token of the request
+        """
+        if not self.current_user:
+            return None
+        User = self.get_user_model()
+        return User.objects.with_id(self.current_user.user_id)
+
+    def check_xsrf_cookie(self):
+        """The API is not authenticated by cookies"""
+        pass
+
+    def send_json(self, status_code, data):
+        self.set_status(status_code)
+        self.finish(data)
+
+    def send_error_json(self, status_code, message, **kwargs):
+        data = {'error': unicode(message)}
+        data.update(kwargs)
+        self.send_json(status_code, data)
+
+    def write_error(self, status_code, **kwargs):
+        self.finish({'error': httplib.responses.get(status_code, 'Error')})
+
+    def token_response(self, user):
+        """Returns the JSON answer with a new token for the user"""
+        return {
+            'token': self.create_token(user),
+            'token_type': 'Bearer',
+            'expires_in': options.api_token_max_age,
+            'user': {
+                'id': unicode(user.id), 'name': user.name,
+                'email': user.email,
+            },
+        }
+
+
+class AuthAPIHandler(APIHandler):
+    """Base of the endpoints of this module, which are only served when
+    the `auth_api` option is set
+    """
+
+    def prepare(self):
+        if not options.auth_api:
+            raise HTTPError(404)
+        super(AuthAPIHandler, self).prepare()
+
+
+class TokenHandler(AuthAPIHandler):
+    """Issues a bearer token in exchange for the email and password"""
+
+    def post(self):
+        User = self.get_user_model()
+        form = LoginForm(TornadoMultiDict(self))
+        if not form.validate():
+            self.send_error_json(
+                400, _("Invalid request"), errors=form_errors(form)
+            )
+            return
+        user = User.authenticate(form.email.data, form.password.data)
+        if not user:
+            login_failure.send(self)
+            self.send_error_json(401, _("The email or password is invalid"))
+            return
+        if options.require_activation and not user.active:
+            self.send_error_json(403, _("User not activated yet"))
+            return
+        login_success.send(self, user=user)
+        self.send_json(200, self.token_response(user))
+
+
+class RevokeTokenHandler(AuthAPIHandler):
+    """Revokes the bearer token of the request"""
+
+    @token_required
+    def post(self):
+        revocations.revoke(self.current_user)
+        self.set_status(204)
+        self.finish()
+
+
+class RegistrationAPIHandler(AuthAPIHandler, ActivationKeyMixin):
+    """Registers a user. A token is issued unless the account has to be
+    activated first.
+    """
+
+    def post(self):
+        User = self.get_user_model()
+        form = RegistrationForm(TornadoMultiDict(self))
+        if not form.validate():
+            self.send_error_json(
+                400, _("Invalid request"), errors=form_errors(form)
+            )
+            return
+        try:
+            user = User.register(
+                form.email.data, form.password.data,
+                company_name=form.company_name.data,
+                name=form.name.data,
+                active=not options.require_activation,
+            )
+        except InvalidRequestError:
+            # The unique index on the email is missing
+            self.send_error_json(
+                503, _("The registration is unavailable, try again later")
+            )
+            return
+        if user is None:
+            self.send_error_json(409, _("This email is already registered"))
+            return
+        if options.require_activation:
+            self.create_activation_key(user)
+            self.send_json(201, {
+                'user': {'id': unicode(user.id), 'active': False},
+            })
+            return
+        self.send_json(201, self.token_response(user))
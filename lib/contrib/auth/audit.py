@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+    audit
+
+    Login audit trail and login statistics
+
+    When the `login_audit` option is set the `login_success` and
+    `login_failure` signals are recorded in memory and written every
+    `login_audit_interval` seconds, or as soon as `login_audit_batch_size`
+    events are waiting, by the worker pool of the signals:
+
+    * the events are inserted in bulk in the capped collection of
+      :class:`monstor.contrib.auth.models.LoginEvent`
+    * the counters and last login times of the users are updated with one
+      atomic `$inc`/`$set` per user and batch, instead of saving (and
+      validating) the user on every login
+
+    A login thus costs neither a write nor a query on the request path.
+    The events waiting in memory are lost if the process dies.
+
+    :copyright: (c) 2012 by Openlabs Technologies & Consulting (P) Limited
+    :license: BSD, see LICENSE for more details.
+"""
+import functools
+from datetime import datetime
+
+from tornado import stack_context
+from tornado.ioloop import IOLoop, PeriodicCallback
+from tornado.options import options
+
+from monstor.utils.wtforms import TornadoMultiDict
+from monstor.contrib.auth.signals import login_success, login_failure, \
+    get_pool
+
+
+def coalesce(events):
+    """Returns the updates of the login statistics of a batch of events,
+    one per user, as a dict of `(user model, field, value)` identifying the
+    user to the keyword arguments of `update_one`. Failed logins are
+    attributed to the user of the email which was tried, if any.
+    """
+    updates = {}
+    for event in events:
+        if event['success']:
+            key = (event['user_model'], 'pk', event['user_id'])
+            count, last = 'inc__login_count', 'set__last_login'
+        elif event['email']:
+            key = (event['user_model'], 'email', event['email'])
+            count, last = 'inc__failed_login_count', 'set__last_failed_login'
+        else:
+            continue
+        update = updates.setdefault(key, {})
+        update[count] = update.get(count, 0) + 1
+        update[last] = max(update.get(last, event['created']),
+            event['created'])
+    return updates
+
+
+class LoginAudit(object):
+    """Buffers the login events and writes them in batches"""
+
+    def __init__(self, io_loop=None):
+        self.io_loop = io_loop
+        self.events = []
+        self._flusher = None
+
+    def on_success(self, sender, user=None, **kwargs):
+        self.record(sender, user, True)
+
+    def on_failure(self, sender, **kwargs):
+        self.record(sender, None, False)
+
+    def record(self, handler, user, success):
+        """Buffers the event of a login through the handler"""
+        if not options.login_audit:
+            return
+        if self._flusher is None:
+            self.start()
+        self.events.append({
+            'user_model': user.__class__ if user else \
+                handler.get_user_model(),
+            'user_id': user.id if user else None,
+            'email': user.email if user else self.get_email(handler),
+            'success': success,
+            'provider': handler.__class__.__name__,
+            'remote_ip': handler.request.remote_ip,
+            'user_agent': handler.request.headers.get('User-Agent'),
+            'created': datetime.utcnow(),
+        })
+        if len(self.events) >= options.login_audit_batch_size:
+            self.flush()
+
+    @staticmethod
+    def get_email(handler):
+        """Returns the email which was tried, from the form or the JSON
+        body of the request
+        """
+        emails = TornadoMultiDict(handler).getlist('email')
+        return emails[0] if emails else None
+
+    def start(self):
+        """Starts the periodic flush, on the first event so that it runs
+        in the worker processes
+        """
+        with stack_context.NullContext():
+            self._flusher = PeriodicCallback(
+                self.flush, options.login_audit_interval * 1000,
+                io_loop=self.io_loop or IOLoop.instance()
+            )
+            self._flusher.start()
+
+    def stop(self):
+        """Stops the periodic flush and flushes the waiting events"""
+        if self._flusher is not None:
+            self._flusher.stop()
+            self._flusher = None
+        self.flush()
+
+    def flush(self):
+        """Hands the waiting events to the worker pool"""
+        if self.events:
+            events, self.events = self.events, []
+            get_pool().submit(functools.partial(self.write, events))
+
+    def write(self, events):
+        """Inserts the events and updates the statistics of the users.
+        Runs in a worker thread.
+        """
+        from monstor.contrib.auth.models import LoginEvent
+
+        LoginEvent.objects.insert([
+            LoginEvent(
+                user_id=event['user_id'], email=event['email'],
+                success=event['success'], provider=event['provider'],
+                remote_ip=event['remote_ip'],
+                user_agent=event['user_agent'], created=event['created']
+            ) for event in events
+        ], load_bulk=False)
+        for (model, field, value), update in coalesce(events).iteritems():
+            model.objects(**{field: value}).update_one(**update)
+
+#: The audit the signals are connected to
+audit = LoginAudit()
+login_success.connect(audit.on_success)
+login_failure.connect(audit.on_failure)
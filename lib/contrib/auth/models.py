@@ -11,11 +11,22 @@ import urllib
 import hashlib
 import random
 import string
+import logging
 
 import pytz
+from pymongo import ASCENDING
+from pymongo.errors import DuplicateKeyError, OperationFailure
 from mongoengine import Document, ValidationError
-from mongoengine import StringField, EmailField, BooleanField
+from mongoengine import StringField, EmailField, BooleanField, IntField, \
+    DateTimeField, ObjectIdField
+from monstor.exc import InvalidRequestError
 from monstor.utils.i18n import _
+from monstor.utils.db import QuerySet
+
+#: The fields which identify a user, each with a unique sparse index
+IDENTITY_FIELDS = ('email', 'facebook_id', 'twitter_id')
+
+logger = logging.getLogger(__name__)
 
 
 class User(Document):
@@ -31,7 +42,9 @@ class User(Document):
     #: sets the same on the index. MongoDB considers NULL also as a unique
     #: value and that ends up being trouble.
     #: 
-    #: So this is manually implemented in :meth:validate
+    #: So this is manually implemented in :meth:validate, and enforced by a
+    #: sparse unique index for the writes which skip it (:meth:`provision`),
+    #: see :meth:`ensure_identity_indexes`
     email = EmailField(verbose_name=_("Email"))
     locale = StringField()
     timezone = StringField(
@@ -66,9 +79,23 @@ class User(Document):
     #: Presence of this key indicates that user has asked for password reset
     reset_key = StringField(verbose_name="Password Reset Key")
 
+    #: Login statistics, maintained by :mod:`monstor.contrib.auth.audit`
+    #: with atomic updates when the `login_audit` option is set
+    login_count = IntField(default=0)
+    last_login = DateTimeField()
+    failed_login_count = IntField(default=0)
+    last_failed_login = DateTimeField()
+
+    #: Set once the unique indexes of the identities are known to exist
+    _identity_indexes = False
+
+    #: The lookup indexes of the queries. The unique indexes, which do not
+    #: include the `_types` of the documents, are built by
+    #: :meth:`ensure_identity_indexes`.
     meta = {
-        'indexes': ['email', 'facebook_id', 'twitter_id'],
+        'indexes': list(IDENTITY_FIELDS),
         'allow_inheritance': True,
+        'queryset_class': QuerySet,
         }
 
     def validate(self):
@@ -87,6 +114,195 @@ class User(Document):
                         existing and existing[0] != self:
                     raise ValidationError("Duplicate %s: %s" % (field, value))
 
+    @classmethod
+    def ensure_identity_indexes(cls):
+        """
+        Creates the unique sparse indexes of the :data:`IDENTITY_FIELDS`
+        and checks that they exist. They are named `unique_<field>` since
+        a database may already have a non unique `<field>_1` index, which
+        has to be dropped (and the duplicates removed) for the unique one to
+        be built, see :meth:`migrate_identity_indexes`. Called before the
+        first write of the process which relies on the indexes, rather than
+        on import, so that loading the app does not touch the database.
+
+        :raises InvalidRequestError: if a unique index is missing
+        """
+        collection = cls._get_collection()
+        db_fields = [cls._fields[field].db_field for field in IDENTITY_FIELDS]
+        for db_field in db_fields:
+            try:
+                collection.ensure_index(
+                    [(db_field, ASCENDING)], unique=True, sparse=True,
+                    name='unique_%s' % db_field
+                )
+            except OperationFailure, exc:
+                # Duplicates or a conflicting index, reported below
+                logger.debug("Cannot build the unique index on %s: %s",
+                    db_field, exc)
+        unique = set(
+            index['key'][0][0]
+            for index in collection.index_information().itervalues()
+            if index.get('unique') and len(index['key']) == 1
+        )
+        missing = [field for field in db_fields if field not in unique]
+        if missing:
+            message = "The unique indexes on %s of the %s collection are " \
+                "missing, run `monstor_admin migrate_user_indexes`" % (
+                    ', '.join(missing), collection.name
+                )
+            logger.error(message)
+            raise InvalidRequestError(message)
+        User._identity_indexes = True
+
+    @classmethod
+    def migrate_identity_indexes(cls):
+        """
+        Drops the non unique indexes on each of the :data:`IDENTITY_FIELDS`
+        alone, which prevent the unique ones from being built, and builds
+        the unique indexes unless there are duplicates. The lookup indexes
+        of `meta` are left as they are.
+
+        :return: The values held by more than one user for each field, which
+                 have to be removed before the unique indexes can be built
+        """
+        collection = cls._get_collection()
+        duplicates = {}
+        for field in IDENTITY_FIELDS:
+            db_field = cls._fields[field].db_field
+            for name, index in collection.index_information().items():
+                if index['key'] == [(db_field, ASCENDING)] and \
+                        not index.get('unique'):
+                    collection.drop_index(name)
+            groups = collection.group(
+                [db_field], {db_field: {'$ne': None}}, {'count': 0},
+                'function (doc, out) { out.count++; }'
+            )
+            values = [
+                group[db_field] for group in groups if group['count'] > 1
+            ]
+            if values:
+                duplicates[field] = values
+        if not duplicates:
+            cls.ensure_identity_indexes()
+        return duplicates
+
+    @classmethod
+    def provision(cls, match, fields=None, defaults=None):
+        """
+        Finds the user matching the first of the `match` conditions which
+        matches one and updates it with `fields`, or creates it from
+        `fields` and `defaults`, as done by the federated logins::
+
+            user, previous = User.provision(
+                [{'facebook_id': data['id']}, {'email': data['email']}],
+                {'facebook_id': data['id'], 'facebook_link': data['link']},
+                {'name': data['name'], 'email': data['email']}
+            )
+
+        The conditions are tried in order with one find-and-modify each,
+        until one matches. A returning user found by the first condition
+        costs one round trip. Otherwise the user is inserted without the
+        queries of :meth:`validate`, so a new user costs one round trip per
+        condition and the insert. The unique indexes reject a user created
+        by a concurrent login with the same identity, and the conditions are
+        then tried once more to update it instead. The first call of the
+        process also checks the indexes (see
+        :meth:`ensure_identity_indexes`).
+
+        The servers supported have no `$setOnInsert`, so the new users
+        cannot be upserted with their `defaults` in one write.
+
+        :param match: Conditions identifying the user, in the order they
+                      are tried, as dictionaries of field values. Values
+                      which are dictionaries are used as query operators.
+                      The conditions with an empty value are skipped.
+        :param fields: Values set on the user whether it exists or not
+        :param defaults: Values of a new user only
+        :return: The user and, unless it was just created, the values of
+                 `fields` before the update
+        :raises ValidationError: if no condition has a value or `fields`
+                                 would take the identity of another user
+        :raises InvalidRequestError: if the unique indexes are missing
+        """
+        queries = []
+        for condition in match:
+            if not all(condition.itervalues()):
+                continue
+            query = dict(cls.objects._query)
+            for name, value in condition.iteritems():
+                field = cls._fields[name]
+                query[field.db_field] = value if isinstance(value, dict) \
+                    else field.to_mongo(value)
+            queries.append(query)
+        if not queries:
+            raise ValidationError("No identity to provision the user")
+
+        fields = fields or {}
+        update = dict(
+            (cls._fields[name].db_field, cls._fields[name].to_mongo(value))
+            for name, value in fields.iteritems()
+        )
+        if not User._identity_indexes:
+            cls.ensure_identity_indexes()
+        collection = cls._get_collection()
+        for attempt in xrange(2):
+            for query in queries:
+                try:
+                    if update:
+                        son = collection.find_and_modify(
+                            query, {'$set': update}
+                        )
+                    else:
+                        son = collection.find_one(query)
+                except OperationFailure, exc:
+                    # The unique indexes reject the update
+                    raise ValidationError(
+                        "The identity of the user belongs to another user: "
+                        "%s" % exc
+                    )
+                if son is not None:
+                    previous = cls._from_son(dict(son))
+                    son.update(update)
+                    return cls._from_son(son), dict(
+                        (name, getattr(previous, name)) for name in fields
+                    )
+
+            values = dict(defaults or {})
+            values.update(fields)
+            user = cls(**values)
+            super(User, user).validate()
+            try:
+                user.id = collection.insert(user.to_mongo(), safe=True)
+            except DuplicateKeyError:
+                # Created by a concurrent login, update it instead
+                continue
+            return user, None
+        raise ValidationError("Cannot provision the user %s" % match)
+
+    @classmethod
+    def register(cls, email, password, **values):
+        """
+        Registers a user with an email and a password, inserting the final
+        document in a single write. The unique index on the email rejects
+        an email which is already registered, instead of a query before.
+        The index is checked by :meth:`ensure_identity_indexes` before the
+        first registration of the process.
+
+        :param values: Values of the other fields of the user
+        :return: The new user or None if the email is already registered
+        :raises InvalidRequestError: if the unique index is missing
+        """
+        if not User._identity_indexes:
+            cls.ensure_identity_indexes()
+        user = cls(email=email, **values)
+        user.set_password(password)
+        super(User, user).validate()
+        try:
+            user.id = cls._get_collection().insert(user.to_mongo(), safe=True)
+        except DuplicateKeyError:
+            return None
+        return user
+
     def get_profile_picture(self):
         """
         Returns a profile picture either based on twitter, facebook or email
@@ -171,3 +387,47 @@ class User(Document):
             return utc_date
 
         return utc_date.astimezone(user_tz)
+
+    def get_login_history(self, limit=10):
+        """
+        Returns the latest login events of the user, most recent first
+        """
+        return LoginEvent.objects(user_id=self.id).order_by(
+            '-created'
+        ).limit(limit)
+
+
+class LoginEvent(Document):
+    """
+    A login attempt recorded by :mod:`monstor.contrib.auth.audit`. The
+    collection is capped so the oldest events are discarded first.
+    """
+    user_id = ObjectIdField()
+    email = StringField()
+    success = BooleanField(default=False)
+    #: The name of the handler class, which tells the login provider
+    provider = StringField()
+    remote_ip = StringField()
+    user_agent = StringField()
+    created = DateTimeField()
+
+    meta = {
+        'max_size': 50 * 1024 * 1024,
+        'indexes': ['user_id'],
+        'allow_inheritance': False,
+        }
+
+
+class RevokedToken(Document):
+    """
+    A bearer token of the API revoked before it expires. See
+    :mod:`monstor.contrib.auth.api`.
+    """
+    token_id = StringField(required=True, unique=True)
+    #: The time the token expires anyway, after which it is not checked
+    expires = DateTimeField(required=True)
+
+    meta = {
+        'indexes': ['expires'],
+        'allow_inheritance': False,
+        }
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+    oauth
+
+    The HTTP client of the OAuth and OpenID flows
+
+    The mixins of :mod:`tornado.auth` call `AsyncHTTPClient()` for every
+    request to the provider, without any control over the number of
+    concurrent requests or their timeouts. The handlers which derive from
+    :class:`OAuthClientMixin` make them use the :class:`OAuthHTTPClient`
+    shared by the process instead::
+
+        class GoogleHandler(OAuthClientMixin, BaseHandler,
+                tornado.auth.GoogleMixin):
+            ...
+
+    With this client:
+
+    * at most `oauth_max_clients` requests to the providers are in flight,
+      the others wait in a queue
+    * the requests which do not set their own timeouts time out after
+      `oauth_connect_timeout` and `oauth_request_timeout` seconds, or after
+      the timeouts given for the host of the provider in `oauth_timeouts`::
+
+        oauth_timeouts = ["graph.facebook.com=2:10", "api.twitter.com=2:5"]
+
+    * the connections are kept alive between the requests when pycurl is
+      installed and the curl client of tornado is used
+    * with the `metrics` option, the time spent waiting for the provider is
+      added to the request which made the call and to the histogram of the
+      host
+
+    :copyright: (c) 2012 by Openlabs Technologies & Consulting (P) Limited
+    :license: BSD, see LICENSE for more details.
+"""
+import logging
+import urlparse
+import functools
+import contextlib
+
+import tornado.auth
+from tornado import httpclient, stack_context
+from tornado.ioloop import IOLoop
+from tornado.options import options
+from tornado.simple_httpclient import SimpleAsyncHTTPClient
+
+try:
+    from tornado.curl_httpclient import CurlAsyncHTTPClient
+except ImportError:
+    CurlAsyncHTTPClient = None
+
+from monstor.exc import InvalidRequestError
+from monstor.utils import metrics
+
+logger = logging.getLogger(__name__)
+
+#: The timeouts of a request which leaves them to the client
+_DEFAULT_TIMEOUTS = (
+    httpclient.HTTPRequest('http://localhost/').connect_timeout,
+    httpclient.HTTPRequest('http://localhost/').request_timeout,
+)
+
+
+def parse_timeouts(values):
+    """Returns the `(connect, request)` timeouts of each host from the
+    `host=connect:request` values of the `oauth_timeouts` option
+    """
+    timeouts = {}
+    for value in values or []:
+        try:
+            host, timeout = value.split('=', 1)
+            connect, request = timeout.split(':', 1)
+            timeouts[host.strip()] = (float(connect), float(request))
+        except ValueError:
+            raise InvalidRequestError(
+                "Invalid oauth_timeouts value %r, use host=connect:request"
+                % value
+            )
+    return timeouts
+
+
+class OAuthHTTPClient(object):
+    """An asynchronous HTTP client with the timeouts of the providers,
+    a bound on the concurrent requests and latency metrics. It is used like
+    the `AsyncHTTPClient` it wraps.
+    """
+
+    def __init__(self, io_loop=None, max_clients=None, timeouts=None):
+        self.io_loop = io_loop or IOLoop.instance()
+        client_class = CurlAsyncHTTPClient or SimpleAsyncHTTPClient
+        self.client = client_class(
+            self.io_loop, max_clients=max_clients or options.oauth_max_clients,
+            force_instance=True
+        )
+        if timeouts is None:
+            timeouts = parse_timeouts(options.oauth_timeouts)
+        self.timeouts = timeouts
+
+    def get_timeouts(self, host):
+        """Returns the connect and request timeouts of the host"""
+        return self.timeouts.get(host) or (
+            options.oauth_connect_timeout, options.oauth_request_timeout
+        )
+
+    def fetch(self, request, callback, **kwargs):
+        """Fetches the request like `AsyncHTTPClient.fetch`. The timeouts of
+        the host are used unless the request sets its own.
+        """
+        if not isinstance(request, httpclient.HTTPRequest):
+            request = httpclient.HTTPRequest(url=request, **kwargs)
+        host = urlparse.urlsplit(request.url).hostname
+        connect_timeout, request_timeout = self.get_timeouts(host)
+        if request.connect_timeout == _DEFAULT_TIMEOUTS[0]:
+            request.connect_timeout = connect_timeout
+        if request.request_timeout == _DEFAULT_TIMEOUTS[1]:
+            request.request_timeout = request_timeout
+        self.client.fetch(
+            request, functools.partial(self._on_response, callback, host)
+        )
+
+    def _on_response(self, callback, host, response):
+        # Called in the stack context of the request which made the call
+        if response.error:
+            logger.warning(
+                "%s %s failed after %.1f ms: %s", response.request.method,
+                host, response.request_time * 1000, response.error
+            )
+        if options.metrics:
+            metrics.registry.observe(
+                'upstream_duration_seconds', host, response.request_time
+            )
+            record = metrics.current_record()
+            if record is not None:
+                record.timings['upstream'] += response.request_time
+        callback(response)
+
+    def close(self):
+        self.client.close()
+
+_clients = {}
+
+
+def get_client(io_loop=None):
+    """Returns the :class:`OAuthHTTPClient` of the IOLoop, created on the
+    first call so that it belongs to the worker process
+    """
+    io_loop = io_loop or IOLoop.instance()
+    client = _clients.get(io_loop)
+    if client is None:
+        client = _clients[io_loop] = OAuthHTTPClient(io_loop)
+    return client
+
+
+class _HTTPClientModule(object):
+    """Stands for :mod:`tornado.httpclient` in :mod:`tornado.auth`, with
+    the client of a handler
+    """
+
+    def __init__(self, handler):
+        self.handler = handler
+
+    def __getattr__(self, name):
+        return getattr(httpclient, name)
+
+    def AsyncHTTPClient(self, io_loop=None, **kwargs):
+        return self.handler.get_auth_http_client()
+
+
+class OAuthClientMixin(object):
+    """Makes the mixins of :mod:`tornado.auth` of a handler fetch through
+    :meth:`get_auth_http_client`. The mixins take the client from
+    :mod:`tornado.httpclient` when they need it, so it is replaced in
+    :mod:`tornado.auth` within a stack context of the request only, in
+    which all of its callbacks run. The other handlers and the callbacks
+    of other requests see the module unchanged.
+    """
+
+    def get_auth_http_client(self):
+        """Returns the client of the requests to the providers, the
+        :class:`OAuthHTTPClient` shared by the process by default
+        """
+        return get_client()
+
+    def _execute(self, transforms, *args, **kwargs):
+        with stack_context.StackContext(self._auth_http_client_context):
+            super(OAuthClientMixin, self)._execute(
+                transforms, *args, **kwargs
+            )
+
+    @contextlib.contextmanager
+    def _auth_http_client_context(self):
+        previous = tornado.auth.httpclient
+        tornado.auth.httpclient = _HTTPClientModule(self)
+        try:
+            yield
+        finally:
+            tornado.auth.httpclient = previous
@@ -4,10 +4,183 @@
 
     Create signals based on login success and login failure
 
+    The receivers connected with :func:`deferred` do not run while the
+    signal is sent but on a later iteration of the IOLoop, or on a bounded
+    pool of worker threads with `pool=True`, so that a slow receiver (an
+    audit log, an analytics call) does not delay the response of the login::
+
+        @deferred(login_success, pool=True)
+        def audit_login(sender, user):
+            AuditLog(user=user).save()
+
+    With a `batch_size` the events are dispatched in batches and the
+    receiver is called with a list of `(sender, kwargs)` instead, as soon as
+    the batch is full or `batch_interval` seconds after its first event::
+
+        @deferred(login_failure, batch_size=100, batch_interval=5)
+        def count_failures(events):
+            Stats.objects(name='login_failure').update_one(
+                inc__value=len(events), upsert=True
+            )
+
+    The request is over when a deferred receiver runs: it may read the
+    sender but must not write to its response.
+
     :copyright: (c) 2012 by Openlabs Technologies & Consulting (P) Limited
     :license: BSD, see LICENSE for more details.
 """
+import time
+import Queue
+import logging
+import threading
+import functools
+
 from blinker import signal
+from tornado import stack_context
+from tornado.ioloop import IOLoop
+from tornado.options import options
+
+logger = logging.getLogger(__name__)
 
 login_success = signal('monstor.contrib.auth.login.success')
 login_failure = signal('monstor.contrib.auth.login.failure')
+
+
+class WorkerPool(object):
+    """A fixed number of daemon threads which run the calls put in a
+    bounded queue. A call submitted while the queue is full is dropped
+    rather than blocking the IOLoop.
+    """
+
+    def __init__(self, workers, queue_size):
+        self.queue = Queue.Queue(queue_size)
+        self.dropped = 0
+        for index in xrange(workers):
+            thread = threading.Thread(target=self._work)
+            thread.daemon = True
+            thread.start()
+
+    def submit(self, callback):
+        """Queues the callback, returns False if it was dropped"""
+        try:
+            self.queue.put_nowait(callback)
+        except Queue.Full:
+            self.dropped += 1
+            logger.warning(
+                "Signal queue full, dropped %s (%d so far)",
+                callback, self.dropped
+            )
+            return False
+        return True
+
+    def _work(self):
+        while True:
+            callback = self.queue.get()
+            try:
+                callback()
+            except Exception:
+                logger.exception("Error in the deferred receiver %s", callback)
+            finally:
+                self.queue.task_done()
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Returns the worker pool shared by the deferred receivers, started
+    with `signal_workers` threads on the first call
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = WorkerPool(
+                options.signal_workers, options.signal_queue_size
+            )
+    return _pool
+
+
+class DeferredReceiver(object):
+    """Connected to a signal in place of `receiver` by :func:`deferred` and
+    queues the events the receiver is then called with.
+    """
+
+    def __init__(self, receiver, pool=False, batch_size=None,
+            batch_interval=None, io_loop=None):
+        self.receiver = receiver
+        self.pool = pool
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.io_loop = io_loop
+        self.events = []
+        self._timeout = None
+
+    def __call__(self, sender, **kwargs):
+        if not self.batch_size:
+            self.dispatch(functools.partial(self.receiver, sender, **kwargs))
+            return
+        self.events.append((sender, kwargs))
+        if len(self.events) >= self.batch_size:
+            self.flush()
+        elif self._timeout is None and self.batch_interval:
+            with stack_context.NullContext():
+                self._timeout = self.get_io_loop().add_timeout(
+                    time.time() + self.batch_interval, self.flush
+                )
+
+    def __repr__(self):
+        return '<DeferredReceiver %r>' % self.receiver
+
+    def get_io_loop(self):
+        return self.io_loop or IOLoop.instance()
+
+    def flush(self):
+        """Dispatches the events of the current batch"""
+        if self._timeout is not None:
+            self.get_io_loop().remove_timeout(self._timeout)
+            self._timeout = None
+        if self.events:
+            events, self.events = self.events, []
+            self.dispatch(functools.partial(self.receiver, events))
+
+    def dispatch(self, callback):
+        """Runs the callback on the worker pool or on the next iteration of
+        the IOLoop. The stack context of the request is not carried over, so
+        an error of the receiver is only logged.
+        """
+        if self.pool:
+            get_pool().submit(callback)
+            return
+        with stack_context.NullContext():
+            self.get_io_loop().add_callback(
+                functools.partial(self._run, callback)
+            )
+
+    def _run(self, callback):
+        try:
+            callback()
+        except Exception:
+            logger.exception("Error in the deferred receiver %r", self)
+
+
+def deferred(signal, pool=False, batch_size=None, batch_interval=None,
+        io_loop=None):
+    """A decorator which connects the receiver to the signal as a deferred
+    receiver. The receiver itself is returned unchanged and the
+    :class:`DeferredReceiver` is kept on it as `deferred_receiver`, for
+    :meth:`DeferredReceiver.flush` or to disconnect it.
+
+    :param pool: Run the receiver on the worker pool instead of the IOLoop
+    :param batch_size: Call the receiver with lists of up to this many
+                       events
+    :param batch_interval: Seconds after which an incomplete batch is
+                           dispatched
+    """
+    def decorator(receiver):
+        deferred_receiver = DeferredReceiver(
+            receiver, pool, batch_size, batch_interval, io_loop
+        )
+        signal.connect(deferred_receiver, weak=False)
+        receiver.deferred_receiver = deferred_receiver
+        return receiver
+    return decorator
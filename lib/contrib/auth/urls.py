@@ -7,28 +7,36 @@
     :copyright: (c) 2012 by Openlabs Technologies & Consulting (P) Limited
     :license: BSD, see LICENSE for more details.
 """
-import tornado.web
+from monstor.utils.web import URLSpec as U
+# Connects the login audit trail to the login signals
+from monstor.contrib.auth import audit
 
-from monstor.contrib.auth.views import (FacebookLoginHandler, GoogleHandler,
-    TwitterHandler, LoginHandler, LogoutHandler, RegistrationHandler,
-    AccountActivationHandler, ActivationKeyResendHandler,
-    SendPasswordResetKeyHandler, PasswordResetHandler)
-
-U = tornado.web.URLSpec
+#: The views are imported on the first request to one of the handlers
+V = 'monstor.contrib.auth.views.'
+A = 'monstor.contrib.auth.api.'
 
 HANDLERS = [
-    U(r'/auth/facebookgraph', FacebookLoginHandler, name="contrib.auth.facebook"),
-    U(r'/auth/google', GoogleHandler, name="contrib.auth.google"),
-    U(r'/auth/twitter', TwitterHandler, name="contrib.auth.twitter"),
-    U(r'/login', LoginHandler, name='contrib.auth.login'),
-    U(r'/logout', LogoutHandler, name='contrib.auth.logout'),
-    U(r'/registration', RegistrationHandler, name='contrib.auth.registration'),
-    U(r'/activation/([a-zA-Z0-9\._]+)', AccountActivationHandler,
+    U(r'/auth/facebookgraph', V + 'FacebookLoginHandler',
+        name="contrib.auth.facebook"),
+    U(r'/auth/google', V + 'GoogleHandler', name="contrib.auth.google"),
+    U(r'/auth/twitter', V + 'TwitterHandler', name="contrib.auth.twitter"),
+    U(r'/login', V + 'LoginHandler', name='contrib.auth.login'),
+    U(r'/logout', V + 'LogoutHandler', name='contrib.auth.logout'),
+    U(r'/registration', V + 'RegistrationHandler',
+        name='contrib.auth.registration'),
+    U(r'/activation/([a-zA-Z0-9\._]+)', V + 'AccountActivationHandler',
         name="contrib.auth.activation"),
-    U(r'/activation_resend', ActivationKeyResendHandler,
+    U(r'/activation_resend', V + 'ActivationKeyResendHandler',
         name="contrib.auth.activation_resend"),
 
-    U(r'/send-reset-key', SendPasswordResetKeyHandler, name='send.reset.key'),
-    U(r'/reset-password',
-        PasswordResetHandler, name='reset.password'),
+    U(r'/send-reset-key', V + 'SendPasswordResetKeyHandler',
+        name='send.reset.key'),
+    U(r'/reset-password', V + 'PasswordResetHandler', name='reset.password'),
+
+    # Only served with the auth_api option
+    U(r'/api/token', A + 'TokenHandler', name='contrib.auth.api.token'),
+    U(r'/api/token/revoke', A + 'RevokeTokenHandler',
+        name='contrib.auth.api.revoke'),
+    U(r'/api/registration', A + 'RegistrationAPIHandler',
+        name='contrib.auth.api.registration'),
 ]
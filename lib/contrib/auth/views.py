@@ -15,8 +15,8 @@ from email.mime.multipart import MIMEMultipart
 
 import tornado.web
 import tornado.auth
-from tornado.options import define, options
-from mongoengine import Q
+from tornado.options import options
+from mongoengine import ValidationError
 from wtforms import Form, TextField, PasswordField, validators
 from itsdangerous import URLSafeSerializer
 
@@ -24,16 +24,9 @@ from monstor.utils.wtforms import REQUIRED_VALIDATOR, EMAIL_VALIDATOR, \
     TornadoMultiDict
 from monstor.utils.web import BaseHandler
 from monstor.utils.i18n import _
+from monstor.exc import InvalidRequestError
 from monstor.contrib.auth.signals import login_success, login_failure
-
-define("require_activation", type=bool,
-    help="Email activation will be made mandatory for new manual\
-    registrations.", default=False)
-define("twitter_consumer_key", help="Twitter consumer key")
-define("twitter_consumer_secret", help="Twitter consumer secret")
-
-define("facebook_api_key", help="Facebook application API key")
-define("facebook_secret", help="Facebook application secret")
+from monstor.contrib.auth import oauth
 
 # pylint: disable=R0904
 # -- Too many public methods
@@ -141,21 +134,27 @@ class RegistrationHandler(BaseHandler, ActivationKeyMixin):
         User = self.get_user_model()
         form = RegistrationForm(TornadoMultiDict(self))
         if form.validate():
-            # First check if user exists
-            user = User.objects(email=form.email.data).first()
-            if user:
+            try:
+                user = User.register(
+                    form.email.data, form.password.data,
+                    company_name = form.company_name.data,
+                    name = form.name.data,
+                    active = not options.require_activation,
+                )
+            except InvalidRequestError:
+                # The unique index on the email is missing
+                self.flash(
+                    _("The registration failed, please try again later"),
+                    'error'
+                )
+                self.render('user/registration.html', registration_form=form)
+                return
+            if user is None:
                 self.flash(_(
                         "This email is already registered. Click on Sign In"
                     ), "warning"
                 )
             else:
-                user = User(
-                    company_name = form.company_name.data,
-                    name = form.name.data,
-                    email = form.email.data,
-                )
-                user.set_password(form.password.data)
-                user.save(safe=True)
                 if options.require_activation:
                     self.create_activation_key(user)
                     self.flash(
@@ -166,8 +165,6 @@ class RegistrationHandler(BaseHandler, ActivationKeyMixin):
                     self.redirect(self.reverse_url("home"))
                     return
                 else:
-                    user.active = True
-                    user.save()
                     self.flash(
                        _("Thank you for registering %(name)s", name=user.name),
                         'info'
@@ -252,7 +249,8 @@ class LogoutHandler(BaseHandler):
         self.redirect(self.application.reverse_url("home"))
 
 
-class GoogleHandler(BaseHandler, tornado.auth.GoogleMixin):
+class GoogleHandler(oauth.OAuthClientMixin, BaseHandler,
+        tornado.auth.GoogleMixin):
     """
     Google authentication
     """
@@ -277,19 +275,26 @@ class GoogleHandler(BaseHandler, tornado.auth.GoogleMixin):
             login_failure.send(self)
             self.flash(_("Login using Google failed, please try again"))
             self.redirect(self.application.reverse_url("contrib.auth.login"))
-            self.finish()
+            return
 
         logger.info(user_data)
 
-        user = User.objects(email=user_data['email']).first()
-        if user:
+        try:
+            user, previous = User.provision(
+                [{'email': user_data['email']}],
+                defaults={
+                    'name': user_data['name'], 'email': user_data['email']
+                }
+            )
+        except (ValidationError, InvalidRequestError), exc:
+            logger.warning("Cannot provision the Google user: %s", exc)
+            login_failure.send(self)
+            self.flash(_("Login using Google failed, please try again"))
+            self.redirect(self.application.reverse_url("contrib.auth.login"))
+            return
+        if previous is not None:
             self.flash(_("Welcome back %(name)s", name=user.name), 'info')
         else:
-            user = User(
-                name = user_data['name'],
-                email = user_data['email'],
-                )
-            user.save()
             self.flash(
                 _("Thank you for regsitering %(name)s", name=user.name)
             )
@@ -304,7 +309,8 @@ class GoogleHandler(BaseHandler, tornado.auth.GoogleMixin):
         )
 
 
-class TwitterHandler(BaseHandler, tornado.auth.TwitterMixin):
+class TwitterHandler(oauth.OAuthClientMixin, BaseHandler,
+        tornado.auth.TwitterMixin):
     """
     Twitter Authentication handler
     """
@@ -326,22 +332,39 @@ class TwitterHandler(BaseHandler, tornado.auth.TwitterMixin):
             login_failure.send(self)
             self.flash(_("Login using Twitter failed, please try again"))
             self.redirect(self.application.reverse_url("contrib.auth.login"))
-            self.finish()
+            return
 
         logging.info(user_data)
 
-        user = User.objects(twitter_username=user_data['username']).first()
-        if user:
+        # The users registered before the twitter id was stored are
+        # found by their username
+        try:
+            user, previous = User.provision(
+                [
+                    {'twitter_id': user_data['id_str']},
+                    {
+                        'twitter_username': user_data['username'],
+                        'twitter_id': {'$exists': False},
+                    },
+                ],
+                {
+                    'twitter_id': user_data['id_str'],
+                    'twitter_username': user_data['username'],
+                    'twitter_profile_picture':
+                        user_data['profile_image_url_https'],
+                    'twitter_description': user_data['description'],
+                },
+                {'name': user_data['name']}
+            )
+        except (ValidationError, InvalidRequestError), exc:
+            logger.warning("Cannot provision the Twitter user: %s", exc)
+            login_failure.send(self)
+            self.flash(_("Login using Twitter failed, please try again"))
+            self.redirect(self.application.reverse_url("contrib.auth.login"))
+            return
+        if previous is not None:
             self.flash(_("Welcome back %(name)s", name=user.name), 'info')
         else:
-            user = User(
-                name = user_data['name'],
-                twitter_id = user_data['id_str'],
-                twitter_username = user_data['username'],
-                twitter_profile_picture = user_data['profile_image_url_https'],
-                twitter_description = user_data['description'],
-                )
-            user.save()
             self.flash(
                 _("Thank you for registering %(name)s", name=user.name)
             )
@@ -365,7 +388,8 @@ class TwitterHandler(BaseHandler, tornado.auth.TwitterMixin):
         )
 
 
-class FacebookLoginHandler(BaseHandler, tornado.auth.FacebookGraphMixin):
+class FacebookLoginHandler(oauth.OAuthClientMixin, BaseHandler,
+        tornado.auth.FacebookGraphMixin):
     """Facebook Authentication"""
 
     @tornado.web.asynchronous
@@ -410,37 +434,44 @@ class FacebookLoginHandler(BaseHandler, tornado.auth.FacebookGraphMixin):
             login_failure.send(self)
             self.flash(_("Login using Facebook failed, please try again"))
             self.redirect(self.application.reverse_url("contrib.auth.login"))
-            self.finish()
-
+            return
 
-        user = User.objects(
-            Q(facebook_id=int(user_data['id'])) | Q(email=user_data['email'])
-        ).first()
 
-        if user:
+        # Links the facebook account to the user of the same email, unless
+        # that user is linked to another facebook account
+        try:
+            user, previous = User.provision(
+                [
+                    {'facebook_id': user_data['id']},
+                    {
+                        'email': user_data['email'],
+                        'facebook_id': {'$exists': False},
+                    },
+                ],
+                {
+                    'facebook_id': user_data['id'],
+                    'facebook_picture': user_data['picture'],
+                    'facebook_username': user_data['username'],
+                    'facebook_link': user_data['link'],
+                },
+                {'name': user_data['name'], 'email': user_data['email']}
+            )
+        except (ValidationError, InvalidRequestError), exc:
+            logger.warning("Cannot provision the Facebook user: %s", exc)
+            login_failure.send(self)
+            self.flash(_("Login using Facebook failed, please try again"))
+            self.redirect(self.application.reverse_url("contrib.auth.login"))
+            return
+        if previous is None:
+            self.flash(
+                _("Thank you for registering %(name)s", name=user.name)
+            )
+        else:
             self.flash(_("Welcome back %(name)s", name=user.name), 'info')
-            if not user.facebook_id:
-                user.facebook_id = user_data['id']
-                user.facebook_picture = user_data['picture']
-                user.facebook_username = user_data['username']
-                user.facebook_link = user_data['link']
-                user.save()
+            if not previous['facebook_id']:
                 self.flash(
                     _("Your facebook account is now connected to your account")
                 )
-        else:
-            user = User(
-                facebook_id = user_data['id'],
-                facebook_picture = user_data['picture'],
-                facebook_username = user_data['username'],
-                facebook_link = user_data['link'],
-                name = user_data['name'],
-                email = user_data['email']
-                )
-            user.save()
-            self.flash(
-                _("Thank you for registering %(name)s", name=user.name)
-            )
 
         self.set_secure_cookie("user", unicode(user.id))
         login_success.send(self, user=user)
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+    cache
+
+    Small in-process caches used by the request helpers
+
+    :copyright: (c) 2012 by Openlabs Technologies & Consulting (P) Limited
+    :license: BSD, see LICENSE for more details.
+"""
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """A bounded mapping which discards the least recently used entry once
+    `size` entries are stored. Hits and misses are counted so that the
+    effectiveness of the cache can be inspected with :meth:`stats`.
+
+    >>> cache = LRUCache(2)
+    >>> cache['a'] = 1
+    >>> cache['b'] = 2
+    >>> cache.get('a')
+    1
+    >>> cache['c'] = 3
+    >>> 'b' in cache
+    False
+    """
+
+    def __init__(self, size=128):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+
+    def get(self, key, default=None):
+        """Returns the value for key (marking it as recently used) or
+        `default` if the key is not cached.
+        """
+        try:
+            value = self._data.pop(key)
+        except KeyError:
+            self.misses += 1
+            return default
+        self._data[key] = value
+        self.hits += 1
+        return value
+
+    def __setitem__(self, key, value):
+        self._data.pop(key, None)
+        self._data[key] = value
+        while len(self._data) > self.size:
+            self._data.popitem(last=False)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def clear(self):
+        """Removes all the entries and resets the counters"""
+        self._data.clear()
+        self.hits = self.misses = 0
+
+    def stats(self):
+        """Returns a dictionary with the usage counters of the cache"""
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': float(self.hits) / lookups if lookups else 0.0,
+            'entries': len(self._data),
+            'size': self.size,
+        }
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+    db
+
+    Connection to MongoDB and read preferences of the queries
+
+    The connection is configured with the `db_*` options. On a replica set
+    (`db_replica_set`) queries still read from the primary, but read-mostly
+    queries can opt into the `db_read_preference` with
+    :func:`secondary_reads`, provided the model uses the :class:`QuerySet`
+    of this module::
+
+        class Article(Document):
+            meta = {'queryset_class': QuerySet}
+
+        articles = secondary_reads(Article.objects(published=True))
+
+    :copyright: (c) 2012 by Openlabs Technologies & Consulting (P) Limited
+    :license: BSD, see LICENSE for more details.
+"""
+from pymongo import ReadPreference
+from mongoengine import connection
+from mongoengine.queryset import QuerySet as BaseQuerySet
+from tornado.options import define, options
+
+from monstor.exc import InvalidRequestError
+
+#: The read preferences which can be used with :meth:`QuerySet.read_preference`
+READ_PREFERENCES = {
+    'primary': ReadPreference.PRIMARY,
+    'secondary': ReadPreference.SECONDARY,
+    'secondary_only': ReadPreference.SECONDARY_ONLY,
+}
+
+define("database", default=None, help="Database name")
+define("db_host", default="localhost",
+    help="Host name where mongod runs"
+)
+define("db_port", default=27017, help="Port where mongod listen to")
+define("db_username", help="Username to connect to MongoDB")
+define("db_password", help="Username to connect to Paassword")
+define("db_max_pool_size", type=int, default=10,
+    help="Maximum number of idle sockets kept open to each mongod")
+define("db_connect_timeout", type=int, default=None,
+    help="Timeout (in milliseconds) to establish a connection to mongod")
+define("db_socket_timeout", type=int, default=None,
+    help="Timeout (in milliseconds) of an operation on the database")
+define("db_replica_set", default=None,
+    help="Name of the replica set. db_host may list several host:port seeds "
+        "separated by commas")
+define("db_read_preference", default="primary",
+    help="Read preference (primary, secondary or secondary_only) of the "
+        "queries which opt into secondary reads, like the current user and "
+        "the pages of a Pagination")
+
+
+def connect_database():
+    """Connects mongoengine to the database configured by the `database` and
+    `db_*` options and returns the connection.
+    """
+    if not options.database:
+        raise InvalidRequestError("Database not specified in options")
+    if options.db_read_preference not in READ_PREFERENCES:
+        raise InvalidRequestError(
+            "Invalid db_read_preference %r" % options.db_read_preference
+        )
+
+    alias = connection.DEFAULT_CONNECTION_NAME
+    if alias in connection._connections:
+        return connection.get_connection(alias)
+
+    connection.register_connection(
+        alias, options.database, options.db_host, options.db_port,
+        username=options.db_username, password=options.db_password,
+    )
+    # register_connection of mongoengine 0.6 drops the arguments of the
+    # driver, but get_connection passes the settings on to it and opens a
+    # ReplicaSetConnection when replicaSet is given
+    settings = connection._connection_settings[alias]
+    settings['max_pool_size'] = options.db_max_pool_size
+    if options.db_connect_timeout:
+        settings['connectTimeoutMS'] = options.db_connect_timeout
+    if options.db_socket_timeout:
+        settings['socketTimeoutMS'] = options.db_socket_timeout
+    if options.db_replica_set:
+        settings['replicaSet'] = options.db_replica_set
+    return connection.get_connection(alias)
+
+
+class QuerySet(BaseQuerySet):
+    """A mongoengine query set whose read preference can be set per query.
+
+    The queries of a model read from the primary unless
+    :meth:`read_preference` is called on its query set.
+    """
+
+    def __init__(self, document, collection):
+        super(QuerySet, self).__init__(document, collection)
+        self._read_preference = ReadPreference.PRIMARY
+
+    def clone(self):
+        c = super(QuerySet, self).clone()
+        c._read_preference = self._read_preference
+        return c
+
+    def read_preference(self, preference):
+        """Sets the read preference of the query.
+
+        :param preference: One of the names in :data:`READ_PREFERENCES` or
+                           a :class:`pymongo.ReadPreference` value
+        """
+        self._read_preference = READ_PREFERENCES.get(preference, preference)
+        return self
+
+    @property
+    def _cursor_args(self):
+        cursor_args = super(QuerySet, self)._cursor_args
+        cursor_args['read_preference'] = self._read_preference
+        return cursor_args
+
+
+def secondary_reads(query_set):
+    """Returns a copy of the query set reading with the `db_read_preference`.
+    Query sets of models which do not use :class:`QuerySet` are returned as
+    such and read from the primary.
+    """
+    if isinstance(query_set, QuerySet):
+        return query_set.clone().read_preference(options.db_read_preference)
+    return query_set
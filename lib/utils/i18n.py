@@ -14,11 +14,47 @@
 """
 
 from __future__ import absolute_import
-from collections import deque
+import threading
+import contextlib
 from speaklater import is_lazy_string, make_lazy_string
 
 
-t = deque(maxlen=1)
+class _LocaleState(threading.local):
+    """The locale lookup of the request being processed by this thread"""
+    lookup = None
+
+_state = _LocaleState()
+
+
+@contextlib.contextmanager
+def locale_context(lookup):
+    """A context manager which makes `lookup`, a callable returning the
+    locale, the source of the locale for :func:`gettext` and
+    :func:`ngettext` within the block.
+
+    The lookup is called only when a string is translated. To make the
+    locale follow a request across asynchronous callbacks, enter the context
+    through a :class:`tornado.stack_context.StackContext` as
+    :class:`monstor.utils.web.BaseHandler` does::
+
+        with StackContext(functools.partial(locale_context, get_locale)):
+            ...
+    """
+    previous, _state.lookup = _state.lookup, lookup
+    try:
+        yield
+    finally:
+        _state.lookup = previous
+
+
+def get_locale():
+    """Returns the locale of the current context or None if no locale
+    context is active
+    """
+    if _state.lookup is None:
+        return None
+    return _state.lookup()
+
 
 def gettext(string, **variables):
     """Translates a string with the current locale and passes in the
@@ -29,21 +65,21 @@ def gettext(string, **variables):
         gettext(u'Hello World!')
         gettext(u'Hello %(name)s!', name='World')
     """
-    global t
-    if not t:
+    locale = get_locale()
+    if locale is None:
         return string % variables
-    return t[0].translate(string) % variables
+    return locale.translate(string) % variables
 
 
 def ngettext(singular, plural, n, **variables):
     """Translates a string with the current locale and passes it to the 
     ngettext API of the translations object
     """
-    global t
     variables.setdefault('num', n)
-    if not t:
+    locale = get_locale()
+    if locale is None:
         return (plural if n > 1 else singular) % variables
-    return t[0].ungettext(singular, plural, n) % variables
+    return locale.translate(singular, plural, n) % variables
 
 
 def make_lazy_gettext(lookup_func):
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+    imports
+
+    Measure the time spent importing modules
+
+    :copyright: (c) 2012 by Openlabs Technologies & Consulting (P) Limited
+    :license: BSD, see LICENSE for more details.
+"""
+import sys
+import time
+import logging
+import __builtin__
+
+from tornado.options import define
+
+define("import_profile", type=bool, default=False,
+    help="Log the time taken by the imports of the apps and handlers")
+
+logger = logging.getLogger(__name__)
+
+
+class ImportProfiler(object):
+    """A context manager which records the time taken by every import which
+    loads new modules within the block::
+
+        with ImportProfiler() as profiler:
+            __import__('monstor.contrib.auth.views')
+        profiler.report()
+
+    Each record holds the name of the imported module, the total time of
+    the import including the modules it imported and the time spent in the
+    module itself.
+
+    :param enabled: If False the profiler does nothing, which makes it easy
+                    to switch profiling with an option.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.records = []
+        self._stack = []
+        self._original_import = None
+
+    def __enter__(self):
+        if self.enabled:
+            self._original_import = __builtin__.__import__
+            __builtin__.__import__ = self._import
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.enabled:
+            __builtin__.__import__ = self._original_import
+
+    def _import(self, name, globals=None, locals=None, fromlist=None,
+            level=-1):
+        loaded = len(sys.modules)
+        self._stack.append(0.0)
+        start = time.time()
+        try:
+            return self._original_import(
+                name, globals, locals, fromlist, level
+            )
+        finally:
+            elapsed = time.time() - start
+            nested = self._stack.pop()
+            if self._stack:
+                self._stack[-1] += elapsed
+            if len(sys.modules) > loaded:
+                if fromlist:
+                    name = '%s (%s)' % (name, ', '.join(fromlist))
+                self.records.append((name, elapsed, elapsed - nested))
+
+    def report(self, limit=20):
+        """Logs the slowest imports and returns the records sorted by the
+        total time of the import
+        """
+        records = sorted(self.records, key=lambda r: r[1], reverse=True)
+        if self.enabled:
+            logger.info(
+                "Imported %d modules in %.1f ms", len(records),
+                sum(r[2] for r in records) * 1000
+            )
+            for name, total, own in records[:limit]:
+                logger.info(
+                    "%8.1f ms %8.1f ms  %s", total * 1000, own * 1000, name
+                )
+        return records
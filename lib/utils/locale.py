@@ -18,15 +18,34 @@
 import gettext
 import logging
 import os
+import threading
+import functools
+from datetime import datetime as datetime_, date as date_, time as time_
 
+import pytz
+from tornado.ioloop import IOLoop, PeriodicCallback
+from tornado.options import define
 from babel.support import Translations
 from babel.core import Locale as BabelCoreLocale
 from babel import dates, numbers
 
+from monstor.utils.cache import LRUCache
+
+define("reload_translations", type=int, default=0,
+    help="Seconds between the checks for changed translation catalogs, "
+        "which are then reloaded, 0 disables the reloading")
+
 _default_locale = "en_US"
 _translations = {}
 _supported_locales = frozenset([_default_locale])
 _use_gettext = False
+_gettext_source = None
+
+#: Number of translated messages memoized for each locale
+TRANSLATION_CACHE_SIZE = 1024
+
+#: Number of parsed date, time and number patterns cached for each locale
+PATTERN_CACHE_SIZE = 64
 
 
 def get(*locale_codes):
@@ -78,6 +97,7 @@ def load_gettext_translations(directory, domain):
     global _translations
     global _supported_locales
     global _use_gettext
+    global _gettext_source
     _translations = {}
     for lang in os.listdir(directory):
         if lang.startswith('.'):
@@ -100,9 +120,128 @@ def load_gettext_translations(directory, domain):
             continue
     _supported_locales = frozenset(_translations.keys() + [_default_locale])
     _use_gettext = True
+    _gettext_source = (directory, domain)
+    # Drop the locales which pin the previous translations
+    Locale._cache = {}
     logging.info("Supported locales: %s", sorted(_supported_locales))
 
 
+def install_translations(lang, translations):
+    """Installs the translations for the language, replacing the cached
+    locale of the language (and with it the memoized messages) in one step.
+    Requests which already hold the previous locale finish with it.
+    """
+    global _supported_locales
+    _translations[lang] = translations
+    _supported_locales = frozenset(_translations.keys() + [_default_locale])
+
+    cache = getattr(Locale, '_cache', {})
+    if lang in cache:
+        locale = Locale.parse(lang)
+        locale.translations = translations
+        locale.translation_cache = LRUCache(TRANSLATION_CACHE_SIZE)
+        cache[lang] = locale
+    logging.info("Installed translations for '%s'", lang)
+
+
+class TranslationsWatcher(object):
+    """Watches the catalogs loaded with :func:`load_gettext_translations` and
+    reloads the catalog of a language when its `.mo` file changes.
+
+    The modification times are checked periodically on the IOLoop. Changed
+    catalogs are loaded in a separate thread and installed on the IOLoop with
+    :func:`install_translations`, so neither the parsing of the catalogs nor
+    a restart of the process add latency to requests::
+
+        watcher = TranslationsWatcher(interval=10)
+        watcher.start()
+
+    :func:`monstor.app.make_app` starts a watcher when the
+    `reload_translations` option is set. Start the watcher after the worker
+    processes have been forked.
+    """
+
+    def __init__(self, interval=5, io_loop=None):
+        self.io_loop = io_loop or IOLoop.instance()
+        self._mtimes = {}
+        self._loading = set()
+        self._periodic_callback = PeriodicCallback(
+            self.check, interval * 1000, io_loop=self.io_loop
+        )
+
+    def start(self):
+        """Starts watching the catalogs"""
+        self._mtimes = self.scan()
+        self._periodic_callback.start()
+
+    def stop(self):
+        """Stops watching the catalogs"""
+        self._periodic_callback.stop()
+
+    def scan(self):
+        """Returns the modification time of the catalog of each language"""
+        if _gettext_source is None:
+            return {}
+        directory, domain = _gettext_source
+        mtimes = {}
+        for lang in os.listdir(directory):
+            path = os.path.join(directory, lang, 'LC_MESSAGES', domain + '.mo')
+            try:
+                mtimes[lang] = os.stat(path).st_mtime
+            except OSError:
+                continue
+        return mtimes
+
+    def check(self):
+        """Reloads the catalogs which changed since the last check. The new
+        modification time of a catalog is only recorded once it is loaded,
+        so a catalog which fails to load (for example when it is read while
+        being written) is retried on the next check.
+        """
+        mtimes = self.scan()
+        for lang in set(self._mtimes) - set(mtimes):
+            del self._mtimes[lang]
+        changed = dict(
+            (lang, mtime) for lang, mtime in mtimes.iteritems()
+            if self._mtimes.get(lang) != mtime and lang not in self._loading
+        )
+        if changed:
+            self._loading.update(changed)
+            thread = threading.Thread(target=self._load, args=(changed,))
+            thread.daemon = True
+            thread.start()
+
+    def _load(self, mtimes):
+        directory, domain = _gettext_source
+        for lang, mtime in mtimes.iteritems():
+            try:
+                translations = Translations.load(directory, [lang], domain)
+            except Exception, e:
+                logging.error(
+                    "Cannot reload translation for '%s': %s", lang, str(e)
+                )
+                translations = None
+            self.io_loop.add_callback(
+                functools.partial(self._install, lang, mtime, translations)
+            )
+
+    def _install(self, lang, mtime, translations):
+        self._loading.discard(lang)
+        if translations is not None:
+            install_translations(lang, translations)
+            self._mtimes[lang] = mtime
+
+
+def translation_cache_stats():
+    """Returns the usage statistics of the translation memo of every locale
+    loaded so far, keyed by the locale code
+    """
+    return dict(
+        (code, locale.translation_cache.stats())
+        for code, locale in getattr(Locale, '_cache', {}).iteritems()
+    )
+
+
 class Locale(BabelCoreLocale):
     """Object representing a locale.
 
@@ -140,15 +279,74 @@ class Locale(BabelCoreLocale):
             translations = _translations.get(code, gettext.NullTranslations())
             locale = cls.parse(code)
             locale.translations = translations
+            locale.translation_cache = LRUCache(TRANSLATION_CACHE_SIZE)
             cls._cache[code] = locale
         return cls._cache[code]
 
+    #: Memo of the translated messages, set up by :meth:`get`
+    translation_cache = None
+
     def translate(self, message, plural_message=None, count=None):
+        """Translates the message using the translations of the locale.
+        The results are memoized in :attr:`translation_cache`.
+        """
         if plural_message is not None:
             assert count is not None
-            return self.translations.ungettext(message, plural_message, count)
+            key = (message, plural_message, count)
         else:
-            return self.translations.ugettext(message)
+            key = message
+
+        cache = self.translation_cache
+        if cache is not None:
+            translated = cache.get(key)
+            if translated is not None:
+                return translated
+
+        if plural_message is not None:
+            translated = self.translations.ungettext(
+                message, plural_message, count
+            )
+        else:
+            translated = self.translations.ugettext(message)
+        if cache is not None:
+            cache[key] = translated
+        return translated
+
+    def _get_pattern_cache(self):
+        """Returns the cache of parsed date, time and number patterns"""
+        cache = self.__dict__.get('_pattern_cache')
+        if cache is None:
+            cache = self._pattern_cache = LRUCache(PATTERN_CACHE_SIZE)
+        return cache
+
+    def _get_pattern(self, kind, format):
+        """Returns the parsed :class:`babel.dates.DateTimePattern` to format
+        values of the kind ('datetime', 'date' or 'time') with the given
+        format. The patterns are parsed once and cached on the locale, so
+        that formatting a value does not resolve and parse the pattern again.
+        """
+        cache = self._get_pattern_cache()
+        key = (kind, format)
+        pattern = cache.get(key)
+        if pattern is not None:
+            return pattern
+
+        if format not in ('full', 'long', 'medium', 'short'):
+            pattern = dates.parse_pattern(format)
+        elif kind == 'date':
+            pattern = dates.get_date_format(format, locale=self)
+        elif kind == 'time':
+            pattern = dates.get_time_format(format, locale=self)
+        else:
+            # Build a single pattern out of the date and time patterns
+            # joined the way the locale joins a date and a time
+            pattern = dates.parse_pattern(
+                dates.get_datetime_format(format, locale=self) \
+                    .replace('{0}', self._get_pattern('time', format).pattern) \
+                    .replace('{1}', self._get_pattern('date', format).pattern)
+            )
+        cache[key] = pattern
+        return pattern
 
     def format_datetime(self, datetime=None, format='medium', tzinfo=None):
         """
@@ -158,7 +356,8 @@ class Locale(BabelCoreLocale):
                          time is used
         :param format: one of "full", "long", "medium", or "short", or a
                        custom date/time pattern
-        :param tzinfo: the timezone to apply to the time for display
+        :param tzinfo: the timezone (or the name of the timezone) to apply
+                       to the time for display
 
         >>> from datetime import datetime
         >>> locale = Locale.parse('pt_BR')
@@ -168,7 +367,22 @@ class Locale(BabelCoreLocale):
         >>> locale.format_datetime(dt)
         u'01/04/2007 15:30:00'
         """
-        return dates.format_datetime(datetime, format, tzinfo, self)
+        return self._get_pattern('datetime', format).apply(
+            _to_datetime(datetime, _get_timezone(tzinfo)), self
+        )
+
+    def format_datetimes(self, values, format='medium', tzinfo=None):
+        """
+        Return a list of the datetimes formatted according to the given
+        pattern. The pattern and the timezone are resolved only once for the
+        whole sequence. See :meth:`format_datetime` for the arguments.
+        """
+        apply_pattern = self._get_pattern('datetime', format).apply
+        tzinfo = _get_timezone(tzinfo)
+        return [
+            apply_pattern(_to_datetime(value, tzinfo), self)
+            for value in values
+        ]
 
     def format_date(self, date=None, format='medium'):
         """
@@ -179,7 +393,15 @@ class Locale(BabelCoreLocale):
         :param format: one of "full", "long", "medium", or "short", or a
                        custom date/time pattern
         """
-        return dates.format_date(date, format, self)
+        return self._get_pattern('date', format).apply(_to_date(date), self)
+
+    def format_dates(self, values, format='medium'):
+        """
+        Return a list of the dates formatted according to the locale. See
+        :meth:`format_date` for the arguments.
+        """
+        apply_pattern = self._get_pattern('date', format).apply
+        return [apply_pattern(_to_date(value), self) for value in values]
 
     def format_time(self, time=None, format='medium', tzinfo=None):
         """
@@ -189,9 +411,29 @@ class Locale(BabelCoreLocale):
                      in UTC is used
         :param format: one of "full", "long", "medium", or "short", or a
                        custom date/time pattern
-        :param tzinfo: the time-zone to apply to the time for display
+        :param tzinfo: the time-zone (or the name of the time-zone) to apply
+                       to the time for display
+        """
+        tzinfo = _get_timezone(tzinfo)
+        if isinstance(time, time_):
+            return dates.format_time(time, format, tzinfo, self)
+        return self._get_pattern('time', format).apply(
+            _to_datetime(time, tzinfo), self
+        )
+
+    def format_times(self, values, format='medium', tzinfo=None):
         """
-        return dates.format_time(time, format, tzinfo, self)
+        Return a list of the times formatted according to the locale. See
+        :meth:`format_time` for the arguments.
+        """
+        apply_pattern = self._get_pattern('time', format).apply
+        tzinfo = _get_timezone(tzinfo)
+        return [
+            dates.format_time(value, format, tzinfo, self)
+            if isinstance(value, time_) else
+            apply_pattern(_to_datetime(value, tzinfo), self)
+            for value in values
+        ]
 
     def format_timedelta(self, delta, granularity='second',
                 threshold=0.84999999999999998):
@@ -209,6 +451,162 @@ class Locale(BabelCoreLocale):
         """
         return dates.format_timedelta(delta, granularity, threshold, self)
 
+    def format_timedeltas(self, values, granularity='second',
+                threshold=0.84999999999999998):
+        """
+        Return a list of the time deltas formatted according to the rules of
+        the locale. See :meth:`format_timedelta` for the arguments.
+        """
+        format_timedelta = dates.format_timedelta
+        return [
+            format_timedelta(delta, granularity, threshold, self)
+            for delta in values
+        ]
+
+    def _get_number_pattern(self, kind, format):
+        """Returns the parsed :class:`babel.numbers.NumberPattern` to format
+        numbers of the kind ('decimal', 'currency' or 'percent') with the
+        given format, None meaning the standard format of the locale.
+        """
+        cache = self._get_pattern_cache()
+        key = (kind, format)
+        pattern = cache.get(key)
+        if pattern is not None:
+            return pattern
+
+        if format is not None:
+            pattern = numbers.parse_pattern(format)
+        elif kind == 'decimal':
+            pattern = self.decimal_formats.get(None)
+        elif kind == 'currency':
+            pattern = self.currency_formats.get(None) or \
+                self.currency_formats['standard']
+        else:
+            pattern = self.percent_formats.get(None)
+        cache[key] = pattern
+        return pattern
+
+    def format_number(self, number):
+        """
+        Return the given number formatted for the locale.
+
+        >>> Locale.parse('de_DE').format_number(1099)
+        u'1.099'
+        """
+        return self.format_decimal(number)
+
+    def format_numbers(self, values):
+        """
+        Return a list of the numbers formatted for the locale.
+        """
+        return self.format_decimals(values)
+
+    def format_decimal(self, number, format=None):
+        """
+        Return the given decimal number formatted for the locale.
+
+        :param number: the number to format
+        :param format: the number pattern, if None the decimal format of the
+                       locale is used
+
+        >>> Locale.parse('en_US').format_decimal(1.2345)
+        u'1.234'
+        """
+        return self._get_number_pattern('decimal', format).apply(number, self)
+
+    def format_decimals(self, values, format=None):
+        """
+        Return a list of the decimal numbers formatted for the locale, for
+        example a column of a table. See :meth:`format_decimal` for the
+        arguments.
+        """
+        apply_pattern = self._get_number_pattern('decimal', format).apply
+        return [apply_pattern(value, self) for value in values]
+
+    def format_currency(self, number, currency, format=None):
+        """
+        Return the formatted currency value for the locale.
+
+        :param number: the number to format
+        :param currency: the ISO 4217 currency code
+        :param format: the number pattern, if None the currency format of
+                       the locale is used
+
+        >>> Locale.parse('en_US').format_currency(1099.98, 'USD')
+        u'$1,099.98'
+        """
+        return self._get_number_pattern('currency', format).apply(
+            number, self, currency=currency
+        )
+
+    def format_currencies(self, values, currency, format=None):
+        """
+        Return a list of the currency values formatted for the locale. See
+        :meth:`format_currency` for the arguments.
+        """
+        apply_pattern = self._get_number_pattern('currency', format).apply
+        return [
+            apply_pattern(value, self, currency=currency) for value in values
+        ]
+
+    def format_percent(self, number, format=None):
+        """
+        Return the formatted percentage value for the locale.
+
+        :param number: the percentage value to format
+        :param format: the number pattern, if None the percent format of the
+                       locale is used
+
+        >>> Locale.parse('en_US').format_percent(0.34)
+        u'34%'
+        """
+        return self._get_number_pattern('percent', format).apply(number, self)
+
+    def format_percents(self, values, format=None):
+        """
+        Return a list of the percentage values formatted for the locale. See
+        :meth:`format_percent` for the arguments.
+        """
+        apply_pattern = self._get_number_pattern('percent', format).apply
+        return [apply_pattern(value, self) for value in values]
+
+
+def _get_timezone(tzinfo):
+    """Returns the tzinfo for a timezone given as a tzinfo or its name"""
+    if isinstance(tzinfo, basestring):
+        return pytz.timezone(tzinfo)
+    return tzinfo
+
+
+def _to_datetime(value, tzinfo):
+    """Converts the value given to the datetime and time formatting methods
+    to an aware datetime in the given timezone, the way babel does.
+    """
+    if value is None:
+        value = datetime_.utcnow()
+    elif isinstance(value, (int, long, float)):
+        value = datetime_.utcfromtimestamp(value)
+    elif isinstance(value, time_):
+        value = datetime_.combine(date_.today(), value)
+    elif isinstance(value, date_) and not isinstance(value, datetime_):
+        value = datetime_.combine(value, time_())
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=pytz.utc)
+    if tzinfo is not None:
+        value = value.astimezone(tzinfo)
+        if hasattr(tzinfo, 'normalize'):
+            value = tzinfo.normalize(value)
+    return value
+
+
+def _to_date(value):
+    """Converts the value given to the date formatting methods to a date"""
+    if value is None:
+        return date_.today()
+    if isinstance(value, datetime_):
+        return value.date()
+    return value
+
 
 if __name__ == '__main__':
     import doctest
@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+"""
+    messages
+
+    Extraction of translatable messages and compilation of the catalogs,
+    used by the `extract` and `compile` commands of `monstor_admin`.
+
+    Both steps are incremental: messages are re-extracted only from the
+    files whose content changed since the last run and only the catalogs
+    whose `.po` file is newer than the `.mo` file are compiled.
+
+    :copyright: (c) 2012 by Openlabs Technologies & Consulting (P) Limited
+    :license: BSD, see LICENSE for more details.
+"""
+import os
+import re
+import ast
+import json
+import hashlib
+import logging
+import pkgutil
+import tokenize
+import multiprocessing
+from StringIO import StringIO
+
+from babel.messages.catalog import Catalog
+from babel.messages.extract import extract_python, DEFAULT_KEYWORDS
+from babel.messages.pofile import read_po, write_po
+from babel.messages.mofile import write_mo
+
+#: The lazy ngettext of :mod:`monstor.utils.i18n` takes a plural form too
+KEYWORDS = dict(DEFAULT_KEYWORDS, N_=(1, 2))
+
+TEMPLATE_EXTENSIONS = ('.html', '.htm', '.txt', '.xml')
+
+_template_block_re = re.compile(r'\{\{(.*?)\}\}|\{%(.*?)%\}', re.S)
+
+logger = logging.getLogger(__name__)
+
+
+def extract_tornado(fileobj, keywords, comment_tags, options):
+    """Extracts the messages from the expressions and statements of a
+    tornado template. The interface is that of a babel extraction method.
+    """
+    source = fileobj.read().decode(options.get('encoding', 'utf-8'))
+    for match in _template_block_re.finditer(source):
+        code = match.group(1) or match.group(2)
+        lineno = source.count('\n', 0, match.start())
+        try:
+            for item in extract_python(StringIO(code.encode('utf-8')),
+                    keywords, comment_tags, options):
+                yield (lineno + item[0],) + tuple(item[1:])
+        except tokenize.TokenError:
+            # Statements like `{% for ... %}` need not be complete python
+            continue
+
+
+def read_installed_apps(application_py):
+    """Returns the `installed_apps` of the settings given to `make_app` in
+    the `application.py` of a project, such as the one written by
+    `monstor_admin start_project`. The file is parsed, not run, so that the
+    application is not built.
+    """
+    with open(application_py, 'rb') as source_file:
+        module = ast.parse(source_file.read(), application_py)
+    for node in ast.walk(module):
+        if isinstance(node, ast.Dict):
+            pairs = zip(node.keys, node.values)
+        elif isinstance(node, ast.Call):
+            pairs = [
+                (ast.Str(keyword.arg), keyword.value)
+                for keyword in node.keywords
+            ]
+        else:
+            continue
+        for key, value in pairs:
+            if isinstance(key, ast.Str) and key.s == 'installed_apps':
+                return ast.literal_eval(value)
+    raise ValueError("No installed_apps in %s" % application_py)
+
+
+def find_sources(app_names, template_paths=()):
+    """Returns the python sources and templates of the given apps and the
+    templates in the given folders as a list of (method, path) tuples.
+
+    The apps are located without importing them.
+    """
+    folders = []
+    for app_name in app_names:
+        loader = pkgutil.get_loader(app_name)
+        folders.append(('python', os.path.dirname(loader.get_filename())))
+    folders.extend(('template', path) for path in template_paths)
+
+    sources = []
+    for kind, folder in folders:
+        for dirpath, dirnames, filenames in os.walk(folder):
+            dirnames[:] = sorted(d for d in dirnames if not d.startswith('.'))
+            for filename in sorted(filenames):
+                path = os.path.join(dirpath, filename)
+                if kind == 'python' and filename.endswith('.py'):
+                    sources.append(('python', path))
+                elif filename.endswith(TEMPLATE_EXTENSIONS) and \
+                        (kind == 'template' or 'templates' in dirpath):
+                    sources.append(('template', path))
+    return sources
+
+
+def _extract_file(source):
+    """Extracts the messages of a single file. Returns the list of
+    (lineno, message, comments) of the file, where the message is a list of
+    the singular and plural forms for plural messages.
+    """
+    method, path = source
+    method = extract_tornado if method == 'template' else extract_python
+    messages = []
+    with open(path, 'rb') as fileobj:
+        for lineno, funcname, arguments, comments in \
+                method(fileobj, KEYWORDS.keys(), (), {}):
+            spec = KEYWORDS[funcname] or (1,)
+            if not isinstance(arguments, (list, tuple)):
+                arguments = [arguments]
+            # Context arguments of pgettext are not supported
+            message = [
+                arguments[index - 1] for index in spec
+                if not isinstance(index, tuple) and index <= len(arguments)
+            ]
+            if not message or not all(message):
+                # Not a string literal, e.g. _(variable)
+                continue
+            messages.append(
+                (lineno, message[0] if len(message) == 1 else message,
+                    comments)
+            )
+    return messages
+
+
+def extract_messages(app_names, output_file, template_paths=(),
+        cache_file=None, processes=None):
+    """Extracts the messages from the python sources and tornado templates
+    of the apps and writes the template catalog (POT) to `output_file`.
+
+    The messages of each file are kept in `cache_file` (defaults to the
+    output file with a `.cache` suffix) along with the hash of the file, so
+    only files whose content changed are extracted again.
+
+    :return: a tuple of the number of files and the number of files which
+             had to be extracted
+    """
+    cache_file = cache_file or output_file + '.cache'
+    try:
+        with open(cache_file, 'rb') as cache_fileobj:
+            cache = json.load(cache_fileobj)
+    except (IOError, ValueError):
+        cache = {}
+
+    sources = find_sources(app_names, template_paths)
+    hashes, changed = {}, []
+    for method, path in sources:
+        with open(path, 'rb') as fileobj:
+            hashes[path] = hashlib.sha1(fileobj.read()).hexdigest()
+        if cache.get(path, {}).get('hash') != hashes[path]:
+            changed.append((method, path))
+
+    if len(changed) > 1 and processes != 1:
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.map(_extract_file, changed)
+        finally:
+            pool.close()
+    else:
+        results = map(_extract_file, changed)
+    for (method, path), messages in zip(changed, results):
+        cache[path] = {'hash': hashes[path], 'messages': messages}
+
+    # Forget the files which no longer exist
+    cache = dict((path, cache[path]) for method, path in sources)
+
+    catalog = Catalog()
+    base = os.path.commonprefix([path for method, path in sources])
+    base = os.path.dirname(base)
+    for method, path in sources:
+        location = os.path.relpath(path, base)
+        for lineno, message, comments in cache[path]['messages']:
+            if isinstance(message, list):
+                message = tuple(message)
+            catalog.add(
+                message, None, [(location, lineno)], auto_comments=comments
+            )
+
+    with open(output_file, 'wb') as output_fileobj:
+        write_po(output_fileobj, catalog)
+    with open(cache_file, 'wb') as cache_fileobj:
+        json.dump(cache, cache_fileobj)
+    logger.info(
+        "Extracted %d messages, %d of %d files changed",
+        len(catalog), len(changed), len(sources)
+    )
+    return len(sources), len(changed)
+
+
+def _compile_catalog(po_file):
+    """Compiles the `.po` file to a `.mo` file next to it"""
+    with open(po_file, 'rb') as po_fileobj:
+        catalog = read_po(po_fileobj)
+    with open(po_file[:-3] + '.mo', 'wb') as mo_fileobj:
+        write_mo(mo_fileobj, catalog)
+    return po_file
+
+
+def compile_catalogs(directory, domain='messages', processes=None):
+    """Compiles the catalogs of every language in the gettext locale tree
+    (`{directory}/{lang}/LC_MESSAGES/{domain}.po`) whose `.po` file changed
+    after it was last compiled. The languages are compiled in parallel.
+
+    :return: the list of `.po` files which were compiled
+    """
+    outdated = []
+    for lang in sorted(os.listdir(directory)):
+        po_file = os.path.join(directory, lang, 'LC_MESSAGES', domain + '.po')
+        if not os.path.isfile(po_file):
+            continue
+        mo_file = po_file[:-3] + '.mo'
+        if os.path.isfile(mo_file) and \
+                os.path.getmtime(mo_file) >= os.path.getmtime(po_file):
+            continue
+        outdated.append(po_file)
+
+    if len(outdated) > 1 and processes != 1:
+        pool = multiprocessing.Pool(processes)
+        try:
+            compiled = pool.map(_compile_catalog, outdated)
+        finally:
+            pool.close()
+    else:
+        compiled = map(_compile_catalog, outdated)
+    for po_file in compiled:
+        logger.info("Compiled %s", po_file)
+    return compiled
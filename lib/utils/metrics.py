@@ -0,0 +1,379 @@
+# -*- coding: utf-8 -*-
+"""
+    metrics
+
+    Request metrics of a monstor application: the number of requests by
+    handler and status, the requests in flight and histograms of the latency
+    and of the time spent on MongoDB, SMTP and upstream HTTP services by
+    each request, as well as the latency of each upstream host.
+
+    The metrics are collected by :class:`monstor.utils.web.BaseHandler` when
+    the `metrics` option is set and exposed at `metrics_url` in the text
+    exposition format of Prometheus. Handlers are identified by the name of
+    their URLSpec, for example `contrib.auth.login`.
+
+    Every process keeps its own metrics. When the server is pre-forked set
+    `metrics_dir` to a folder shared by the workers: each worker writes its
+    metrics there periodically and the endpoint, whichever worker serves
+    it, reports the sum of all of them.
+
+    :copyright: (c) 2012 by Openlabs Technologies & Consulting (P) Limited
+    :license: BSD, see LICENSE for more details.
+"""
+import os
+import json
+import time
+import errno
+import bisect
+import tempfile
+import threading
+import functools
+import contextlib
+from collections import defaultdict
+
+import tornado.web
+from tornado.ioloop import IOLoop, PeriodicCallback
+from tornado.options import define, options
+
+define("metrics", type=bool, default=False,
+    help="Collect the latency and status of the requests")
+define("metrics_url", default="/metrics",
+    help="URL where the metrics are exposed, empty to not expose them")
+define("metrics_dir", default=None,
+    help="Folder shared by the worker processes to aggregate their metrics")
+define("metrics_flush_interval", type=int, default=10,
+    help="Seconds between two writes of the metrics to metrics_dir")
+
+#: Upper bounds (in seconds) of the buckets of the histograms
+BUCKETS = (
+    0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+
+#: The histograms kept, their description and the label of their series
+HISTOGRAMS = (
+    ('request_duration_seconds', "Time taken to serve the request",
+        'handler'),
+    ('request_mongo_seconds', "Time spent on MongoDB by the request",
+        'handler'),
+    ('request_smtp_seconds', "Time spent sending mails by the request",
+        'handler'),
+    ('request_upstream_seconds',
+        "Time spent waiting for upstream HTTP services by the request",
+        'handler'),
+    ('upstream_duration_seconds', "Time taken by the upstream HTTP requests",
+        'host'),
+)
+
+PREFIX = 'monstor_'
+
+
+class Histogram(object):
+    """A histogram of observations counted in the fixed :data:`BUCKETS`"""
+
+    def __init__(self, counts=None, total=0.0, count=0):
+        self.counts = counts or [0] * (len(BUCKETS) + 1)
+        self.sum = total
+        self.count = count
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def merge(self, other):
+        for index, count in enumerate(other.counts):
+            self.counts[index] += count
+        self.sum += other.sum
+        self.count += other.count
+
+
+class RequestRecord(object):
+    """The time spent on each kind of external call by a request"""
+
+    def __init__(self):
+        self.timings = defaultdict(float)
+        #: Whether the request is counted in :attr:`Metrics.in_flight`
+        self.in_flight = True
+
+
+class _RequestState(threading.local):
+    """The record of the request being processed by this thread"""
+    record = None
+
+_state = _RequestState()
+
+
+@contextlib.contextmanager
+def request_context(record):
+    """A context manager which makes `record` the :class:`RequestRecord`
+    to which :func:`timed` adds the time spent. Like the locale context it
+    is entered through a stack context by the handler, so the time spent in
+    asynchronous callbacks is attributed to the right request.
+    """
+    previous, _state.record = _state.record, record
+    try:
+        yield
+    finally:
+        _state.record = previous
+
+
+def current_record():
+    """Returns the record of the current request or None"""
+    return _state.record
+
+
+@contextlib.contextmanager
+def timed(kind):
+    """Adds the time spent within the block to the `kind` timing of the
+    current request, if any::
+
+        with timed('smtp'):
+            smtp_server.sendmail(sender, receiver, message)
+    """
+    record = _state.record
+    if record is None:
+        yield
+        return
+    start = time.time()
+    try:
+        yield
+    finally:
+        record.timings[kind] += time.time() - start
+
+
+def _timed_method(method, kind):
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        with timed(kind):
+            return method(*args, **kwargs)
+    wrapper.instrumented = True
+    return wrapper
+
+
+def instrument_pymongo():
+    """Times the messages sent to MongoDB by pymongo as `mongo`. Every query,
+    command and write goes through the two methods patched here.
+    """
+    from pymongo.connection import Connection
+    from pymongo.replica_set_connection import ReplicaSetConnection
+
+    for cls in (Connection, ReplicaSetConnection):
+        for name in ('_send_message', '_send_message_with_response'):
+            method = getattr(cls, name)
+            if not getattr(method, 'instrumented', False):
+                setattr(cls, name, _timed_method(method, 'mongo'))
+
+
+class Metrics(object):
+    """The metrics of a process"""
+
+    def __init__(self):
+        self.in_flight = 0
+        self.requests = defaultdict(int)
+        self.histograms = {}
+        self._handler_names = {}
+        self._flusher = None
+
+    def start_request(self):
+        """Returns the :class:`RequestRecord` of a new request or None if
+        metrics are not collected
+        """
+        if not options.metrics:
+            return None
+        if options.metrics_dir and self._flusher is None:
+            # Started on the first request, after the workers are forked
+            self._flusher = PeriodicCallback(
+                self.flush, options.metrics_flush_interval * 1000,
+                io_loop=IOLoop.instance()
+            )
+            self._flusher.start()
+        self.in_flight += 1
+        return RequestRecord()
+
+    def end_request(self, record):
+        """Stops counting the request as in flight. The request is counted
+        once, whether it ends by finishing or by the client closing the
+        connection first, or both.
+        """
+        if record.in_flight:
+            record.in_flight = False
+            self.in_flight -= 1
+
+    def finish_request(self, handler, record):
+        """Records the status and timings of the request of the handler"""
+        self.end_request(record)
+        name = self.handler_name(handler)
+        self.requests[(name, str(handler.get_status()))] += 1
+        self.observe('request_duration_seconds', name,
+            handler.request.request_time())
+        self.observe('request_mongo_seconds', name, record.timings['mongo'])
+        self.observe('request_smtp_seconds', name, record.timings['smtp'])
+        self.observe('request_upstream_seconds', name,
+            record.timings['upstream'])
+
+    def observe(self, metric, name, value):
+        try:
+            histogram = self.histograms[(metric, name)]
+        except KeyError:
+            histogram = self.histograms[(metric, name)] = Histogram()
+        histogram.observe(value)
+
+    def handler_name(self, handler):
+        """Returns the name of the URLSpec which routed to the handler or
+        the name of its class if the URLSpec has no name
+        """
+        cls = handler.__class__
+        try:
+            return self._handler_names[cls]
+        except KeyError:
+            pass
+        dotted_name = '%s.%s' % (cls.__module__, cls.__name__)
+        name = cls.__name__
+        for spec_name, spec in handler.application.named_handlers.iteritems():
+            # Do not import the lazy handlers of monstor URLSpecs
+            target = getattr(spec, '_handler_class', None) or \
+                spec.handler_class
+            if target is cls or target == dotted_name:
+                name = spec_name
+                break
+        self._handler_names[cls] = name
+        return name
+
+    def snapshot(self):
+        """Returns the metrics as a JSON serialisable dictionary"""
+        return {
+            'pid': os.getpid(),
+            'in_flight': self.in_flight,
+            'requests': [
+                [name, status, count]
+                for (name, status), count in self.requests.iteritems()
+            ],
+            'histograms': [
+                [metric, name, h.counts, h.sum, h.count]
+                for (metric, name), h in self.histograms.iteritems()
+            ],
+        }
+
+    def flush(self, directory=None):
+        """Writes the snapshot of the process to `{pid}.json` in the
+        directory, `metrics_dir` by default
+        """
+        directory = directory or options.metrics_dir
+        fd, path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as fileobj:
+            json.dump(self.snapshot(), fileobj)
+        os.rename(path, os.path.join(directory, '%d.json' % os.getpid()))
+
+    def collect(self, directory=None):
+        """Returns the snapshots of all the processes which wrote to the
+        directory, `metrics_dir` by default, with the current snapshot of
+        this process. Without a directory only this process is reported.
+        """
+        directory = directory or options.metrics_dir
+        snapshot = self.snapshot()
+        if not directory:
+            return [snapshot]
+        self.flush(directory)
+        snapshots = []
+        for filename in os.listdir(directory):
+            if not filename.endswith('.json'):
+                continue
+            if filename == '%d.json' % snapshot['pid']:
+                snapshots.append(snapshot)
+                continue
+            try:
+                with open(os.path.join(directory, filename), 'rb') as fileobj:
+                    snapshots.append(json.load(fileobj))
+            except (IOError, ValueError):
+                continue
+        return snapshots
+
+
+def merge(snapshots):
+    """Merges the snapshots of several processes into one. The counters and
+    histograms of the processes which exited are kept, so they remain
+    monotonic, but their requests are no longer in flight.
+    """
+    in_flight = 0
+    requests = defaultdict(int)
+    histograms = {}
+    for snapshot in snapshots:
+        if _is_alive(snapshot['pid']):
+            in_flight += snapshot['in_flight']
+        for name, status, count in snapshot['requests']:
+            requests[(name, status)] += count
+        for metric, name, counts, total, count in snapshot['histograms']:
+            histogram = Histogram(list(counts), total, count)
+            if (metric, name) in histograms:
+                histograms[(metric, name)].merge(histogram)
+            else:
+                histograms[(metric, name)] = histogram
+    return in_flight, requests, histograms
+
+
+def _is_alive(pid):
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except OSError, e:
+        return e.errno == errno.EPERM
+    return True
+
+
+def _labels(**labels):
+    return '{%s}' % ','.join(
+        '%s="%s"' % (key, value.replace('\\', r'\\').replace('"', r'\"'))
+        for key, value in sorted(labels.iteritems())
+    )
+
+
+def exposition(snapshots):
+    """Renders the merged snapshots in the Prometheus text format"""
+    in_flight, requests, histograms = merge(snapshots)
+    lines = [
+        "# HELP %srequests_in_flight Requests being served" % PREFIX,
+        "# TYPE %srequests_in_flight gauge" % PREFIX,
+        "%srequests_in_flight %d" % (PREFIX, in_flight),
+        "# HELP %srequests_total Requests served" % PREFIX,
+        "# TYPE %srequests_total counter" % PREFIX,
+    ]
+    for (name, status), count in sorted(requests.iteritems()):
+        lines.append("%srequests_total%s %d" % (
+            PREFIX, _labels(handler=name, status=status), count
+        ))
+    for metric, description, label in HISTOGRAMS:
+        lines.append("# HELP %s%s %s" % (PREFIX, metric, description))
+        lines.append("# TYPE %s%s histogram" % (PREFIX, metric))
+        for (histogram_metric, name), histogram in \
+                sorted(histograms.iteritems()):
+            if histogram_metric != metric:
+                continue
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ('+Inf',), histogram.counts):
+                cumulative += count
+                lines.append("%s%s_bucket%s %d" % (
+                    PREFIX, metric, _labels(**{label: name, 'le': str(bound)}),
+                    cumulative
+                ))
+            lines.append("%s%s_sum%s %r" % (
+                PREFIX, metric, _labels(**{label: name}), histogram.sum
+            ))
+            lines.append("%s%s_count%s %d" % (
+                PREFIX, metric, _labels(**{label: name}), histogram.count
+            ))
+    return '\n'.join(lines) + '\n'
+
+
+#: The metrics of this process
+registry = Metrics()
+
+
+class MetricsHandler(tornado.web.RequestHandler):
+    """Exposes the metrics of all the workers. Added by
+    :func:`monstor.app.make_app` at the `metrics_url`.
+    """
+
+    def get(self):
+        self.set_header("Content-Type", "text/plain; version=0.0.4")
+        self.write(exposition(registry.collect()))
@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+"""
+    queries
+
+    Profiler of the MongoDB operations issued by a request
+
+    When the `profile_queries` option is set every operation sent by pymongo
+    during a request is recorded with its collection, the shape of its
+    filter (the filter with the values left out), its duration and, with
+    `profile_queries_explain`, whether an index was used. Operations whose
+    shape repeats more than `profile_queries_repeat` times in a request are
+    logged as a warning since they usually are a query in a loop (N+1)
+    which could be a single query.
+
+    With `profile_queries_header` a summary of the profile is sent in the
+    `X-Query-Profile` header of the response.
+
+    :copyright: (c) 2012 by Openlabs Technologies & Consulting (P) Limited
+    :license: BSD, see LICENSE for more details.
+"""
+import json
+import time
+import logging
+import threading
+import functools
+import contextlib
+from collections import namedtuple, defaultdict
+
+from tornado.options import define, options
+
+from monstor.utils.cache import LRUCache
+
+define("profile_queries", type=bool, default=False,
+    help="Record the MongoDB operations issued by each request")
+define("profile_queries_repeat", type=int, default=5,
+    help="Warn when a request repeats the same query more than this")
+define("profile_queries_explain", type=bool, default=False,
+    help="Explain each new query shape once to find if it uses an index")
+define("profile_queries_header", type=bool, default=False,
+    help="Send the query profile in the X-Query-Profile response header")
+
+logger = logging.getLogger(__name__)
+
+#: An operation recorded by the profiler. `index` is None when unknown.
+Query = namedtuple(
+    'Query', ['operation', 'collection', 'shape', 'duration', 'index']
+)
+
+#: Whether an index is used, by collection, query shape and sort keys
+_index_cache = LRUCache(256)
+
+
+def query_shape(spec):
+    """Returns the filter with its values replaced by `?` as a string, so
+    that queries which differ only by the values compare equal
+
+    >>> query_shape({'email': 'a@example.com', 'age': {'$gt': 18}})
+    '{"age": {"$gt": "?"}, "email": "?"}'
+    """
+    return json.dumps(_shape(spec), sort_keys=True)
+
+
+def _shape(value):
+    if not isinstance(value, dict):
+        return '?'
+    shape = {}
+    for key, item in value.iteritems():
+        if key in ('$and', '$or', '$nor') and isinstance(item, list):
+            shape[key] = [_shape(clause) for clause in item]
+        else:
+            shape[key] = _shape(item)
+    return shape
+
+
+class QueryProfile(object):
+    """The operations issued during a request"""
+
+    def __init__(self):
+        self.queries = []
+
+    def record(self, operation, collection, shape, duration, index=None):
+        self.queries.append(
+            Query(operation, collection, shape, duration, index)
+        )
+
+    @property
+    def total_time(self):
+        return sum(query.duration for query in self.queries)
+
+    def repeated(self, threshold=None):
+        """Returns the (operation, collection, shape) of the operations
+        repeated more than `threshold` (`profile_queries_repeat` by default)
+        times with their count, the most repeated first
+        """
+        if threshold is None:
+            threshold = options.profile_queries_repeat
+        counts = defaultdict(int)
+        for query in self.queries:
+            counts[query[:3]] += 1
+        return sorted(
+            [(key, count) for key, count in counts.iteritems()
+                if count > threshold],
+            key=lambda item: item[1], reverse=True
+        )
+
+    def unindexed(self):
+        """Returns the queries known not to use an index"""
+        return [query for query in self.queries if query.index is False]
+
+    def summary(self):
+        """Returns a one line summary of the profile"""
+        parts = ["%d queries in %.1f ms" % (
+            len(self.queries), self.total_time * 1000
+        )]
+        for (operation, collection, shape), count in self.repeated():
+            parts.append(
+                "%dx %s %s %s" % (count, operation, collection, shape)
+            )
+        unindexed = set(query[:3] for query in self.unindexed())
+        for operation, collection, shape in unindexed:
+            parts.append("no index %s %s %s" % (operation, collection, shape))
+        return "; ".join(parts)
+
+    def log(self, request):
+        """Logs the repeated and unindexed operations of the request"""
+        for (operation, collection, shape), count in self.repeated():
+            logger.warning(
+                "%s %s repeats %s on %s %d times: %s", request.method,
+                request.uri, operation, collection, count, shape
+            )
+        for operation, collection, shape in \
+                set(query[:3] for query in self.unindexed()):
+            logger.warning(
+                "%s %s %s on %s does not use an index: %s", request.method,
+                request.uri, operation, collection, shape
+            )
+        logger.debug("%s %s: %s", request.method, request.uri, self.summary())
+
+
+class _ProfileState(threading.local):
+    """The profile of the request being processed by this thread"""
+    profile = None
+
+_state = _ProfileState()
+
+
+def start_profile():
+    """Returns a new :class:`QueryProfile` if queries are profiled"""
+    if options.profile_queries:
+        return QueryProfile()
+    return None
+
+
+@contextlib.contextmanager
+def profile_context(profile):
+    """A context manager which records the operations issued within the
+    block to `profile`. Entered through a stack context by
+    :class:`monstor.utils.web.BaseHandler` like the locale context.
+    """
+    previous, _state.profile = _state.profile, profile
+    try:
+        yield
+    finally:
+        _state.profile = previous
+
+
+def _explain(cursor, collection, shape):
+    """Returns whether the query of the cursor uses an index. Each shape is
+    explained once, with the profiler turned off.
+    """
+    ordering = cursor._Cursor__ordering
+    key = (collection, shape, tuple(ordering.keys()) if ordering else ())
+    index = _index_cache.get(key)
+    if index is None and key not in _index_cache:
+        previous, _state.profile = _state.profile, None
+        try:
+            plan = cursor.explain()
+            index = not plan.get('cursor', '').startswith('BasicCursor')
+        except Exception, e:
+            logger.debug("Cannot explain %s %s: %s", collection, shape, e)
+        finally:
+            _state.profile = previous
+        _index_cache[key] = index
+    return index
+
+
+def _profile_refresh(method):
+    @functools.wraps(method)
+    def wrapper(cursor):
+        profile = _state.profile
+        if profile is None or cursor._Cursor__id is not None or \
+                cursor._Cursor__data or cursor._Cursor__killed:
+            # Not profiling or fetching more results of a query
+            return method(cursor)
+
+        collection = cursor._Cursor__collection
+        spec = cursor._Cursor__spec
+        index = None
+        if collection.name == '$cmd':
+            # Commands like count are queries on the $cmd collection
+            operation = iter(spec).next()
+            target = '%s.%s' % (collection.database.name, spec[operation])
+            shape = query_shape(spec.get('query') or {})
+        else:
+            operation, target = 'find', collection.full_name
+            shape = query_shape(spec)
+            if options.profile_queries_explain:
+                index = _explain(cursor, target, shape)
+
+        start = time.time()
+        try:
+            return method(cursor)
+        finally:
+            profile.record(
+                operation, target, shape, time.time() - start, index
+            )
+    wrapper.profiled = True
+    return wrapper
+
+
+def _profile_write(method, operation, argument):
+    @functools.wraps(method)
+    def wrapper(collection, *args, **kwargs):
+        profile = _state.profile
+        if profile is None:
+            return method(collection, *args, **kwargs)
+        spec = args[0] if args else kwargs.get(argument)
+        if operation == 'insert':
+            shape = '-'
+        elif isinstance(spec, dict) or spec is None:
+            shape = query_shape(spec or {})
+        else:
+            shape = query_shape({'_id': spec})
+        start = time.time()
+        try:
+            return method(collection, *args, **kwargs)
+        finally:
+            profile.record(
+                operation, collection.full_name, shape, time.time() - start
+            )
+    wrapper.profiled = True
+    return wrapper
+
+
+def install_profiler():
+    """Patches pymongo to record the operations in the current profile.
+    Queries and commands go through :meth:`Cursor._refresh` and the writes
+    through the `insert`, `update` and `remove` methods of the collection.
+    """
+    from pymongo.cursor import Cursor
+    from pymongo.collection import Collection
+
+    if not getattr(Cursor._refresh, 'profiled', False):
+        Cursor._refresh = _profile_refresh(Cursor._refresh)
+    for operation, argument in (('insert', 'doc_or_docs'),
+            ('update', 'spec'), ('remove', 'spec_or_id')):
+        method = getattr(Collection, operation)
+        if not getattr(method, 'profiled', False):
+            setattr(Collection, operation,
+                _profile_write(method, operation, argument))
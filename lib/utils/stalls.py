@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+"""
+    stalls
+
+    Detection of the callbacks which block the IOLoop
+
+    :class:`StallDetector` uses the blocking signal of the IOLoop: when an
+    iteration of the loop runs for more than `stall_threshold` seconds the
+    stack of the loop is sampled, and sampled again every
+    `stall_sample_interval` seconds for as long as it stays blocked. Each
+    sample is attributed to the :class:`monstor.utils.web.BaseHandler`
+    whose request is being processed and to the call site which was
+    running, and the call sites which blocked the loop the longest are
+    logged periodically::
+
+        if options.stall_threshold:
+            StallDetector(options.stall_threshold).start()
+
+    The detector relies on `SIGALRM` and must be started in the main thread
+    of the process running the IOLoop, after the workers are forked.
+
+    :copyright: (c) 2012 by Openlabs Technologies & Consulting (P) Limited
+    :license: BSD, see LICENSE for more details.
+"""
+import os
+import sys
+import signal
+import logging
+import threading
+import traceback
+import contextlib
+from collections import defaultdict
+
+from tornado.ioloop import IOLoop, PeriodicCallback
+from tornado.options import define, options
+
+from monstor.utils import metrics
+
+define("stall_threshold", type=float, default=0,
+    help="Seconds an iteration of the IOLoop may block before its stack is "
+        "sampled, 0 disables the stall detector")
+define("stall_sample_interval", type=float, default=None,
+    help="Seconds between two samples of a blocked IOLoop, defaults to the "
+        "stall_threshold")
+define("stall_report_interval", type=int, default=60,
+    help="Seconds between two reports of the top blocking call sites")
+define("stall_report_size", type=int, default=10,
+    help="Number of call sites in the report of the stall detector")
+
+logger = logging.getLogger(__name__)
+
+_STDLIB = os.path.dirname(traceback.__file__)
+
+#: The folders of monstor, whose frames are attributed to even when it is
+#: installed in site-packages
+_MONSTOR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+#: The modules of monstor which wrap the calls of the apps (the metrics,
+#: the query profiler, the stall detector and the request context of the
+#: handlers), whose frames are never attributed to
+_PLUMBING = tuple(
+    os.path.join(_MONSTOR, 'utils', name + '.py')
+    for name in ('metrics', 'queries', 'stalls', 'web')
+)
+
+#: Libraries the apps call which may not be installed in site-packages
+LIBRARIES = ('tornado', 'pymongo', 'bson', 'gridfs', 'mongoengine', 'babel',
+    'wtforms')
+
+
+class _HandlerState(threading.local):
+    """The handler whose request is being processed by this thread"""
+    handler = None
+
+_state = _HandlerState()
+
+
+@contextlib.contextmanager
+def handler_context(handler):
+    """A context manager which makes `handler` the handler blocking
+    samples are attributed to. Entered through a stack context by
+    :class:`monstor.utils.web.BaseHandler` like the locale context.
+    """
+    previous, _state.handler = _state.handler, handler
+    try:
+        yield
+    finally:
+        _state.handler = previous
+
+
+def describe_handler(handler):
+    """Returns the class of the handler with the name of its URLSpec"""
+    if handler is None:
+        return '-'
+    name = handler.__class__.__name__
+    url_name = metrics.registry.handler_name(handler)
+    if url_name != name:
+        name = '%s (%s)' % (name, url_name)
+    return name
+
+
+def _library_paths():
+    """Returns the folders of the standard library and of the
+    :data:`LIBRARIES` imported so far. Only the imported libraries can be
+    on the stack, so none is imported here.
+    """
+    paths = [_STDLIB]
+    for name in LIBRARIES:
+        filename = getattr(sys.modules.get(name), '__file__', None)
+        if filename:
+            paths.append(os.path.dirname(os.path.abspath(filename)))
+    return tuple(path + os.sep for path in paths)
+
+
+def is_library(filename, library_paths=None):
+    """Returns True if the file is part of the standard library, of an
+    installed package other than monstor or of the plumbing of monstor
+    """
+    filename = os.path.abspath(filename)
+    if filename.startswith(_MONSTOR + os.sep):
+        return filename in _PLUMBING
+    if library_paths is None:
+        library_paths = _library_paths()
+    return filename.startswith(library_paths) or \
+        'site-packages' in filename or 'dist-packages' in filename
+
+
+def call_site(stack):
+    """Returns the innermost entry of the stack which is not in the
+    standard library, an installed package or the plumbing of monstor, so
+    that a blocking read of the database is attributed to the code which
+    made the query
+    """
+    library_paths = _library_paths()
+    for entry in reversed(stack):
+        if not is_library(entry[0], library_paths):
+            return entry
+    return stack[-1]
+
+
+class CallSite(object):
+    """The samples taken while a call site was blocking the loop"""
+
+    def __init__(self, filename, lineno, function, stack):
+        self.filename = filename
+        self.lineno = lineno
+        self.function = function
+        #: The stack of the first sample
+        self.stack = stack
+        self.samples = 0
+        self.handlers = defaultdict(int)
+
+    def __str__(self):
+        return '%s:%d in %s' % (self.filename, self.lineno, self.function)
+
+
+class StallDetector(object):
+    """Samples the stack of the IOLoop when it is blocked for more than
+    `threshold` seconds and aggregates the samples by call site.
+
+    :param threshold: Seconds after which an iteration of the loop is
+                      considered blocked
+    :param sample_interval: Seconds between the samples of a blocked loop,
+                            defaults to the threshold
+    """
+
+    def __init__(self, threshold, sample_interval=None, io_loop=None):
+        self.threshold = threshold
+        self.sample_interval = sample_interval or \
+            options.stall_sample_interval or threshold
+        self.io_loop = io_loop or IOLoop.instance()
+        self.sites = {}
+        self._reporter = PeriodicCallback(
+            self.log_report, options.stall_report_interval * 1000,
+            io_loop=self.io_loop
+        )
+
+    def start(self):
+        """Starts sampling the blocked iterations of the loop"""
+        self.io_loop.set_blocking_signal_threshold(
+            self.threshold, self.sample
+        )
+        # Restart the blocking system calls (socket reads of pymongo and
+        # smtplib) interrupted by a sample instead of failing with EINTR
+        signal.siginterrupt(signal.SIGALRM, False)
+        self._reporter.start()
+
+    def stop(self):
+        """Stops sampling and reporting"""
+        self.io_loop.set_blocking_signal_threshold(None, None)
+        signal.setitimer(signal.ITIMER_REAL, 0, 0)
+        signal.signal(signal.SIGALRM, signal.SIG_DFL)
+        self._reporter.stop()
+
+    def sample(self, signum, frame):
+        """The signal handler which records the stack of the loop"""
+        stack = traceback.extract_stack(frame)
+        filename, lineno, function, line = call_site(stack)
+        key = (filename, lineno)
+        site = self.sites.get(key)
+        if site is None:
+            site = self.sites[key] = CallSite(
+                filename, lineno, function, stack
+            )
+        site.samples += 1
+        site.handlers[describe_handler(_state.handler)] += 1
+        # Sample again if the loop is still blocked. The IOLoop clears the
+        # timer before it polls.
+        signal.setitimer(signal.ITIMER_REAL, self.sample_interval, 0)
+
+    def blocked_time(self, site):
+        """Returns the approximate seconds the call site blocked the loop"""
+        return site.samples * self.sample_interval
+
+    def report(self, limit=None):
+        """Returns the call sites which blocked the loop the longest"""
+        sites = sorted(
+            self.sites.itervalues(), key=lambda site: site.samples,
+            reverse=True
+        )
+        return sites[:limit or options.stall_report_size]
+
+    def log_report(self):
+        """Logs the top blocking call sites"""
+        sites = self.report()
+        if not sites:
+            return
+        lines = ["Top blocking call sites of the IOLoop:"]
+        for site in sites:
+            lines.append("%8.3f s %5d samples  %s" % (
+                self.blocked_time(site), site.samples, site
+            ))
+            for handler, samples in sorted(site.handlers.iteritems(),
+                    key=lambda item: item[1], reverse=True):
+                lines.append("%24d  %s" % (samples, handler))
+        logger.warning("\n".join(lines))
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""
+    static
+
+    Static asset pipeline. Assets are fingerprinted with a hash of their
+    content, compressed copies are written next to them and a manifest maps
+    the logical names used in templates to the fingerprinted files.
+
+    The manifest is built by `monstor_admin build_static <static_path>` and
+    is picked up by :func:`monstor.app.make_app` from the `static_path`.
+
+    :copyright: (c) 2012 by Openlabs Technologies & Consulting (P) Limited
+    :license: BSD, see LICENSE for more details.
+"""
+import os
+import re
+import json
+import gzip
+import hashlib
+import logging
+import datetime
+import mimetypes
+
+import tornado.web
+
+MANIFEST_NAME = 'manifest.json'
+
+#: Files with these extensions are written with a gzip compressed sibling
+COMPRESSIBLE_EXTENSIONS = frozenset([
+    '.css', '.js', '.html', '.htm', '.txt', '.xml', '.json', '.svg',
+])
+
+#: Matches the names written by :func:`fingerprint` and their `.gz` siblings
+GENERATED_RE = re.compile(r'\.([0-9a-f]{12})(\.[^./]*)?(\.gz)?$')
+
+logger = logging.getLogger(__name__)
+
+
+class StaticManifest(object):
+    """The mapping of logical asset names to their fingerprinted files
+
+    :param assets: dictionary of logical name to fingerprinted name
+    :param compressed: fingerprinted names which have a `.gz` sibling
+    """
+
+    def __init__(self, assets=None, compressed=None):
+        self.assets = assets or {}
+        self.compressed = frozenset(compressed or [])
+        self.fingerprinted = frozenset(self.assets.itervalues())
+
+    def resolve(self, name):
+        """Returns the fingerprinted name of the asset or None"""
+        return self.assets.get(name)
+
+    @classmethod
+    def load(cls, static_path):
+        """Loads the manifest from the static path. Returns None if there is
+        no manifest in the folder.
+        """
+        path = os.path.join(static_path, MANIFEST_NAME)
+        if not os.path.isfile(path):
+            return None
+        with open(path, 'rb') as manifest_file:
+            data = json.load(manifest_file)
+        return cls(data.get('assets'), data.get('compressed'))
+
+    def save(self, static_path):
+        """Writes the manifest to the static path"""
+        path = os.path.join(static_path, MANIFEST_NAME)
+        with open(path, 'wb') as manifest_file:
+            json.dump({
+                'assets': self.assets,
+                'compressed': sorted(self.compressed),
+            }, manifest_file, indent=2, sort_keys=True)
+
+
+def fingerprint(name, content, length=12):
+    """Returns the name of the file with the hash of the content inserted
+    before the extension
+
+    >>> fingerprint('css/site.css', 'body {}')
+    'css/site.fcdce6b6d6e2.css'
+    """
+    root, ext = os.path.splitext(name)
+    digest = hashlib.md5(content).hexdigest()[:length]
+    return '%s.%s%s' % (root, digest, ext)
+
+
+def is_generated(name, content):
+    """Returns True if the file was written by :func:`build_static`: a copy
+    named with the fingerprint of its content or the gzip compressed sibling
+    of one
+    """
+    match = GENERATED_RE.search(name)
+    if match is None:
+        return False
+    if match.group(3):
+        return True
+    return fingerprint(name[:match.start()] + (match.group(2) or ''),
+        content) == name
+
+
+def build_static(static_path, compress_level=9):
+    """Fingerprints all the assets in the static path, writes gzip compressed
+    siblings for the compressible ones and saves the manifest.
+
+    Files produced by earlier builds are left in place (so that pages
+    rendered by workers running the previous releases keep working) but are
+    recognised by their names and not fingerprinted again.
+
+    :return: the :class:`StaticManifest` which was written
+    """
+    assets, compressed = {}, set()
+    for dirpath, dirnames, filenames in os.walk(static_path):
+        dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+        for filename in filenames:
+            if filename.startswith('.'):
+                continue
+            abspath = os.path.join(dirpath, filename)
+            name = os.path.relpath(abspath, static_path).replace(os.sep, '/')
+            if name == MANIFEST_NAME:
+                continue
+
+            with open(abspath, 'rb') as asset_file:
+                content = asset_file.read()
+            if is_generated(name, content):
+                continue
+            target = fingerprint(name, content)
+            assets[name] = target
+            target_path = os.path.join(static_path, target)
+            if not os.path.exists(target_path):
+                with open(target_path, 'wb') as target_file:
+                    target_file.write(content)
+
+            if os.path.splitext(name)[1].lower() in COMPRESSIBLE_EXTENSIONS:
+                compressed.add(target)
+                if not os.path.exists(target_path + '.gz'):
+                    # mtime is fixed so that rebuilds are byte identical
+                    with open(target_path + '.gz', 'wb') as gz_file:
+                        gz = gzip.GzipFile(
+                            filename='', mode='wb', fileobj=gz_file,
+                            compresslevel=compress_level, mtime=0
+                        )
+                        gz.write(content)
+                        gz.close()
+            logger.info("%s -> %s", name, target)
+
+    manifest = StaticManifest(assets, compressed)
+    manifest.save(static_path)
+    return manifest
+
+
+class StaticFileHandler(tornado.web.StaticFileHandler):
+    """A static file handler which resolves asset names through the
+    :class:`StaticManifest` in the `static_manifest` setting.
+
+    URLs built with `static_url` point at the fingerprinted files, which are
+    served with far-future cache headers and, when the client accepts it,
+    from their precompressed sibling. No hashing or stat calls are needed to
+    build the URLs.
+    """
+
+    @classmethod
+    def make_static_url(cls, settings, path):
+        manifest = settings.get('static_manifest')
+        target = manifest and manifest.resolve(path)
+        if target is None:
+            return super(StaticFileHandler, cls).make_static_url(
+                settings, path
+            )
+        return settings.get('static_url_prefix', '/static/') + target
+
+    def get(self, path, include_body=True):
+        manifest = self.settings.get('static_manifest')
+        if manifest is None or path not in manifest.fingerprinted:
+            return super(StaticFileHandler, self).get(path, include_body)
+
+        # The content of a fingerprinted file never changes, so the name is
+        # a sufficient validator
+        etag = '"%s"' % path
+        self.set_header("Etag", etag)
+        self.set_header("Cache-Control", "public, max-age=%d" %
+            self.CACHE_MAX_AGE)
+        self.set_header("Expires", datetime.datetime.utcnow() +
+            datetime.timedelta(seconds=self.CACHE_MAX_AGE))
+        mime_type, encoding = mimetypes.guess_type(path)
+        if mime_type:
+            self.set_header("Content-Type", mime_type)
+        self.set_extra_headers(path)
+
+        if self.request.headers.get("If-None-Match") == etag or \
+                self.request.headers.get("If-Modified-Since"):
+            self.set_status(304)
+            return
+
+        abspath = os.path.join(self.root, path)
+        if path in manifest.compressed:
+            self.set_header("Vary", "Accept-Encoding")
+            if "gzip" in self.request.headers.get("Accept-Encoding", ""):
+                self.set_header("Content-Encoding", "gzip")
+                abspath += '.gz'
+        try:
+            with open(abspath, "rb") as asset_file:
+                data = asset_file.read()
+        except IOError:
+            raise tornado.web.HTTPError(404)
+        if include_body:
+            self.write(data)
+        else:
+            self.set_header("Content-Length", len(data))
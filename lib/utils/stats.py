@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+"""
+    stats
+
+    Statistics helpers for the timings reported by monstor
+
+    :copyright: (c) 2012 by Openlabs Technologies & Consulting (P) Limited
+    :license: BSD, see LICENSE for more details.
+"""
+
+
+def percentile(values, percent):
+    """Returns the percentile of the values, interpolating linearly between
+    the closest ranks
+
+    >>> percentile([1, 2, 3, 4], 50)
+    2.5
+    >>> percentile([3, 1, 2], 100)
+    3
+    """
+    if not values:
+        raise ValueError("percentile of an empty sequence")
+    values = sorted(values)
+    rank = (len(values) - 1) * percent / 100.0
+    lower = int(rank)
+    if lower == len(values) - 1:
+        return values[lower]
+    return values[lower] + (values[lower + 1] - values[lower]) * (rank - lower)
+
+
+def summarize(values, percents=(50, 90, 95, 99)):
+    """Returns a dictionary with the count, minimum, maximum, mean and the
+    given percentiles (as `p50`, `p90`...) of the values
+    """
+    summary = {
+        'count': len(values),
+        'min': min(values),
+        'max': max(values),
+        'mean': sum(values) / float(len(values)),
+    }
+    for percent in percents:
+        summary['p%d' % percent] = percentile(values, percent)
+    return summary
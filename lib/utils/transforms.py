@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+    transforms
+
+    Output transforms for the responses of a monstor application
+
+    :copyright: (c) 2012 by Openlabs Technologies & Consulting (P) Limited
+    :license: BSD, see LICENSE for more details.
+"""
+import zlib
+import hashlib
+
+from tornado.web import OutputTransform
+from tornado.options import define, options
+
+from monstor.utils.cache import LRUCache
+
+define("compress", type=bool, default=False,
+    help="Compress responses with gzip when the client accepts it")
+define("compress_level", type=int, default=6,
+    help="Compression level (1-9) used for responses")
+define("compress_min_length", type=int, default=256,
+    help="Responses smaller than this (in bytes) are not compressed")
+define("compress_types", multiple=True, default=[
+        "text/plain", "text/html", "text/css", "text/xml",
+        "text/javascript", "application/javascript",
+        "application/x-javascript", "application/json", "application/xml",
+        "application/atom+xml", "application/xhtml+xml",
+    ], help="Content types which are compressed")
+define("compress_cache_size", type=int, default=64,
+    help="Number of compressed response bodies kept in memory")
+define("compress_cache_max_length", type=int, default=256 * 1024,
+    help="Largest response body (in bytes) kept in the compression cache")
+
+
+class CompressionTransform(OutputTransform):
+    """Applies the gzip content encoding to the response depending on the
+    `compress_*` options.
+
+    Responses which are written in one go are looked up in a small LRU of
+    precompressed bodies keyed by the digest of the body, so pages and
+    fragments that are byte identical across requests are only compressed
+    once.
+
+    This transform replaces :class:`tornado.web.GZipContentEncoding` and is
+    set up by :func:`monstor.app.make_app` when the `compress` option is set.
+    """
+    #: The compressed bodies shared by all requests of the process, created
+    #: by :meth:`get_cache` once the options are parsed
+    cache = None
+
+    @classmethod
+    def get_cache(cls):
+        """Returns the cache of compressed bodies, created on first use with
+        `compress_cache_size` entries
+        """
+        if cls.cache is None:
+            cls.cache = LRUCache(options.compress_cache_size)
+        return cls.cache
+
+    def __init__(self, request):
+        self._compressing = request.supports_http_1_1() and \
+            "gzip" in request.headers.get("Accept-Encoding", "")
+        self._compressor = None
+
+    def transform_first_chunk(self, headers, chunk, finishing):
+        ctype = headers.get("Content-Type", "").split(";")[0].strip()
+        compressible = ctype in options.compress_types
+        if compressible:
+            vary = headers.get("Vary")
+            if not vary:
+                headers["Vary"] = "Accept-Encoding"
+            elif "accept-encoding" not in vary.lower():
+                headers["Vary"] = vary + ", Accept-Encoding"
+        # The transforms are not told the status, but the responses without
+        # a body (204, 304) are finished with an empty chunk
+        self._compressing = self._compressing and compressible and \
+            (not finishing or (
+                chunk and len(chunk) >= options.compress_min_length
+            )) and \
+            (finishing or "Content-Length" not in headers) and \
+            ("Content-Encoding" not in headers)
+        if not self._compressing:
+            return headers, chunk
+
+        headers["Content-Encoding"] = "gzip"
+        if finishing:
+            chunk = self.compress(chunk)
+        else:
+            chunk = self.transform_chunk(chunk, finishing)
+        if "Content-Length" in headers:
+            headers["Content-Length"] = str(len(chunk))
+        return headers, chunk
+
+    def transform_chunk(self, chunk, finishing):
+        if not self._compressing:
+            return chunk
+        if self._compressor is None:
+            self._compressor = self._make_compressor()
+        chunk = self._compressor.compress(chunk)
+        if finishing:
+            chunk += self._compressor.flush()
+        else:
+            chunk += self._compressor.flush(zlib.Z_SYNC_FLUSH)
+        return chunk
+
+    def compress(self, body):
+        """Returns the gzip compressed body, reusing a cached copy if the
+        same body has been compressed recently.
+        """
+        if len(body) > options.compress_cache_max_length:
+            compressor = self._make_compressor()
+            return compressor.compress(body) + compressor.flush()
+
+        key = (options.compress_level, hashlib.sha1(body).digest())
+        cache = self.get_cache()
+        compressed = cache.get(key)
+        if compressed is None:
+            compressor = self._make_compressor()
+            compressed = compressor.compress(body) + compressor.flush()
+            cache[key] = compressed
+        return compressed
+
+    @staticmethod
+    def _make_compressor():
+        # A wbits value of 16 + MAX_WBITS writes the gzip header and trailer
+        return zlib.compressobj(
+            options.compress_level, zlib.DEFLATED, 16 + zlib.MAX_WBITS
+        )
@@ -10,27 +10,153 @@
 import json
 from collections import defaultdict
 import re
+import calendar
+import functools
+import contextlib
+import email.utils
 from math import ceil
 from copy import copy
 import smtplib
 
 import tornado.web
-from tornado import options
-from monstor.utils import locale
+from tornado import options, stack_context
+from tornado.util import import_object
+from monstor.utils import locale, metrics, queries, stalls
+from monstor.utils.i18n import locale_context
+from monstor.utils.imports import ImportProfiler
+from monstor.utils.db import QuerySet, secondary_reads
+from monstor.utils.cache import LRUCache
 from speaklater import make_lazy_gettext
 from unidecode import unidecode
 
 _punct_re = re.compile(r'[\t !"#$%&\'()*\-/<=>?@\[\\\]^_`{|},.]+')
 
+#: Number of slugs of non-ASCII texts memoized by :func:`slugify`
+SLUG_CACHE_SIZE = 1024
+
+_slug_cache = LRUCache(SLUG_CACHE_SIZE)
+
 
 def slugify(text, delim=u'-'):
     """
     Generates an ASCII-only slug.
+
+    Plain ASCII text is slugged without :func:`unidecode`. The slugs of the
+    other texts, which are much more expensive to transliterate, are
+    memoized.
+    """
+    text = _punct_re.sub(u' ', text.lower())
+    try:
+        text.encode('ascii')
+    except UnicodeError:
+        key = (text, delim)
+        slug = _slug_cache.get(key)
+        if slug is None:
+            slug = _slug_cache[key] = unicode(delim.join(
+                unidecode(text).split()
+            ))
+        return slug
+    return unicode(delim.join(text.split()))
+
+
+def slugify_all(texts, delim=u'-'):
     """
+    Returns the slugs of the texts, slugging the texts repeated in the
+    sequence only once
+    """
+    slugs = {}
     result = []
-    for word in _punct_re.split(text.lower()):
-        result.extend(unidecode(word).split())
-    return unicode(delim.join(result))
+    for text in texts:
+        slug = slugs.get(text)
+        if slug is None:
+            slug = slugs[text] = slugify(text, delim)
+        result.append(slug)
+    return result
+
+
+def unique_slug(query_set, text, field='slug', delim=u'-'):
+    """
+    Returns the slug of the text, suffixed with the lowest number which is
+    not taken by a document of the query set (`title`, `title-2`, ...).
+
+    The slugs taken are found with a single query on the `field`, anchored
+    at the start of the slug so that an index on the field is used. Two
+    concurrent allocations can still pick the same slug: give the field a
+    unique index and allocate again if the save fails.
+    """
+    slug = slugify(text, delim)
+    db_field = query_set._document._fields[field].db_field
+    pattern = u'^%s(%s[0-9]+)?$' % (re.escape(slug), re.escape(delim))
+    taken = set(
+        query_set.clone().filter(
+            __raw__={db_field: {'$regex': pattern}}
+        ).scalar(field)
+    )
+    if slug not in taken:
+        return slug
+    number = 2
+    while u'%s%s%d' % (slug, delim, number) in taken:
+        number += 1
+    return u'%s%s%d' % (slug, delim, number)
+
+
+def conditional(method):
+    """Decorate the `get` method of a :class:`BaseHandler` to answer
+    conditional requests before the page is rendered.
+
+    The validators are taken from :meth:`BaseHandler.get_etag` and
+    :meth:`BaseHandler.get_last_modified`, which receive the same
+    arguments as the decorated method. If the client already has the
+    current representation a `304 Not Modified` is sent and the decorated
+    method is never called, so neither the page body nor the queries behind
+    it are evaluated::
+
+        class ArticleHandler(BaseHandler):
+
+            def get_last_modified(self, slug):
+                return Article.objects(slug=slug).only('updated').first().updated
+
+            @conditional
+            def get(self, slug):
+                ...
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self.request.method in ("GET", "HEAD") and \
+                self.check_not_modified(*args, **kwargs):
+            self.set_status(304)
+            self.finish()
+            return
+        return method(self, *args, **kwargs)
+    return wrapper
+
+
+class URLSpec(tornado.web.URLSpec):
+    """A :class:`tornado.web.URLSpec` which accepts the handler as a dotted
+    string reference. The handler is imported the first time a request
+    matches the URL, so that the modules of handlers which are never used
+    are not imported by the worker::
+
+        URLSpec(r'/login', 'monstor.contrib.auth.views.LoginHandler',
+            name='contrib.auth.login')
+    """
+
+    def __init__(self, pattern, handler_class, kwargs=None, name=None):
+        super(URLSpec, self).__init__(
+            pattern, handler_class, kwargs or {}, name
+        )
+
+    @property
+    def handler_class(self):
+        if isinstance(self._handler_class, basestring):
+            with ImportProfiler(options.options.import_profile) as profiler:
+                self._handler_class = import_object(self._handler_class)
+            profiler.report()
+        return self._handler_class
+
+    @handler_class.setter
+    def handler_class(self, value):
+        self._handler_class = value
 
 
 class BaseHandler(tornado.web.RequestHandler):
@@ -63,16 +189,74 @@ class BaseHandler(tornado.web.RequestHandler):
                 assert self._locale
         return self._locale
 
+    #: The :class:`monstor.utils.metrics.RequestRecord` of the request when
+    #: the metrics are collected
+    metrics_record = None
+
+    #: The :class:`monstor.utils.queries.QueryProfile` of the request when
+    #: the queries are profiled
+    query_profile = None
 
+    def _execute(self, transforms, *args, **kwargs):
+        """Executes the request within the request context of this handler.
 
-    def prepare(self):
-       from monstor.utils.i18n import t
-       t.clear()
-       t.appendleft(self.locale)
+        The context is entered through a stack context, so it is restored
+        around every callback of the request and the lazy strings translated
+        by :func:`monstor.utils.i18n.gettext` use the locale of the request
+        even when asynchronous requests are interleaved on the IOLoop.
+
+        The metrics and the query profile of the request are started here
+        rather than in :meth:`prepare`, so that requests rejected by the XSRF
+        check are counted too, and the time spent on MongoDB and SMTP is
+        attributed the same way as the locale.
+        """
+        self.metrics_record = metrics.registry.start_request()
+        self.query_profile = queries.start_profile()
+        with stack_context.StackContext(self._request_context):
+            super(BaseHandler, self)._execute(transforms, *args, **kwargs)
+
+    @contextlib.contextmanager
+    def _request_context(self):
+        with locale_context(lambda: self.locale):
+            with metrics.request_context(self.metrics_record):
+                with queries.profile_context(self.query_profile):
+                    with stalls.handler_context(self):
+                        yield
+
+    def finish(self, chunk=None):
+        if self.query_profile is not None and \
+                options.options.profile_queries_header and \
+                not self._headers_written:
+            self.set_header("X-Query-Profile", self.query_profile.summary())
+        super(BaseHandler, self).finish(chunk)
+
+    def on_finish(self):
+        """Records the metrics and logs the query profile of the request.
+        Subclasses overriding this method must call it.
+        """
+        if self.metrics_record is not None:
+            metrics.registry.finish_request(self, self.metrics_record)
+        if self.query_profile is not None:
+            self.query_profile.log(self.request)
+
+    def on_connection_close(self):
+        """Stops counting the request as in flight, since an asynchronous
+        request whose client went away may never finish. Subclasses
+        overriding this method must call it.
+        """
+        if self.metrics_record is not None:
+            metrics.registry.end_request(self.metrics_record)
+
+    #: The lazy gettext of the handler, built on first use of :attr:`_`
+    _lazy_gettext = None
 
     @property
     def _(self):
-        return make_lazy_gettext(lambda: self.locale.translate)
+        if self._lazy_gettext is None:
+            self._lazy_gettext = make_lazy_gettext(
+                lambda: self.locale.translate
+            )
+        return self._lazy_gettext
 
     def get_user_locale(self):
         """
@@ -136,7 +320,7 @@ class BaseHandler(tornado.web.RequestHandler):
         if not user_id:
             return None
         User = self.get_user_model()
-        return User.objects().with_id(user_id)
+        return secondary_reads(User.objects()).with_id(user_id)
 
     @property
     def messages(self):
@@ -204,6 +388,61 @@ class BaseHandler(tornado.web.RequestHandler):
             **kwargs
         )
 
+    def get_etag(self, *args, **kwargs):
+        """Returns a cheap validator for the representation of the page,
+        for example the version of the underlying documents, or None if the
+        page cannot be validated this way. Used by :func:`conditional`.
+
+        .. note::
+            If the page differs between users or locales the validator
+            must reflect that as well.
+        """
+        return None
+
+    def get_last_modified(self, *args, **kwargs):
+        """Returns the time (naive UTC datetime) at which the page was last
+        modified or None if it is not known. Used by :func:`conditional`.
+        """
+        return None
+
+    def check_not_modified(self, *args, **kwargs):
+        """Sets the `Etag` and `Last-Modified` headers from the validators
+        of the handler and returns True if the client copy, as described by
+        `If-None-Match` or `If-Modified-Since`, is still current.
+
+        Pages with pending flash messages are never considered unmodified
+        because the messages have to be rendered. They are sent without the
+        validators so that the client does not cache them as the page.
+        """
+        if any(self.messages.itervalues()):
+            return False
+
+        etag = self.get_etag(*args, **kwargs)
+        last_modified = self.get_last_modified(*args, **kwargs)
+        if etag is None and last_modified is None:
+            return False
+
+        if etag is not None:
+            etag = '"%s"' % etag
+            self.set_header("Etag", etag)
+        if last_modified is not None:
+            self.set_header("Last-Modified", last_modified)
+
+        inm = self.request.headers.get("If-None-Match")
+        if inm and etag is not None:
+            # If-None-Match takes precedence over If-Modified-Since
+            tags = [tag.strip() for tag in inm.split(",")]
+            return "*" in tags or etag in tags or ('W/' + etag) in tags
+
+        ims = self.request.headers.get("If-Modified-Since")
+        if ims and last_modified is not None:
+            ims = email.utils.parsedate(ims)
+            if ims is None:
+                return False
+            return calendar.timegm(last_modified.utctimetuple()) <= \
+                calendar.timegm(ims)
+        return False
+
     is_xhr = property(
         lambda x: x.get_argument("X-Requested-With", "").\
             lower() == "xmlhttprequest",
@@ -218,22 +457,23 @@ class BaseHandler(tornado.web.RequestHandler):
         :param receiver: email Id of the receiver
         :param message: email content
         """
-        if options.options.smtp_ssl:
-            smtp_server = smtplib.SMTP_SSL(
-                options.options.smtp_server, options.options.smtp_port
-            )
-        else:
-            smtp_server = smtplib.SMTP(
-                options.options.smtp_server, options.options.smtp_port
-            )
-        if options.options.smtp_tls:
-            smtp_server.starttls()
-        if options.options.smtp_user and options.options.smtp_password:
-            smtp_server.login(
-                options.options.smtp_user, options.options.smtp_password
-            )
-        smtp_server.sendmail(sender, receiver, message)
-        smtp_server.quit()
+        with metrics.timed('smtp'):
+            if options.options.smtp_ssl:
+                smtp_server = smtplib.SMTP_SSL(
+                    options.options.smtp_server, options.options.smtp_port
+                )
+            else:
+                smtp_server = smtplib.SMTP(
+                    options.options.smtp_server, options.options.smtp_port
+                )
+            if options.options.smtp_tls:
+                smtp_server.starttls()
+            if options.options.smtp_user and options.options.smtp_password:
+                smtp_server.login(
+                    options.options.smtp_user, options.options.smtp_password
+                )
+            smtp_server.sendmail(sender, receiver, message)
+            smtp_server.quit()
 
 
 class Pagination(object):
@@ -241,14 +481,22 @@ class Pagination(object):
     A pagination object which works with Mongoengine Query Sets
     """
 
-    def __init__(self, page, per_page, query_set):
+    def __init__(self, page, per_page, query_set, read_preference=None):
         """
         :param page: The page to be displayed
         :param per_page: Items per page
         :param query_set: The query set based on which pagination is to be done
+        :param read_preference: The read preference of the queries for the
+                                count and the items. Defaults to the
+                                `db_read_preference` option.
         """
         self.page = page
         self.per_page = per_page
+        self.read_preference = read_preference
+        if read_preference is None:
+            query_set = secondary_reads(query_set)
+        elif isinstance(query_set, QuerySet):
+            query_set = query_set.clone().read_preference(read_preference)
         self.query_set = query_set
 
     @property
@@ -280,11 +528,15 @@ class Pagination(object):
 
     def prev(self):
         """Returns a :class:`Pagination` object for the previous page."""
-        return Pagination(self.page - 1, self.per_page, self.query_set)
+        return Pagination(
+            self.page - 1, self.per_page, self.query_set, self.read_preference
+        )
 
     def next(self):
         """Returns a :class:`Pagination` object for the next page."""
-        return Pagination(self.page + 1, self.per_page, self.query_set)
+        return Pagination(
+            self.page + 1, self.per_page, self.query_set, self.read_preference
+        )
 
     #: Attributes below this may not require modifications in general cases
 
@@ -8,29 +8,98 @@
     :license: BSD, see LICENSE for more details.
 """
 from __future__ import absolute_import
+import json
+
+from tornado.web import HTTPError
 from wtforms import validators
 from monstor.utils.i18n import _
 
 
+def json_form_value(value):
+    """Returns a value of a JSON body as the text of a form input"""
+    if isinstance(value, basestring):
+        return value
+    if isinstance(value, bool):
+        return value and u'true' or u'false'
+    if value is None:
+        return u''
+    if isinstance(value, (int, long, float)):
+        return unicode(value)
+    return json.dumps(value)
+
+
 class TornadoMultiDict(object):
     """A wrapper to make the tornado request handler to be compatible with the
     multidict format used by WTForms
+
+    The arguments are decoded the first time a form asks for them and kept
+    on the handler, so each is decoded once per request whatever the number
+    of forms and fields reading it.
+
+    The object posted as the body of a request with the `application/json`
+    content type is read as arguments too, after those of the query string,
+    so API clients can post JSON to the handlers of the HTML forms. Lists
+    are the values of repeated arguments, `true` and `false` the values of
+    a checkbox. The body is parsed on the first access to the arguments.
     """
 
     def __init__(self, handler):
         self.handler = handler
+        arguments = getattr(handler, '_multidict_arguments', None)
+        if arguments is None:
+            arguments = handler._multidict_arguments = {}
+        self._arguments = arguments
+
+    @property
+    def json_arguments(self):
+        """The arguments of the JSON body, parsed once per request"""
+        handler = self.handler
+        try:
+            return handler._multidict_json
+        except AttributeError:
+            pass
+        request = handler.request
+        content_type = request.headers.get('Content-Type', '')
+        if content_type.split(';')[0].strip() != 'application/json':
+            handler._multidict_json = {}
+            return handler._multidict_json
+        try:
+            body = json.loads(request.body or '{}')
+        except ValueError:
+            raise HTTPError(400, "Invalid JSON body")
+        if not isinstance(body, dict):
+            raise HTTPError(400, "The JSON body must be an object")
+        handler._multidict_json = dict(
+            (name, [json_form_value(v) for v in value]
+                if isinstance(value, list) else [json_form_value(value)])
+            for name, value in body.iteritems()
+        )
+        return handler._multidict_json
+
+    def _names(self):
+        names = self.handler.request.arguments
+        if self.json_arguments:
+            names = set(names).union(self.json_arguments)
+        return names
 
     def __iter__(self):
-        return iter(self.handler.request.arguments) 
+        return iter(self._names())
 
     def __len__(self):
-        return len(self.handler.request.arguments) 
+        return len(self._names())
 
     def __contains__(self, name):
-        return (name in self.handler.request.arguments) 
+        return name in self.handler.request.arguments or \
+            name in self.json_arguments
 
     def getlist(self, name):
-        return self.handler.get_arguments(name, strip=False) 
+        try:
+            return self._arguments[name]
+        except KeyError:
+            values = self._arguments[name] = \
+                self.handler.get_arguments(name, strip=False) + \
+                self.json_arguments.get(name, [])
+            return values
 
 
 REQUIRED_VALIDATOR = validators.Required(message=_("This field is required"))
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""
+    test_api
+
+    Test the bearer tokens of the JSON API
+
+    :copyright: (c) 2012 by Openlabs Technologies & Consulting (P) Limited
+    :license: BSD, see LICENSE for more details.
+"""
+import os
+import json
+import unittest
+
+import tornado
+from bson import ObjectId
+from tornado import testing
+from tornado.options import options
+from tornado.web import Application
+from monstor.app import make_app
+from monstor.contrib.auth.api import APIHandler, token_required, \
+    revocations, create_token, load_token
+from monstor.contrib.auth.models import User
+from monstor.utils.web import BaseHandler
+from mongoengine.connection import get_connection
+
+COOKIE_SECRET = 'nbgdhfjvgdfglkjdfkgjdfi'
+
+
+class WhoAmIHandler(APIHandler):
+
+    @token_required
+    def get(self):
+        self.write({'user_id': self.current_user.user_id})
+
+
+class TestBearerToken(testing.AsyncHTTPTestCase):
+
+    def get_app(self):
+        return Application(
+            [(r'/whoami', WhoAmIHandler)], cookie_secret=COOKIE_SECRET
+        )
+
+    def setUp(self):
+        super(TestBearerToken, self).setUp()
+        self.user = User(id=ObjectId(), name="Test User")
+        self.token = create_token(COOKIE_SECRET, self.user)
+
+    def tearDown(self):
+        options.api_token_revocation = False
+        revocations.token_ids = frozenset()
+        revocations.loaded = 0
+        super(TestBearerToken, self).tearDown()
+
+    def whoami(self, token):
+        return self.fetch('/whoami', headers={
+            'Authorization': 'Bearer %s' % token
+        })
+
+    def test_0010_valid(self):
+        """
+        A valid token authenticates the user without a query
+        """
+        response = self.whoami(self.token)
+        self.assertEqual(response.code, 200)
+        self.assertEqual(
+            json.loads(response.body), {'user_id': str(self.user.id)}
+        )
+
+    def test_0020_invalid(self):
+        """
+        A missing or tampered token is answered with 401
+        """
+        response = self.fetch('/whoami')
+        self.assertEqual(response.code, 401)
+        self.assertEqual(response.headers['WWW-Authenticate'], 'Bearer')
+        self.assertTrue('error' in json.loads(response.body))
+        self.assertEqual(self.whoami(self.token[:-1] + '_').code, 401)
+
+    def test_0030_expired(self):
+        """
+        A token older than api_token_max_age is answered with 401
+        """
+        options.api_token_max_age = -1
+        try:
+            self.assertEqual(self.whoami(self.token).code, 401)
+        finally:
+            options.api_token_max_age = 30 * 24 * 3600
+
+    def test_0040_revoked(self):
+        """
+        A token in the cached revocation list is answered with 401
+        """
+        options.api_token_revocation = True
+        token_id = load_token(COOKIE_SECRET, self.token).token_id
+        revocations.token_ids = frozenset([token_id])
+        revocations.loaded = float('inf')
+        self.assertEqual(self.whoami(self.token).code, 401)
+
+
+class DummyHomeHandler(BaseHandler):
+    def get(self):
+        self.write("Welcome Home")
+
+
+class urls(object):
+    HANDLERS = [
+        tornado.web.URLSpec(r'/', DummyHomeHandler, name='home')
+    ]
+
+
+class TestTokenHandler(testing.AsyncHTTPTestCase):
+
+    def get_app(self):
+        options.database = 'test_api'
+        return make_app(
+            installed_apps=['monstor.contrib.auth', __name__],
+            template_path=os.path.join(
+                os.path.dirname(__file__), "templates"
+            ),
+            cookie_secret=COOKIE_SECRET,
+        )
+
+    def setUp(self):
+        super(TestTokenHandler, self).setUp()
+        options.auth_api = True
+
+    def tearDown(self):
+        options.auth_api = False
+        get_connection().drop_database('test_api')
+
+    def test_0010_token(self):
+        """
+        A token is issued for valid credentials, with the XSRF check on
+        """
+        user = User(name="Test User", email="test@example.com")
+        user.set_password("password")
+        user.save()
+        response = self.fetch(
+            '/api/token', method='POST', body=json.dumps({
+                'email': 'test@example.com', 'password': 'wrong'
+            }), headers={'Content-Type': 'application/json'}
+        )
+        self.assertEqual(response.code, 401)
+        response = self.fetch(
+            '/api/token', method='POST', body=json.dumps({
+                'email': 'test@example.com', 'password': 'password'
+            }), headers={'Content-Type': 'application/json'}
+        )
+        self.assertEqual(response.code, 200)
+        data = json.loads(response.body)
+        self.assertEqual(data['user']['id'], str(user.id))
+        self.assertEqual(data['token_type'], 'Bearer')
+
+    def test_0020_disabled(self):
+        """
+        The API is not served without the auth_api option
+        """
+        options.auth_api = False
+        response = self.fetch(
+            '/api/token', method='POST', body=json.dumps({
+                'email': 'test@example.com', 'password': 'password'
+            }), headers={'Content-Type': 'application/json'}
+        )
+        self.assertEqual(response.code, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+    test_audit
+
+    Test the login audit trail and the login statistics
+
+    :copyright: (c) 2012 by Openlabs Technologies & Consulting (P) Limited
+    :license: BSD, see LICENSE for more details.
+"""
+import json
+import unittest
+from datetime import datetime, timedelta
+
+from mongoengine import connect
+from tornado import testing
+from tornado.options import options
+from tornado.web import Application
+from monstor.contrib.auth.audit import LoginAudit, coalesce
+from monstor.contrib.auth.models import User, LoginEvent
+from monstor.contrib.auth.signals import login_failure
+from monstor.utils.web import BaseHandler
+
+NOW = datetime(2012, 6, 1, 12, 0)
+
+
+def event(success, user_id=None, email=None, minutes=0):
+    return {
+        'user_model': User, 'user_id': user_id, 'email': email,
+        'success': success, 'provider': 'LoginHandler',
+        'remote_ip': '127.0.0.1', 'user_agent': None,
+        'created': NOW + timedelta(minutes=minutes),
+    }
+
+
+class TestCoalesce(unittest.TestCase):
+
+    def test_0010_coalesce(self):
+        """
+        The events of a user are coalesced in a single update
+        """
+        updates = coalesce([
+            event(True, 1, 'a@example.com'),
+            event(False, None, 'a@example.com', 1),
+            event(True, 1, 'a@example.com', 2),
+            event(False, None, None),
+        ])
+        self.assertEqual(updates, {
+            (User, 'pk', 1): {
+                'inc__login_count': 2,
+                'set__last_login': NOW + timedelta(minutes=2),
+            },
+            (User, 'email', 'a@example.com'): {
+                'inc__failed_login_count': 1,
+                'set__last_failed_login': NOW + timedelta(minutes=1),
+            },
+        })
+
+
+class TestLoginAudit(testing.AsyncHTTPTestCase):
+
+    def get_app(self):
+
+        class FailureHandler(BaseHandler):
+            def get(self):
+                login_failure.send(self)
+                self.write("Failed")
+
+            post = get
+
+        return Application([(r'/failure', FailureHandler)])
+
+    def setUp(self):
+        super(TestLoginAudit, self).setUp()
+        options.login_audit = True
+        self.audit = LoginAudit(self.io_loop)
+        login_failure.connect(self.audit.on_failure)
+
+    def tearDown(self):
+        login_failure.disconnect(self.audit.on_failure)
+        self.audit.events = []
+        self.audit.stop()
+        options.login_audit = False
+        super(TestLoginAudit, self).tearDown()
+
+    def test_0010_record(self):
+        """
+        The events are buffered without touching the database
+        """
+        self.fetch('/failure?email=a%40example.com')
+        self.assertEqual(len(self.audit.events), 1)
+        recorded = self.audit.events[0]
+        self.assertEqual(recorded['email'], 'a@example.com')
+        self.assertEqual(recorded['provider'], 'FailureHandler')
+        self.assertEqual(recorded['user_model'], User)
+        self.assertFalse(recorded['success'])
+
+    def test_0020_json(self):
+        """
+        The email of a JSON body is recorded
+        """
+        self.fetch(
+            '/failure', method='POST',
+            body=json.dumps({'email': 'a@example.com'}),
+            headers={'Content-Type': 'application/json'}
+        )
+        self.assertEqual(self.audit.events[0]['email'], 'a@example.com')
+
+
+class TestWrite(unittest.TestCase):
+    """Test the writes of the audit trail"""
+
+    @classmethod
+    def setUpClass(cls):
+        connect("test_audit")
+
+    def setUp(self):
+        User.drop_collection()
+        LoginEvent.drop_collection()
+        self.user = User(name="Test User", email="test@example.com")
+        self.user.save()
+
+    def test_0010_write(self):
+        """
+        The events are inserted and the counters updated
+        """
+        LoginAudit().write([
+            event(True, self.user.id, self.user.email),
+            event(True, self.user.id, self.user.email, 1),
+            event(False, None, self.user.email, 2),
+        ])
+        user = User.objects.with_id(self.user.id)
+        self.assertEqual(user.login_count, 2)
+        self.assertEqual(user.last_login, NOW + timedelta(minutes=1))
+        self.assertEqual(user.failed_login_count, 1)
+        self.assertEqual(LoginEvent.objects.count(), 3)
+        self.assertEqual(
+            user.get_login_history(1)[0].created, NOW + timedelta(minutes=2)
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
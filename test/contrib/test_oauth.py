@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+    test_oauth
+
+    Test the HTTP client of the OAuth flows against a fake provider
+
+    :copyright: (c) 2012 by Openlabs Technologies & Consulting (P) Limited
+    :license: BSD, see LICENSE for more details.
+"""
+import time
+import json
+import unittest
+from urllib import urlencode
+
+import tornado.web
+import tornado.auth
+from tornado import httpclient
+from tornado.ioloop import IOLoop
+from tornado.options import options
+from tornado.testing import AsyncHTTPTestCase
+from monstor.contrib.auth import oauth
+from monstor.exc import InvalidRequestError
+from monstor.utils import metrics
+from monstor.utils.web import BaseHandler, URLSpec
+
+
+class FakeOpenIdHandler(tornado.web.RequestHandler):
+    """The check_authentication endpoint of an OpenID provider"""
+
+    def post(self):
+        self.write("ns:http://specs.openid.net/auth/2.0\nis_valid:true\n")
+
+
+class SlowHandler(tornado.web.RequestHandler):
+    """A provider which answers after a second"""
+
+    @tornado.web.asynchronous
+    def get(self):
+        IOLoop.instance().add_timeout(time.time() + 1, self.finish)
+
+
+class TestOAuthClient(AsyncHTTPTestCase, unittest.TestCase):
+
+    def get_new_ioloop(self):
+        # tornado.auth uses the client of the singleton IOLoop
+        return IOLoop.instance()
+
+    def get_app(self):
+        endpoint = self.get_url('/openid')
+
+        class GoogleHandler(oauth.OAuthClientMixin, BaseHandler,
+                tornado.auth.GoogleMixin):
+            _OPENID_ENDPOINT = endpoint
+
+            @tornado.web.asynchronous
+            def get(self):
+                self.get_authenticated_user(self.async_callback(self._on_auth))
+
+            def _on_auth(self, user):
+                self.finish({'email': user and user['email']})
+
+        return tornado.web.Application([
+            (r'/openid', FakeOpenIdHandler),
+            (r'/slow', SlowHandler),
+            URLSpec(r'/auth/google', GoogleHandler, name='test.google'),
+        ])
+
+    def setUp(self):
+        super(TestOAuthClient, self).setUp()
+        metrics.registry = metrics.Metrics()
+        options.metrics = True
+
+    def tearDown(self):
+        options.metrics = False
+        client = oauth._clients.pop(self.io_loop, None)
+        if client is not None:
+            client.close()
+        super(TestOAuthClient, self).tearDown()
+
+    def test_0010_openid(self):
+        """
+        The OpenID response is verified through the shared client and the
+        time spent on the provider is recorded
+        """
+        response = self.fetch('/auth/google?' + urlencode({
+            'openid.mode': 'id_res',
+            'openid.ns.ax': 'http://openid.net/srv/ax/1.0',
+            'openid.ax.type.email': 'http://axschema.org/contact/email',
+            'openid.ax.value.email': 'test@example.com',
+        }))
+        self.assertEqual(
+            json.loads(response.body), {'email': 'test@example.com'}
+        )
+        # The client is only replaced for the requests of the handler
+        self.assertTrue(tornado.auth.httpclient is httpclient)
+        histograms = metrics.registry.histograms
+        self.assertEqual(
+            histograms[('upstream_duration_seconds', 'localhost')].count, 1
+        )
+        self.assertTrue(
+            histograms[('request_upstream_seconds', 'test.google')].sum > 0
+        )
+
+    def test_0020_timeout(self):
+        """
+        The requests to a slow provider time out
+        """
+        oauth.get_client(self.io_loop).timeouts = oauth.parse_timeouts(
+            ['localhost=1:0.2']
+        )
+        oauth.get_client(self.io_loop).fetch(self.get_url('/slow'), self.stop)
+        response = self.wait()
+        self.assertEqual(response.code, 599)
+        self.assertTrue(response.request_time < 1)
+
+    def test_0025_request_timeout(self):
+        """
+        The timeouts set by the caller are kept
+        """
+        oauth.get_client(self.io_loop).timeouts = oauth.parse_timeouts(
+            ['localhost=1:0.2']
+        )
+        oauth.get_client(self.io_loop).fetch(
+            self.get_url('/slow'), self.stop, request_timeout=5
+        )
+        response = self.wait(timeout=5)
+        self.assertEqual(response.code, 200)
+
+    def test_0030_parse_timeouts(self):
+        """
+        The timeouts are given as host=connect:request
+        """
+        self.assertEqual(
+            oauth.parse_timeouts(['api.twitter.com=2:5.5']),
+            {'api.twitter.com': (2.0, 5.5)}
+        )
+        self.assertRaises(
+            InvalidRequestError, oauth.parse_timeouts, ['api.twitter.com=2']
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
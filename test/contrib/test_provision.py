@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""
+    test_provision
+
+    Test the single write provisioning and registration of the users
+
+    :copyright: (c) 2012 by Openlabs Technologies & Consulting (P) Limited
+    :license: BSD, see LICENSE for more details.
+"""
+import unittest
+
+from mongoengine import connect, ValidationError
+from pymongo.errors import DuplicateKeyError
+from monstor.exc import InvalidRequestError
+from monstor.contrib.auth.models import User
+
+
+class TestProvision(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        connect("test_provision")
+
+    def setUp(self):
+        User.drop_collection()
+        User._identity_indexes = False
+
+    def provision(self, picture='a.png', email='test@example.com'):
+        return User.provision(
+            [
+                {'facebook_id': '42'},
+                {'email': email, 'facebook_id': {'$exists': False}},
+            ],
+            {'facebook_id': '42', 'facebook_picture': picture},
+            {'name': 'Test User', 'email': email}
+        )
+
+    def test_0010_create(self):
+        """
+        A new user is created from the fields and the defaults
+        """
+        user, previous = self.provision()
+        self.assertEqual(previous, None)
+        user = User.objects.with_id(user.id)
+        self.assertEqual(user.name, 'Test User')
+        self.assertEqual(user.facebook_id, '42')
+
+    def test_0020_update(self):
+        """
+        An existing user is updated and the previous values returned
+        """
+        created, _previous = self.provision()
+        user, previous = self.provision('b.png')
+        self.assertEqual(user.id, created.id)
+        self.assertEqual(user.facebook_picture, 'b.png')
+        self.assertEqual(previous['facebook_picture'], 'a.png')
+        self.assertEqual(User.objects.count(), 1)
+
+    def test_0030_link(self):
+        """
+        The account is linked to the user of the same email
+        """
+        existing = User(name="Existing User", email="test@example.com")
+        existing.save()
+        user, previous = self.provision()
+        self.assertEqual(user.id, existing.id)
+        self.assertEqual(user.name, 'Existing User')
+        self.assertEqual(previous['facebook_id'], None)
+        self.assertEqual(User.objects.with_id(user.id).facebook_id, '42')
+
+    def test_0040_unique(self):
+        """
+        The unique indexes reject the duplicates but not the missing values
+        """
+        self.provision()
+        collection = User._get_collection()
+        self.assertRaises(
+            DuplicateKeyError, collection.insert,
+            {'_types': ['User'], 'email': 'test@example.com'}, safe=True
+        )
+        User(name="Twitter User", twitter_id='1').save()
+        User(name="Other Twitter User", twitter_id='2').save()
+        self.assertEqual(User.objects.count(), 3)
+        self.assertTrue(
+            'unique_email' in User._get_collection().index_information()
+        )
+
+    def test_0050_priority(self):
+        """
+        The conditions are tried in order, so the user of the facebook
+        account is found before the user of the same email
+        """
+        linked, _previous = self.provision(email='other@example.com')
+        User(name="Existing User", email="test@example.com").save()
+        user, previous = self.provision()
+        self.assertEqual(user.id, linked.id)
+        self.assertEqual(User.objects.count(), 2)
+
+    def test_0060_invalid(self):
+        """
+        Provisioning without identity or taking the identity of another
+        user is rejected
+        """
+        self.assertRaises(
+            ValidationError, User.provision, [{'email': None}], {}
+        )
+        self.provision()
+        User(name="Other User", email="other@example.com").save()
+        self.assertRaises(
+            ValidationError, User.provision,
+            [{'email': 'other@example.com'}], {'facebook_id': '42'}
+        )
+
+    def test_0070_missing_index(self):
+        """
+        The unique indexes which cannot be built are reported
+        """
+        collection = User._get_collection()
+        for name in ("Test User", "Other User"):
+            collection.insert(
+                {'_types': ['User'], 'name': name, 'email': 'a@example.com'},
+                safe=True
+            )
+        self.assertRaises(InvalidRequestError, User.ensure_identity_indexes)
+        self.assertFalse(User._identity_indexes)
+
+    def test_0080_migrate(self):
+        """
+        The non unique indexes of an existing database are replaced by the
+        unique ones once the duplicates are removed
+        """
+        collection = User._get_collection()
+        collection.ensure_index('email')
+        for name in ("Test User", "Other User"):
+            collection.insert(
+                {'_types': ['User'], 'name': name, 'email': 'a@example.com'},
+                safe=True
+            )
+        self.assertEqual(
+            User.migrate_identity_indexes(), {'email': ['a@example.com']}
+        )
+        self.assertFalse('email_1' in collection.index_information())
+        self.assertFalse(User._identity_indexes)
+
+        collection.remove({'name': "Other User"}, safe=True)
+        self.assertEqual(User.migrate_identity_indexes(), {})
+        self.assertTrue(User._identity_indexes)
+        indexes = collection.index_information()
+        self.assertTrue(indexes['unique_email']['unique'])
+        # The lookup index of the queries is kept
+        self.assertTrue('_types_1_email_1' in indexes)
+
+
+class TestRegister(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        connect("test_provision")
+
+    def setUp(self):
+        User.drop_collection()
+        User._identity_indexes = False
+
+    def test_0010_register(self):
+        """
+        The user is inserted with its password and state
+        """
+        user = User.register(
+            'test@example.com', 'password', name='Test User', active=True
+        )
+        self.assertEqual(User.objects.with_id(user.id).active, True)
+        self.assertEqual(
+            User.authenticate('test@example.com', 'password'), user
+        )
+
+    def test_0020_duplicate(self):
+        """
+        An email which is already registered is rejected
+        """
+        User.register('test@example.com', 'password', name='Test User')
+        self.assertEqual(
+            User.register('test@example.com', 'other', name='Other User'),
+            None
+        )
+        self.assertEqual(User.objects.count(), 1)
+
+    def test_0030_missing_index(self):
+        """
+        No user is registered while the unique index on the email is missing
+        """
+        collection = User._get_collection()
+        for name in ("Test User", "Other User"):
+            collection.insert(
+                {'_types': ['User'], 'name': name, 'email': 'a@example.com'},
+                safe=True
+            )
+        self.assertRaises(
+            InvalidRequestError, User.register,
+            'a@example.com', 'password', name='Third User'
+        )
+        self.assertEqual(User.objects.count(), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
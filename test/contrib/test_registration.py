@@ -293,6 +293,31 @@ class TestRegistration(testing.AsyncHTTPTestCase):
             response.body.count(u'Invalid Activation Key, Please register.'), 1
         )
 
+    def test_0150_registration_missing_index(self):
+        """
+        The registration fails without an error while the unique index on
+        the email cannot be built
+        """
+        collection = User._get_collection()
+        for name in ("Test User", "Other User"):
+            collection.insert(
+                {'_types': ['User'], 'name': name, 'email': 'a@example.com'},
+                safe=True
+            )
+        User._identity_indexes = False
+        response = self.fetch(
+            '/registration', method="POST", follow_redirects=False,
+            body=urlencode({'name':'anoop', 'email':'pqr@example.com',
+                'password':'openlabs', 'confirm_password':'openlabs'}
+            )
+        )
+        self.assertEqual(response.code, 200)
+        self.assertEqual(
+            response.body.count(
+                u'The registration failed, please try again later'
+            ), 1
+        )
+        self.assertEqual(User.objects(email='pqr@example.com').count(), 0)
 
     def tearDown(self):
         """
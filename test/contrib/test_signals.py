@@ -8,16 +8,20 @@
     :license: BSD, see LICENSE for more details.
 """
 import os
+import time
 import unittest
+import threading
 from urllib import urlencode
 
 import tornado
+from blinker import Signal
 from tornado import testing, options
 from monstor.app import make_app
 from monstor.contrib.auth.models import User
 from monstor.utils.web import BaseHandler
 from mongoengine.connection import get_connection
-from monstor.contrib.auth.signals import login_success, login_failure
+from monstor.contrib.auth.signals import login_success, login_failure, \
+    deferred
 
 COUNTER = {'success': 0, 'failure': 0}
 
@@ -118,5 +122,79 @@ class TestSignals(testing.AsyncHTTPTestCase):
         get_connection().drop_database('test_signal')
 
 
+class TestDeferredSignals(testing.AsyncTestCase):
+    """
+    Test the deferred receivers
+    """
+
+    def setUp(self):
+        super(TestDeferredSignals, self).setUp()
+        self.signal = Signal()
+
+    def test_0010_loop(self):
+        """
+        A deferred receiver runs after the signal is sent
+        """
+        received = []
+
+        @deferred(self.signal, io_loop=self.io_loop)
+        def receiver(sender, **kw):
+            received.append((sender, kw))
+            self.stop()
+
+        self.signal.send('sender', user='user')
+        self.assertEqual(received, [])
+        self.wait()
+        self.assertEqual(received, [('sender', {'user': 'user'})])
+
+    def test_0020_pool(self):
+        """
+        A deferred receiver with pool runs in a worker thread
+        """
+        received = []
+
+        @deferred(self.signal, pool=True)
+        def receiver(sender, **kw):
+            received.append(threading.current_thread())
+            self.io_loop.add_callback(self.stop)
+
+        self.signal.send('sender')
+        self.wait()
+        self.assertNotEqual(received, [threading.current_thread()])
+
+    def test_0030_batch(self):
+        """
+        The events are dispatched when the batch is full or on timeout
+        """
+        batches = []
+
+        @deferred(self.signal, batch_size=3, batch_interval=0.05,
+            io_loop=self.io_loop)
+        def receiver(events):
+            batches.append([sender for sender, kw in events])
+            self.stop()
+
+        for sender in xrange(4):
+            self.signal.send(sender)
+        self.wait()
+        self.assertEqual(batches, [[0, 1, 2]])
+        start = time.time()
+        self.wait()
+        self.assertEqual(batches, [[0, 1, 2], [3]])
+        self.assertTrue(time.time() - start < 1)
+
+    def test_0040_error(self):
+        """
+        An error in a deferred receiver does not reach the sender
+        """
+        @deferred(self.signal, io_loop=self.io_loop)
+        def receiver(sender, **kw):
+            self.io_loop.add_callback(self.stop)
+            raise ValueError(sender)
+
+        self.signal.send('sender')
+        self.wait()
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -33,6 +33,46 @@ class TestMakeApp(unittest.TestCase):
         app = make_app(installed_apps=[
             'monstor.contrib.auth',
         ])
+        phases = [phase for phase, seconds in app.startup_timings.phases]
+        self.assertEqual(
+            phases, ['options', 'database', 'apps', 'static', 'application']
+        )
+        self.assertEqual(
+            app.startup_timings.as_dict()['total'],
+            app.startup_timings.total
+        )
+
+    def test_0025_reload_translations(self):
+        """
+        The translations are watched when the option is set
+        """
+        from tornado.options import options
+        from monstor.utils.locale import TranslationsWatcher
+        options.database = 'test_db'
+        app = make_app(installed_apps=['monstor.contrib.auth'])
+        self.assertEqual(app.translations_watcher, None)
+        options.reload_translations = 10
+        try:
+            app = make_app(installed_apps=['monstor.contrib.auth'])
+        finally:
+            options.reload_translations = 0
+        self.assertTrue(
+            isinstance(app.translations_watcher, TranslationsWatcher)
+        )
+        app.translations_watcher.stop()
+
+    def test_0030_lazy_handlers(self):
+        """
+        The handlers of the apps are imported on first use
+        """
+        from monstor.app import load_app
+        from monstor.utils.web import BaseHandler
+        handlers, ui_modules = load_app('monstor.contrib.auth')
+        login = [h for h in handlers if h.name == 'contrib.auth.login'][0]
+        self.assertEqual(login.reverse(), '/login')
+        handler_class = login.handler_class
+        self.assertTrue(issubclass(handler_class, BaseHandler))
+        self.assertTrue(login.handler_class is handler_class)
 
 
 if __name__ == "__main__":
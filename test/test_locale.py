@@ -7,11 +7,17 @@
     :copyright: (c) 2012 by Openlabs Technologies & Consulting (P) LTD
     :license: BSD, see LICENSE for more details.
 """
+import os
+import time
+import shutil
+import tempfile
+from datetime import datetime
 import unittest2 as unittest
 
+import pytz
 import pycountry
-from tornado.web import Application
-from tornado.testing import AsyncHTTPTestCase
+from tornado.web import Application, asynchronous
+from tornado.testing import AsyncHTTPTestCase, AsyncTestCase
 from monstor.utils.web import BaseHandler
 from monstor.utils.i18n import _
 
@@ -32,6 +38,85 @@ class TestLocale(unittest.TestCase):
         t = locale.get("es")
         self.assertEqual(t.translate("United States"), u'Estados Unidos')
 
+    def test_0020_translation_cache(self):
+        """
+        Translated messages are memoized per locale
+        """
+        from monstor.utils import locale
+        locale.load_gettext_translations(pycountry.LOCALES_DIR, 'iso3166')
+        t = locale.get("pt")
+        t.translation_cache.clear()
+        self.assertEqual(t.translate("United States"), u'Estados Unidos')
+        self.assertEqual(t.translate("United States"), u'Estados Unidos')
+        stats = locale.translation_cache_stats()["pt"]
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+
+    def test_0030_format_dates(self):
+        """
+        Dates formatted with the cached patterns match babel and the batch
+        variants match formatting the values one by one
+        """
+        from babel import dates
+        from monstor.utils.locale import Locale
+        locale = Locale.parse('pt_BR')
+        values = [datetime(2007, 4, 1, 15, 30), datetime(2012, 12, 31, 23)]
+        tzinfo = pytz.timezone('Asia/Kolkata')
+        for format in ('full', 'medium', 'short', "yyyy.MM.dd 'at' HH:mm"):
+            self.assertEqual(
+                locale.format_datetime(values[0], format, tzinfo),
+                dates.format_datetime(values[0], format, tzinfo, locale)
+            )
+            self.assertEqual(
+                locale.format_datetimes(values, format, 'Asia/Kolkata'),
+                [locale.format_datetime(v, format, tzinfo) for v in values]
+            )
+        self.assertEqual(
+            locale.format_dates(values, 'long'),
+            [dates.format_date(v, 'long', locale) for v in values]
+        )
+        self.assertEqual(
+            locale.format_times(values, 'short', tzinfo),
+            [dates.format_time(v, 'short', tzinfo, locale) for v in values]
+        )
+        # A date is formatted as its midnight in UTC
+        day = datetime(2012, 12, 31).date()
+        self.assertEqual(
+            locale.format_datetime(day, 'medium', tzinfo),
+            dates.format_datetime(day, 'medium', tzinfo, locale)
+        )
+        self.assertEqual(
+            locale.format_datetimes([day], 'short', tzinfo),
+            [dates.format_datetime(day, 'short', tzinfo, locale)]
+        )
+
+    def test_0040_format_numbers(self):
+        """
+        Numbers formatted with the cached patterns match babel
+        """
+        from babel import numbers
+        from monstor.utils.locale import Locale
+        locale = Locale.parse('de_DE')
+        values = [0, 1099, -12345.678, 0.5]
+        self.assertEqual(
+            locale.format_decimals(values),
+            [numbers.format_decimal(v, locale=locale) for v in values]
+        )
+        self.assertEqual(
+            locale.format_decimals(values, '#,##0.00'),
+            [numbers.format_decimal(v, '#,##0.00', locale=locale)
+                for v in values]
+        )
+        self.assertEqual(
+            locale.format_currencies(values, 'EUR'),
+            [numbers.format_currency(v, 'EUR', locale=locale) for v in values]
+        )
+        self.assertEqual(
+            locale.format_percents(values),
+            [numbers.format_percent(v, locale=locale) for v in values]
+        )
+        self.assertEqual(locale.format_number(1099), u'1.099')
+
 
 class TestLocaleLoading(AsyncHTTPTestCase, unittest.TestCase):
 
@@ -82,5 +167,126 @@ class TestLocaleLoading(AsyncHTTPTestCase, unittest.TestCase):
         )
 
 
+class TestLocaleContext(AsyncHTTPTestCase, unittest.TestCase):
+
+    def get_app(self):
+        from monstor.utils import locale
+        locale.load_gettext_translations(pycountry.LOCALES_DIR, 'iso3166')
+        io_loop = self.io_loop
+
+        class DelayedTranslationHandler(BaseHandler):
+            @asynchronous
+            def get(self):
+                io_loop.add_timeout(
+                    time.time() + float(self.get_argument('delay')),
+                    self.async_callback(self.on_timeout)
+                )
+
+            def on_timeout(self):
+                self.finish(unicode(_("United States")))
+
+        return Application(
+            [('/delayed', DelayedTranslationHandler)],
+            cookie_secret="something_really_random"
+        )
+
+    def test_0010_interleaved_requests(self):
+        """
+        The locale of a request must not leak into the strings translated
+        by another request which is processed meanwhile
+        """
+        responses = {}
+
+        def callback(name):
+            def on_response(response):
+                responses[name] = response.body
+                if len(responses) == 2:
+                    self.stop()
+            return on_response
+
+        self.http_client.fetch(
+            self.get_url('/delayed?locale=pt&delay=0.2'), callback('pt')
+        )
+        self.http_client.fetch(
+            self.get_url('/delayed?locale=fr&delay=0.01'), callback('fr')
+        )
+        self.wait()
+        self.assertEqual(responses['pt'], u'Estados Unidos')
+        self.assertEqual(responses['fr'], '\xc3\x89tats-Unis')
+
+
+def write_catalog(directory, lang, translations):
+    """
+    Writes a compiled catalog with the given translations for the language
+    """
+    from babel.messages.catalog import Catalog
+    from babel.messages.mofile import write_mo
+    catalog = Catalog(locale=lang)
+    for message, translation in translations.iteritems():
+        catalog.add(message, translation)
+    path = os.path.join(directory, lang, 'LC_MESSAGES')
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    with open(os.path.join(path, 'messages.mo'), 'wb') as catalog_file:
+        write_mo(catalog_file, catalog)
+
+
+class TestTranslationsReload(AsyncTestCase, unittest.TestCase):
+
+    def setUp(self):
+        super(TestTranslationsReload, self).setUp()
+        from monstor.utils import locale
+        self.directory = tempfile.mkdtemp()
+        write_catalog(self.directory, 'de', {'Hello': u'Hallo'})
+        locale.load_gettext_translations(self.directory, 'messages')
+
+    def tearDown(self):
+        super(TestTranslationsReload, self).tearDown()
+        shutil.rmtree(self.directory)
+
+    def test_0010_watcher(self):
+        """
+        A changed catalog is reloaded and replaces the cached locale
+        """
+        from monstor.utils import locale
+        self.assertEqual(locale.get('de').translate('Hello'), u'Hallo')
+
+        watcher = locale.TranslationsWatcher(io_loop=self.io_loop)
+        watcher.start()
+        write_catalog(self.directory, 'de', {'Hello': u'Guten Tag'})
+        path = os.path.join(self.directory, 'de', 'LC_MESSAGES', 'messages.mo')
+        os.utime(path, (time.time() + 10, time.time() + 10))
+        watcher.check()
+        self.io_loop.add_timeout(time.time() + 0.2, self.stop)
+        self.wait()
+        watcher.stop()
+        self.assertEqual(locale.get('de').translate('Hello'), u'Guten Tag')
+
+    def test_0020_retry(self):
+        """
+        A catalog which fails to load is retried on the next check
+        """
+        from monstor.utils import locale
+        watcher = locale.TranslationsWatcher(io_loop=self.io_loop)
+        watcher.start()
+        path = os.path.join(self.directory, 'de', 'LC_MESSAGES', 'messages.mo')
+        mtime = time.time() + 10
+        with open(path, 'wb') as catalog_file:
+            catalog_file.write('half written')
+        os.utime(path, (mtime, mtime))
+        watcher.check()
+        self.io_loop.add_timeout(time.time() + 0.2, self.stop)
+        self.wait()
+        self.assertEqual(locale.get('de').translate('Hello'), u'Hallo')
+
+        write_catalog(self.directory, 'de', {'Hello': u'Guten Tag'})
+        os.utime(path, (mtime, mtime))
+        watcher.check()
+        self.io_loop.add_timeout(time.time() + 0.2, self.stop)
+        self.wait()
+        watcher.stop()
+        self.assertEqual(locale.get('de').translate('Hello'), u'Guten Tag')
+
+
 if __name__ == '__main__':
     unittest.main()
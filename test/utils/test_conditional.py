@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""
+    test_conditional
+
+    Test the conditional GET support of the BaseHandler
+
+    :copyright: (c) 2012 by Openlabs Technologies & Consulting (P) Limited
+    :license: BSD, see LICENSE for more details.
+"""
+from datetime import datetime
+import unittest
+from tornado.web import Application
+from tornado.testing import AsyncHTTPTestCase
+from monstor.utils.web import BaseHandler, conditional
+
+RENDER_COUNT = {'etag': 0, 'modified': 0}
+
+
+class TestConditional(AsyncHTTPTestCase, unittest.TestCase):
+
+    def get_app(self):
+
+        class ETagHandler(BaseHandler):
+            def get_etag(self, version):
+                return 'v%s' % version
+
+            @conditional
+            def get(self, version):
+                RENDER_COUNT['etag'] += 1
+                self.write("Version %s" % version)
+
+        class LastModifiedHandler(BaseHandler):
+            def get_last_modified(self):
+                return datetime(2012, 6, 1, 10, 0, 0)
+
+            @conditional
+            def get(self):
+                RENDER_COUNT['modified'] += 1
+                self.write("Modified page")
+
+        class FlashHandler(BaseHandler):
+            def get(self):
+                self.flash("Saved")
+
+        return Application(
+            [
+                (r'/flash', FlashHandler),
+                (r'/etag/(\d+)', ETagHandler),
+                (r'/modified', LastModifiedHandler),
+            ],
+            cookie_secret="something_really_random"
+        )
+
+    def setUp(self):
+        super(TestConditional, self).setUp()
+        RENDER_COUNT['etag'] = RENDER_COUNT['modified'] = 0
+
+    def test_0010_etag(self):
+        """
+        The handler validator is used as the etag and a matching
+        If-None-Match header is answered without rendering
+        """
+        rv = self.fetch('/etag/1')
+        self.assertEqual(rv.code, 200)
+        self.assertEqual(rv.headers['Etag'], '"v1"')
+        self.assertEqual(RENDER_COUNT['etag'], 1)
+
+        rv = self.fetch('/etag/1', headers={'If-None-Match': '"v1"'})
+        self.assertEqual(rv.code, 304)
+        self.assertEqual(RENDER_COUNT['etag'], 1)
+
+        rv = self.fetch('/etag/2', headers={'If-None-Match': '"v1"'})
+        self.assertEqual(rv.code, 200)
+        self.assertEqual(rv.body, 'Version 2')
+        self.assertEqual(RENDER_COUNT['etag'], 2)
+
+    def test_0020_last_modified(self):
+        """
+        If-Modified-Since is compared against the last modified time
+        """
+        rv = self.fetch('/modified')
+        self.assertEqual(rv.code, 200)
+        self.assertEqual(
+            rv.headers['Last-Modified'], 'Fri, 01 Jun 2012 10:00:00 GMT'
+        )
+
+        rv = self.fetch('/modified', headers={
+            'If-Modified-Since': 'Fri, 01 Jun 2012 10:00:00 GMT'
+        })
+        self.assertEqual(rv.code, 304)
+        self.assertEqual(RENDER_COUNT['modified'], 1)
+
+        rv = self.fetch('/modified', headers={
+            'If-Modified-Since': 'Thu, 31 May 2012 10:00:00 GMT'
+        })
+        self.assertEqual(rv.code, 200)
+        self.assertEqual(RENDER_COUNT['modified'], 2)
+
+    def test_0030_flash(self):
+        """
+        A page with pending flash messages is rendered without validators
+        """
+        rv = self.fetch('/flash')
+        cookie = rv.headers['Set-Cookie'].split(';')[0]
+        rv = self.fetch('/etag/1', headers={
+            'If-None-Match': '"v1"', 'Cookie': cookie
+        })
+        self.assertEqual(rv.code, 200)
+        self.assertNotEqual(rv.headers.get('Etag'), '"v1"')
+        self.assertEqual(RENDER_COUNT['etag'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
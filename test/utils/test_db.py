@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+    test_db
+
+    Test the database connection options and the read preferences
+
+    :copyright: (c) 2012 by Openlabs Technologies & Consulting (P) Limited
+    :license: BSD, see LICENSE for more details.
+"""
+import unittest2 as unittest
+
+from pymongo import ReadPreference
+from mongoengine import Document, IntField
+from mongoengine import connection
+from tornado.options import options
+
+from monstor.exc import InvalidRequestError
+from monstor.utils.db import connect_database, QuerySet, secondary_reads
+from monstor.utils.web import Pagination
+
+
+class ReadMostlyDocument(Document):
+    sequence = IntField()
+
+    meta = {'queryset_class': QuerySet}
+
+
+def cursor_read_preference(query_set):
+    return query_set._cursor._Cursor__read_preference
+
+
+class TestReadPreference(unittest.TestCase):
+    """Test the read preference of the queries"""
+
+    @classmethod
+    def setUpClass(cls):
+        options.database = 'test_db'
+        options.db_read_preference = 'secondary'
+        connect_database()
+
+    @classmethod
+    def tearDownClass(cls):
+        options.db_read_preference = 'primary'
+
+    def test_0010_primary(self):
+        "Queries read from the primary unless they opt in"
+        self.assertEqual(
+            cursor_read_preference(ReadMostlyDocument.objects()),
+            ReadPreference.PRIMARY
+        )
+
+    def test_0020_read_preference(self):
+        "The read preference is set per query and kept by clones"
+        query_set = ReadMostlyDocument.objects().read_preference(
+            'secondary_only'
+        )
+        self.assertEqual(
+            cursor_read_preference(query_set), ReadPreference.SECONDARY_ONLY
+        )
+        self.assertEqual(
+            cursor_read_preference(query_set.clone()),
+            ReadPreference.SECONDARY_ONLY
+        )
+
+    def test_0030_secondary_reads(self):
+        "secondary_reads uses the db_read_preference option"
+        query_set = ReadMostlyDocument.objects()
+        self.assertEqual(
+            cursor_read_preference(secondary_reads(query_set)),
+            ReadPreference.SECONDARY
+        )
+        # The query set given is left as it is
+        self.assertEqual(
+            cursor_read_preference(query_set), ReadPreference.PRIMARY
+        )
+
+    def test_0040_pagination(self):
+        "The pages of a pagination read with the same preference"
+        pagination = Pagination(1, 10, ReadMostlyDocument.objects())
+        self.assertEqual(
+            cursor_read_preference(pagination.next().items()),
+            ReadPreference.SECONDARY
+        )
+        pagination = Pagination(
+            1, 10, ReadMostlyDocument.objects(), read_preference='primary'
+        )
+        self.assertEqual(
+            cursor_read_preference(pagination.next().items()),
+            ReadPreference.PRIMARY
+        )
+
+    def test_0050_invalid_read_preference(self):
+        "An unknown read preference is reported when connecting"
+        options.db_read_preference = 'nearest'
+        try:
+            self.assertRaises(InvalidRequestError, connect_database)
+        finally:
+            options.db_read_preference = 'secondary'
+
+
+class TestConnection(unittest.TestCase):
+    """Test the options of the connection to the database"""
+
+    def setUp(self):
+        connection.disconnect()
+        options.database = 'test_db'
+
+    def tearDown(self):
+        options.db_max_pool_size = 10
+        options.db_connect_timeout = None
+        options.db_socket_timeout = None
+        options.db_replica_set = None
+        connection.disconnect()
+
+    def test_0010_options(self):
+        "The pool size and the timeouts are given to the connection"
+        options.db_max_pool_size = 3
+        options.db_connect_timeout = 2000
+        options.db_socket_timeout = 5000
+        db_connection = connect_database()
+        self.assertEqual(db_connection.max_pool_size, 3)
+        self.assertEqual(db_connection._Connection__conn_timeout, 2.0)
+        self.assertEqual(db_connection._Connection__net_timeout, 5.0)
+
+    def test_0020_replica_set(self):
+        "A replica set name opens a replica set connection"
+        options.db_replica_set = 'rs0'
+        # The test server is not a member of a replica set
+        self.assertRaises(connection.ConnectionError, connect_database)
+        self.assertEqual(
+            connection._connection_settings['default']['replicaSet'], 'rs0'
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""
+    test_messages
+
+    Test the incremental extraction and compilation of messages
+
+    :copyright: (c) 2012 by Openlabs Technologies & Consulting (P) Limited
+    :license: BSD, see LICENSE for more details.
+"""
+import os
+import time
+import shutil
+import tempfile
+import unittest
+
+from babel.messages.catalog import Catalog
+from babel.messages.pofile import read_po, write_po
+from monstor.utils.messages import extract_messages, compile_catalogs, \
+    read_installed_apps
+
+
+class TestMessages(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.templates = os.path.join(self.directory, 'templates')
+        os.mkdir(self.templates)
+        self.write_template('Welcome')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write_template(self, message):
+        with open(os.path.join(self.templates, 'home.html'), 'wb') as f:
+            f.write('<h1>{{ _("%s") }}</h1>\n' % message)
+
+    def test_0010_extract(self):
+        """
+        Messages are extracted from the apps and the templates and only the
+        changed files are extracted again
+        """
+        pot_file = os.path.join(self.directory, 'messages.pot')
+        files, changed = extract_messages(
+            ['monstor.contrib.auth'], pot_file, [self.templates], processes=1
+        )
+        self.assertEqual(files, changed)
+        with open(pot_file) as f:
+            catalog = read_po(f)
+        self.assertTrue('Welcome' in catalog)
+        self.assertTrue('Passwords must match' in catalog)
+
+        self.assertEqual(extract_messages(
+            ['monstor.contrib.auth'], pot_file, [self.templates], processes=1
+        ), (files, 0))
+
+        self.write_template('Welcome back')
+        self.assertEqual(extract_messages(
+            ['monstor.contrib.auth'], pot_file, [self.templates], processes=1
+        ), (files, 1))
+        with open(pot_file) as f:
+            catalog = read_po(f)
+        self.assertTrue('Welcome back' in catalog)
+        self.assertFalse('Welcome' in catalog)
+
+    def test_0020_compile(self):
+        """
+        Only the catalogs which changed are compiled
+        """
+        for lang in ('de', 'fr'):
+            os.makedirs(os.path.join(self.directory, lang, 'LC_MESSAGES'))
+            catalog = Catalog(locale=lang)
+            catalog.add('Welcome', lang)
+            with open(os.path.join(self.directory, lang, 'LC_MESSAGES',
+                    'messages.po'), 'wb') as f:
+                write_po(f, catalog)
+
+        self.assertEqual(len(compile_catalogs(self.directory)), 2)
+        self.assertEqual(compile_catalogs(self.directory), [])
+
+        po_file = os.path.join(
+            self.directory, 'de', 'LC_MESSAGES', 'messages.po'
+        )
+        os.utime(po_file, (time.time() + 10, time.time() + 10))
+        self.assertEqual(compile_catalogs(self.directory), [po_file])
+
+    def test_0030_installed_apps(self):
+        """
+        The installed apps are read from the settings of the project
+        """
+        application_py = os.path.join(self.directory, 'application.py')
+        with open(application_py, 'wb') as f:
+            f.write(
+                "import os\n"
+                "settings = {\n"
+                "    'installed_apps': ['monstor.contrib.auth', 'blog'],\n"
+                "    'template_path': os.path.join(os.getcwd(), 't'),\n"
+                "}\n"
+                "application = make_app(**settings)\n"
+            )
+        self.assertEqual(
+            read_installed_apps(application_py),
+            ['monstor.contrib.auth', 'blog']
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+    test_metrics
+
+    Test the request metrics and their exposition
+
+    :copyright: (c) 2012 by Openlabs Technologies & Consulting (P) Limited
+    :license: BSD, see LICENSE for more details.
+"""
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+from tornado.options import options
+from tornado.web import Application, HTTPError, asynchronous
+from tornado.testing import AsyncHTTPTestCase
+from monstor.utils import metrics
+from monstor.utils.web import BaseHandler, URLSpec
+
+
+class TestMetrics(AsyncHTTPTestCase, unittest.TestCase):
+
+    def get_app(self):
+
+        class PageHandler(BaseHandler):
+            def get(self):
+                with metrics.timed('mongo'):
+                    pass
+                self.write("Page")
+
+        class MissingHandler(BaseHandler):
+            def get(self):
+                raise HTTPError(404)
+
+        test = self
+
+        class PendingHandler(BaseHandler):
+            @asynchronous
+            def get(self):
+                # The client goes away before the request finishes
+                test.pending = self
+                self.request.connection.stream.close()
+
+        return Application([
+            URLSpec(r'/metrics', metrics.MetricsHandler),
+            URLSpec(r'/page', PageHandler, name='test.page'),
+            URLSpec(r'/missing', MissingHandler),
+            URLSpec(r'/pending', PendingHandler),
+        ])
+
+    def setUp(self):
+        super(TestMetrics, self).setUp()
+        metrics.registry = metrics.Metrics()
+        options.metrics = True
+
+    def tearDown(self):
+        options.metrics = False
+        super(TestMetrics, self).tearDown()
+
+    def test_0010_requests(self):
+        """
+        The requests are counted by URLSpec name and status
+        """
+        self.fetch('/page')
+        self.fetch('/page')
+        self.fetch('/missing')
+
+        registry = metrics.registry
+        self.assertEqual(registry.in_flight, 0)
+        self.assertEqual(registry.requests[('test.page', '200')], 2)
+        self.assertEqual(registry.requests[('MissingHandler', '404')], 1)
+        self.assertEqual(
+            registry.histograms[
+                ('request_duration_seconds', 'test.page')
+            ].count, 2
+        )
+        self.assertEqual(
+            registry.histograms[('request_smtp_seconds', 'test.page')].sum,
+            0.0
+        )
+
+    def test_0020_exposition(self):
+        """
+        The metrics are exposed in the text format
+        """
+        self.fetch('/page')
+        rv = self.fetch('/metrics')
+        self.assertEqual(rv.code, 200)
+        lines = rv.body.splitlines()
+        self.assertTrue('monstor_requests_in_flight 0' in lines)
+        self.assertTrue(
+            'monstor_requests_total{handler="test.page",status="200"} 1'
+            in lines
+        )
+        self.assertTrue(
+            'monstor_request_duration_seconds_bucket'
+            '{handler="test.page",le="+Inf"} 1' in lines
+        )
+        self.assertTrue(
+            'monstor_request_mongo_seconds_count{handler="test.page"} 1'
+            in lines
+        )
+
+    def test_0030_workers(self):
+        """
+        The metrics written by the workers to metrics_dir are merged
+        """
+        directory = tempfile.mkdtemp()
+        try:
+            worker = metrics.Metrics()
+            worker.requests[('test.page', '200')] = 5
+            worker.in_flight = 3
+            snapshot = worker.snapshot()
+            # A worker which is no longer running
+            snapshot['pid'] = 2 ** 22 + 1
+            with open(os.path.join(directory, 'worker.json'), 'wb') as f:
+                json.dump(snapshot, f)
+
+            self.fetch('/page')
+            snapshots = metrics.registry.collect(directory)
+            self.assertEqual(len(snapshots), 2)
+            self.assertTrue(
+                os.path.exists(os.path.join(directory, '%d.json' % os.getpid()))
+            )
+            in_flight, requests, histograms = metrics.merge(snapshots)
+            self.assertEqual(requests[('test.page', '200')], 6)
+            self.assertEqual(in_flight, 0)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_0040_connection_close(self):
+        """
+        A request whose client goes away is no longer in flight, and is not
+        counted twice if it is finished later
+        """
+        rv = self.fetch('/pending')
+        self.assertEqual(rv.code, 599)
+        self.assertEqual(metrics.registry.in_flight, 0)
+
+        # Writing to the closed stream fails before on_finish is called,
+        # which is then left to the handlers which catch the error
+        self.assertRaises(IOError, self.pending.finish)
+        metrics.registry.finish_request(
+            self.pending, self.pending.metrics_record
+        )
+        self.assertEqual(metrics.registry.in_flight, 0)
+        self.assertEqual(
+            metrics.registry.requests[('PendingHandler', '200')], 1
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+    test_queries
+
+    Test the query profiler
+
+    :copyright: (c) 2012 by Openlabs Technologies & Consulting (P) Limited
+    :license: BSD, see LICENSE for more details.
+"""
+import unittest
+
+from mongoengine import connect, Document, IntField
+from tornado.options import options
+from tornado.web import Application
+from tornado.testing import AsyncHTTPTestCase
+from monstor.utils import queries
+from monstor.utils.web import BaseHandler
+
+
+class ProfiledDocument(Document):
+    sequence = IntField()
+
+
+class TestQueryProfile(AsyncHTTPTestCase, unittest.TestCase):
+
+    def get_app(self):
+
+        class LoopHandler(BaseHandler):
+            def get(self):
+                for duration in xrange(7):
+                    self.query_profile.record(
+                        'find', 'test.user', '{"_id": "?"}', 0.001
+                    )
+                self.query_profile.record(
+                    'count', 'test.user', '{}', 0.001, False
+                )
+                self.write("Looped")
+
+        return Application([(r'/loop', LoopHandler)])
+
+    def setUp(self):
+        super(TestQueryProfile, self).setUp()
+        options.profile_queries = True
+        options.profile_queries_header = True
+
+    def tearDown(self):
+        options.profile_queries = False
+        options.profile_queries_header = False
+        super(TestQueryProfile, self).tearDown()
+
+    def test_0010_shape(self):
+        """
+        The values of the filter are left out of its shape
+        """
+        self.assertEqual(
+            queries.query_shape({'email': 'a@example.com'}),
+            queries.query_shape({'email': 'b@example.com'}),
+        )
+        self.assertEqual(
+            queries.query_shape({'$or': [{'a': 1}, {'b': {'$in': [1, 2]}}]}),
+            '{"$or": [{"a": "?"}, {"b": {"$in": "?"}}]}'
+        )
+
+    def test_0020_header(self):
+        """
+        The repeated and unindexed queries are sent in the header
+        """
+        rv = self.fetch('/loop')
+        self.assertEqual(rv.code, 200)
+        self.assertEqual(
+            rv.headers['X-Query-Profile'],
+            '8 queries in 8.0 ms; 7x find test.user {"_id": "?"}; '
+            'no index count test.user {}'
+        )
+
+
+class TestProfiler(unittest.TestCase):
+    """Test the profiling of the operations of pymongo"""
+
+    @classmethod
+    def setUpClass(cls):
+        connect("test_queries")
+        queries.install_profiler()
+
+    def setUp(self):
+        ProfiledDocument.drop_collection()
+        for sequence in xrange(10):
+            ProfiledDocument(sequence=sequence).save()
+
+    def test_0010_repeated(self):
+        "A query in a loop is reported as repeated"
+        profile = queries.QueryProfile()
+        with queries.profile_context(profile):
+            for sequence in xrange(10):
+                ProfiledDocument.objects(sequence=sequence).first()
+            ProfiledDocument.objects.count()
+        collection = ProfiledDocument._get_collection().full_name
+        self.assertEqual(
+            profile.repeated(5),
+            [(('find', collection, '{"sequence": "?"}'), 10)]
+        )
+        self.assertEqual(profile.queries[-1].operation, 'count')
+
+    def test_0020_writes(self):
+        "Writes are recorded with the shape of their filter"
+        profile = queries.QueryProfile()
+        with queries.profile_context(profile):
+            ProfiledDocument.objects(sequence=1).update(set__sequence=11)
+        self.assertEqual(
+            [(q.operation, q.shape) for q in profile.queries],
+            [('update', '{"sequence": "?"}')]
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+    test_slugify
+
+    Test the slugs and the allocation of unique slugs
+
+    :copyright: (c) 2012 by Openlabs Technologies & Consulting (P) Limited
+    :license: BSD, see LICENSE for more details.
+"""
+import unittest2 as unittest
+
+from mongoengine import connect, Document, StringField
+from monstor.utils.web import slugify, slugify_all, unique_slug
+
+
+class Article(Document):
+    slug = StringField(db_field='s')
+
+    meta = {'indexes': ['slug']}
+
+
+class TestSlugify(unittest.TestCase):
+
+    def test_0010_ascii(self):
+        """
+        The punctuation and the whitespace are replaced by the delimiter
+        """
+        self.assertEqual(
+            slugify(u"Monstor 0.1 released, faster\tstartup & more!"),
+            u'monstor-0-1-released-faster-startup-more'
+        )
+        self.assertEqual(slugify("Hello, World", u'_'), u'hello_world')
+        self.assertEqual(slugify(u" -- "), u'')
+
+    def test_0020_unicode(self):
+        """
+        The non-ASCII text is transliterated
+        """
+        self.assertEqual(slugify(u"Crème brûlée"), u'creme-brulee')
+        self.assertEqual(slugify(u"Crème brûlée"), u'creme-brulee')
+        self.assertEqual(slugify(u"東京", u'_'), u'Dong_Jing')
+
+    def test_0030_bulk(self):
+        """
+        The slugs are returned in the order of the texts
+        """
+        self.assertEqual(
+            slugify_all([u"Zürich", u"Hello World", u"Zürich"]),
+            [u'zurich', u'hello-world', u'zurich']
+        )
+
+
+class TestUniqueSlug(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        connect("test_slugify")
+
+    def setUp(self):
+        Article.drop_collection()
+
+    def test_0010_unique(self):
+        """
+        The lowest free number is appended to a taken slug
+        """
+        self.assertEqual(unique_slug(Article.objects, u"Hello"), u'hello')
+        for slug in (u'hello', u'hello-2', u'hello-4', u'hello-world'):
+            Article(slug=slug).save()
+        self.assertEqual(unique_slug(Article.objects, u"Hello"), u'hello-3')
+        self.assertEqual(
+            unique_slug(Article.objects, u"Hello World!"), u'hello-world-2'
+        )
+
+    def test_0020_query_set(self):
+        """
+        The query set given is left as it is
+        """
+        for slug in (u'hello', u'world'):
+            Article(slug=slug).save()
+        query_set = Article.objects
+        self.assertEqual(unique_slug(query_set, u"Hello"), u'hello-2')
+        self.assertEqual(query_set.count(), 2)
+        self.assertEqual(
+            sorted(article.slug for article in query_set),
+            [u'hello', u'world']
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+    test_stalls
+
+    Test the detection of the handlers blocking the IOLoop
+
+    :copyright: (c) 2012 by Openlabs Technologies & Consulting (P) Limited
+    :license: BSD, see LICENSE for more details.
+"""
+import time
+import socket
+import unittest
+
+import pymongo.cursor
+import pymongo.connection
+import tornado.web
+import tornado.ioloop
+from tornado.web import Application
+from tornado.testing import AsyncHTTPTestCase
+from monstor.utils import metrics, queries
+from monstor.utils.stalls import StallDetector, call_site
+from monstor.utils.web import BaseHandler, URLSpec
+
+
+def block(seconds):
+    end = time.time() + seconds
+    while time.time() < end:
+        pass
+
+
+class TestStallDetector(AsyncHTTPTestCase, unittest.TestCase):
+
+    def get_app(self):
+
+        class SlowHandler(BaseHandler):
+            def get(self):
+                block(0.35)
+                self.write("Slow")
+
+        class FastHandler(BaseHandler):
+            def get(self):
+                self.write("Fast")
+
+        return Application([
+            URLSpec(r'/slow', SlowHandler, name='test.slow'),
+            URLSpec(r'/fast', FastHandler, name='test.fast'),
+        ])
+
+    def setUp(self):
+        super(TestStallDetector, self).setUp()
+        self.detector = StallDetector(0.1, io_loop=self.io_loop)
+        self.detector.start()
+
+    def tearDown(self):
+        self.detector.stop()
+        super(TestStallDetector, self).tearDown()
+
+    def test_0010_report(self):
+        """
+        The blocking call site is reported with the handler it blocked
+        """
+        self.assertEqual(self.fetch('/fast').code, 200)
+        self.assertEqual(self.detector.report(), [])
+
+        self.assertEqual(self.fetch('/slow').code, 200)
+        site = self.detector.report()[0]
+        self.assertEqual(site.function, 'block')
+        self.assertTrue(site.samples >= 2)
+        self.assertEqual(
+            dict(site.handlers), {'SlowHandler (test.slow)': site.samples}
+        )
+
+
+class TestCallSite(unittest.TestCase):
+
+    def test_0010_call_site(self):
+        """
+        A blocking read of the database is attributed to the app code
+        which made the query
+        """
+        stack = [
+            ('/srv/blog/views.py', 12, 'get', 'articles = list(query)'),
+            (pymongo.connection.__file__, 700, '_receive_message', None),
+            (socket.__file__, 400, 'recv', None),
+        ]
+        self.assertEqual(call_site(stack), stack[0])
+        self.assertEqual(call_site(stack[1:]), stack[-1])
+
+    def test_0020_plumbing(self):
+        """
+        The frames of the request context of the handlers and of the
+        wrappers of pymongo are not attributed to
+        """
+        def source(function):
+            return function.func_code.co_filename
+
+        stack = [
+            (tornado.ioloop.__file__, 390, 'start', None),
+            (source(BaseHandler._execute), 216, '_execute', None),
+            (tornado.web.__file__, 1000, '_execute', None),
+            ('/srv/blog/views.py', 12, 'get', 'articles = list(query)'),
+            (source(queries._profile_refresh), 190, 'wrapper', None),
+            (pymongo.cursor.__file__, 700, '_refresh', None),
+            (source(metrics._timed_method), 148, 'wrapper', None),
+            (pymongo.connection.__file__, 700, '_send_message', None),
+            (socket.__file__, 400, 'recv', None),
+        ]
+        self.assertEqual(call_site(stack), stack[3])
+
+
+if __name__ == '__main__':
+    unittest.main()
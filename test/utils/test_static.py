@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+    test_static
+
+    Test the static asset pipeline
+
+    :copyright: (c) 2012 by Openlabs Technologies & Consulting (P) Limited
+    :license: BSD, see LICENSE for more details.
+"""
+import os
+import gzip
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+
+from tornado.web import Application, RequestHandler
+from tornado.testing import AsyncHTTPTestCase
+from monstor.utils.static import build_static, StaticManifest, \
+    StaticFileHandler
+
+CSS = "body { color: #333; }\n" * 50
+
+
+class TestStatic(AsyncHTTPTestCase, unittest.TestCase):
+
+    def get_app(self):
+        self.static_path = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.static_path, 'css'))
+        with open(os.path.join(self.static_path, 'css', 'site.css'), 'wb') \
+                as css_file:
+            css_file.write(CSS)
+        with open(os.path.join(self.static_path, 'logo.png'), 'wb') \
+                as png_file:
+            png_file.write('not really a png')
+        self.manifest = build_static(self.static_path)
+
+        class AssetHandler(RequestHandler):
+            def get(self):
+                self.write(self.static_url(self.get_argument('name')))
+
+        return Application(
+            [('/asset', AssetHandler)],
+            static_path=self.static_path,
+            static_manifest=StaticManifest.load(self.static_path),
+            static_handler_class=StaticFileHandler,
+        )
+
+    def tearDown(self):
+        super(TestStatic, self).tearDown()
+        shutil.rmtree(self.static_path)
+
+    def test_0010_build(self):
+        """
+        Assets are fingerprinted, compressed and a rebuild is stable
+        """
+        target = self.manifest.resolve('css/site.css')
+        self.assertNotEqual(target, 'css/site.css')
+        self.assertTrue(target in self.manifest.compressed)
+        self.assertFalse(
+            self.manifest.resolve('logo.png') in self.manifest.compressed
+        )
+        self.assertTrue(
+            os.path.exists(os.path.join(self.static_path, target + '.gz'))
+        )
+        rebuilt = build_static(self.static_path)
+        self.assertEqual(rebuilt.assets, self.manifest.assets)
+
+    def test_0015_rebuild(self):
+        """
+        The files of the earlier builds are not fingerprinted again
+        """
+        css_path = os.path.join(self.static_path, 'css', 'site.css')
+        for version in (1, 2):
+            with open(css_path, 'wb') as css_file:
+                css_file.write(CSS * (version + 1))
+            manifest = build_static(self.static_path)
+        self.assertEqual(
+            sorted(manifest.assets), ['css/site.css', 'logo.png']
+        )
+        names = os.listdir(os.path.join(self.static_path, 'css'))
+        self.assertEqual(len(names), 7)
+        self.assertTrue(manifest.resolve('css/site.css')[4:] in names)
+
+    def test_0020_serve(self):
+        """
+        static_url resolves through the manifest and the fingerprinted
+        assets are served with far future cache headers
+        """
+        url = self.fetch('/asset?name=css/site.css').body
+        self.assertEqual(
+            url, '/static/' + self.manifest.resolve('css/site.css')
+        )
+
+        rv = self.fetch(url, use_gzip=False)
+        self.assertEqual(rv.code, 200)
+        self.assertEqual(rv.body, CSS)
+        self.assertTrue('max-age' in rv.headers['Cache-Control'])
+        self.assertEqual(rv.headers['Content-Type'], 'text/css')
+
+        rv = self.fetch(url, headers={'Accept-Encoding': 'gzip'},
+            use_gzip=False)
+        self.assertEqual(rv.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.GzipFile(fileobj=StringIO(rv.body)).read(), CSS)
+
+        rv = self.fetch(url, headers={'If-None-Match': rv.headers['Etag']})
+        self.assertEqual(rv.code, 304)
+
+
+if __name__ == '__main__':
+    unittest.main()
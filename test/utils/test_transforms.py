@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+    test_transforms
+
+    Test the compression of responses
+
+    :copyright: (c) 2012 by Openlabs Technologies & Consulting (P) Limited
+    :license: BSD, see LICENSE for more details.
+"""
+import unittest
+from tornado.options import options
+from tornado.web import Application, RequestHandler, ChunkedTransferEncoding
+from tornado.testing import AsyncHTTPTestCase
+from monstor.utils.transforms import CompressionTransform
+
+BODY = "<html>%s</html>" % ("Monstor " * 200)
+
+
+class TestCompression(AsyncHTTPTestCase, unittest.TestCase):
+
+    def get_app(self):
+
+        class PageHandler(RequestHandler):
+            def get(self):
+                self.write(BODY)
+
+        class SmallHandler(RequestHandler):
+            def get(self):
+                self.write("tiny")
+
+        class ImageHandler(RequestHandler):
+            def get(self):
+                self.set_header("Content-Type", "image/png")
+                self.write(BODY)
+
+        class LocalizedHandler(RequestHandler):
+            def get(self):
+                self.set_header("Vary", "Accept-Language")
+                self.write(BODY)
+
+        class NotModifiedHandler(RequestHandler):
+            def get(self):
+                self.set_status(304)
+
+        return Application(
+            [
+                ('/page', PageHandler),
+                ('/localized', LocalizedHandler),
+                ('/not-modified', NotModifiedHandler),
+                ('/small', SmallHandler),
+                ('/image', ImageHandler),
+            ],
+            transforms=[CompressionTransform, ChunkedTransferEncoding]
+        )
+
+    def setUp(self):
+        super(TestCompression, self).setUp()
+        CompressionTransform.cache = None
+        options.compress_cache_size = 8
+
+    def tearDown(self):
+        options.compress_cache_size = 64
+        super(TestCompression, self).tearDown()
+
+    def test_0010_compress(self):
+        """
+        Compressible responses are gzipped and the body is cached
+        """
+        rv = self.fetch('/page', use_gzip=True)
+        self.assertEqual(rv.code, 200)
+        self.assertEqual(rv.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(rv.headers['Vary'], 'Accept-Encoding')
+        self.assertEqual(rv.body, BODY)
+        self.assertEqual(len(CompressionTransform.cache), 1)
+        # The cache is sized from the options when it is first used
+        self.assertEqual(CompressionTransform.cache.size, 8)
+
+        rv = self.fetch('/page', use_gzip=True)
+        self.assertEqual(rv.body, BODY)
+        self.assertEqual(CompressionTransform.cache.hits, 1)
+
+    def test_0020_no_compress(self):
+        """
+        Small bodies, other content types and clients which do not accept
+        gzip get the response as is
+        """
+        rv = self.fetch('/small', use_gzip=True)
+        self.assertFalse('Content-Encoding' in rv.headers)
+        self.assertEqual(rv.body, 'tiny')
+
+        rv = self.fetch('/image', use_gzip=True)
+        self.assertFalse('Content-Encoding' in rv.headers)
+
+        rv = self.fetch('/page', use_gzip=False)
+        self.assertFalse('Content-Encoding' in rv.headers)
+        self.assertEqual(rv.body, BODY)
+
+    def test_0030_vary(self):
+        """
+        Accept-Encoding is added to the Vary header of the handler
+        """
+        rv = self.fetch('/localized', use_gzip=True)
+        self.assertEqual(
+            rv.headers['Vary'], 'Accept-Language, Accept-Encoding'
+        )
+
+    def test_0040_empty(self):
+        """
+        Responses without a body are not compressed whatever the minimum
+        length
+        """
+        options.compress_min_length = 0
+        try:
+            rv = self.fetch('/not-modified', use_gzip=True)
+        finally:
+            options.compress_min_length = 256
+        self.assertEqual(rv.code, 304)
+        self.assertFalse('Content-Encoding' in rv.headers)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+    test_wtforms
+
+    Test the WTForms wrapper of the request arguments
+
+    :copyright: (c) 2012 by Openlabs Technologies & Consulting (P) Limited
+    :license: BSD, see LICENSE for more details.
+"""
+import json
+import unittest
+from urllib import urlencode
+
+from tornado.web import Application
+from tornado.testing import AsyncHTTPTestCase
+from wtforms import Form, TextField, IntegerField, BooleanField
+from monstor.utils.web import BaseHandler
+from monstor.utils.wtforms import TornadoMultiDict
+
+DECODED = []
+
+
+class ProfileForm(Form):
+    name = TextField()
+    age = IntegerField()
+    newsletter = BooleanField()
+    tags = TextField()
+
+
+class ProfileHandler(BaseHandler):
+
+    def decode_argument(self, value, name=None):
+        DECODED.append(name)
+        return super(ProfileHandler, self).decode_argument(value, name)
+
+    def post(self):
+        form = ProfileForm(TornadoMultiDict(self))
+        # A second form reads the arguments already decoded
+        form = ProfileForm(TornadoMultiDict(self))
+        self.write({
+            'name': form.name.data, 'age': form.age.data,
+            'newsletter': form.newsletter.data,
+            'tags': TornadoMultiDict(self).getlist('tags'),
+        })
+
+
+class TestTornadoMultiDict(AsyncHTTPTestCase, unittest.TestCase):
+
+    def get_app(self):
+        return Application([(r'/profile', ProfileHandler)])
+
+    def setUp(self):
+        super(TestTornadoMultiDict, self).setUp()
+        del DECODED[:]
+
+    def test_0010_form(self):
+        """
+        Each argument is decoded once
+        """
+        response = self.fetch('/profile', method='POST', body=urlencode([
+            ('name', 'Jane'), ('age', '42'), ('newsletter', 'y'),
+            ('tags', 'a'), ('tags', 'b'),
+        ]))
+        self.assertEqual(json.loads(response.body), {
+            'name': 'Jane', 'age': 42, 'newsletter': True,
+            'tags': ['a', 'b'],
+        })
+        self.assertEqual(
+            sorted(DECODED), ['age', 'name', 'newsletter', 'tags', 'tags']
+        )
+
+    def test_0020_json(self):
+        """
+        A JSON body is read as the arguments
+        """
+        response = self.fetch(
+            '/profile?tags=a', method='POST',
+            headers={'Content-Type': 'application/json; charset=UTF-8'},
+            body=json.dumps({
+                'name': u'Zoë', 'age': 42, 'newsletter': False,
+                'tags': ['b', 'c'],
+            })
+        )
+        self.assertEqual(json.loads(response.body), {
+            'name': u'Zoë', 'age': 42, 'newsletter': False,
+            'tags': ['a', 'b', 'c'],
+        })
+
+    def test_0030_invalid_json(self):
+        """
+        A body which is not a JSON object is a bad request
+        """
+        for body in ('{"name": ', '["name"]'):
+            response = self.fetch(
+                '/profile', method='POST', body=body,
+                headers={'Content-Type': 'application/json'},
+            )
+            self.assertEqual(response.code, 400)
+
+
+if __name__ == '__main__':
+    unittest.main()